@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""AsyncBadgrLite: asyncio flavor of BadgrLite for ASGI services
+
+Requires the optional `aiohttp` dependency:
+
+    pip install badgr-lite[async]
+"""
+
+import asyncio
+import json
+from typing import Optional, Tuple
+
+from badgr_lite import exceptions
+from .models import (BASE_URL, Badge, TokenFileMixin,
+                     validate_award_result)
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None  # type: ignore
+
+# asyncio.get_running_loop is new in Python 3.7
+_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+def _next_url(response) -> Optional[str]:
+    """URL of the next page linked from response, or None"""
+
+    link = response.links.get('next')
+    return None if link is None else str(link['url'])
+
+
+async def _in_thread(func, *args):
+    """Run blocking func (file I/O, locks) off the event loop"""
+
+    return await _running_loop().run_in_executor(None, func, *args)
+
+
+class AsyncBadgrLite(TokenFileMixin):
+    """Automate using Badgr API from an asyncio event loop
+
+    Mirrors BadgrLite: `badges()`, `award_badge()` and `refresh_token()` are
+    coroutines returning the same `Badge` objects and raising the same
+    `exceptions`.
+
+    Each client keeps one aiohttp connection pool (at most `limit`
+    connections) and a semaphore allowing at most `max_concurrency` requests
+    in flight, so thousands of awards can be gathered from one event loop:
+
+    >>> async with AsyncBadgrLite(token_filename='./token.json') as badgr:
+    ...     badges = await asyncio.gather(*[
+    ...         badgr.award_badge(badge_id, badge_data)
+    ...         for badge_data in all_badge_data])
+
+    A caller-supplied aiohttp `session` is used as is and not closed.
+    """
+
+    def __init__(self, token_filename: str, session=None,
+                 max_concurrency: int = 20, limit: int = 20,
+                 token_cache: bool = True, base_url: str = BASE_URL) -> None:
+        if aiohttp is None:
+            raise ImportError(
+                "AsyncBadgrLite requires aiohttp: "
+                "pip install badgr-lite[async]")
+        super().__init__(token_filename, token_cache, base_url)
+        self._session = session
+        self._owns_session = session is None
+        self._limit = limit
+        self._max_concurrency = max_concurrency
+        # Created lazily so they bind to the running event loop
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._refresh_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def session(self) -> 'aiohttp.ClientSession':
+        """Connection-pooled session, created on first use"""
+
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._limit))
+        return self._session
+
+    async def close(self) -> None:
+        """Release pooled connections if the session is owned by us"""
+
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self) -> 'AsyncBadgrLite':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def _load_token(self) -> None:
+        """Load the token file off the event loop (see load_token)"""
+
+        await _in_thread(self.load_token)
+
+    async def refresh_token(self,
+                            stale_access_token: Optional[str] = None) -> None:
+        """Refresh access token from refresh_token
+
+        Single-flight like BadgrLite.refresh_token: concurrent coroutines
+        that saw a 401 for the same `stale_access_token` wait for one
+        refresh, and other processes sharing the token file are coordinated
+        through its advisory lock. Token file I/O happens off the event
+        loop.
+        """
+
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+
+        async with self._refresh_lock:
+            if stale_access_token is None:
+                stale_access_token = self._token_data['access_token']
+            if not self._is_stale(stale_access_token):
+                return
+
+            lock_handler = await _in_thread(self._lock_token_file)
+            try:
+                await self._load_token()
+                if not self._is_stale(stale_access_token):
+                    return
+
+                async with self.session.post(
+                        self.token_url,
+                        data=self._refresh_data()) as response:
+                    if response.status == 401:
+                        raise exceptions.TokenAndRefreshExpiredError
+                    if response.status != 200:
+                        raise exceptions.ServerError(response.status,
+                                                     self.token_url)
+                    raw_data = json.loads(await response.read())
+                await _in_thread(self._store_token, raw_data)
+            finally:
+                await _in_thread(self._unlock_token_file, lock_handler)
+
+    async def _request(self, method: str, url: str,
+                       **kwargs) -> Tuple[int, bytes, Optional[str]]:
+        """Send request over the pooled session
+
+        Return the status, the body and the URL of the next page (from the
+        `Link: <...>; rel="next"` header), or None. If the server answers
+        401, refresh the token once and try again.
+        """
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        async with self._semaphore:
+            access_token = self._token_data['access_token']
+            async with self.session.request(
+                    method, url, headers=self.prepare_headers(),
+                    **kwargs) as response:
+                status, body = response.status, await response.read()
+                next_url = _next_url(response)
+
+            if status == 401:
+                await self.refresh_token(stale_access_token=access_token)
+                async with self.session.request(
+                        method, url, headers=self.prepare_headers(),
+                        **kwargs) as response:
+                    status, body = response.status, await response.read()
+                    next_url = _next_url(response)
+                if status == 401:
+                    raise exceptions.TokenAndRefreshExpiredError
+        return status, body, next_url
+
+    async def get_from_server(self, url: str) -> dict:
+        """Communicate with the server"""
+
+        return (await self._get_page(url))[0]
+
+    async def _get_page(self, url: str) -> Tuple[dict, Optional[str]]:
+        """GET one page of a listing, return it and the next page URL"""
+
+        status, body, next_url = await self._request('GET', url)
+        if status != 200:
+            raise exceptions.ServerError(status, url)
+        return json.loads(body), next_url
+
+    async def badges(self) -> list:
+        """Get list of badges from Server, following pagination
+
+        Example:
+
+        >>> async with AsyncBadgrLite(token_filename='./token.json') as badgr:
+        ...     for badge in await badgr.badges():
+        ...         print(badge)
+        """
+        await self._load_token()
+        badges: list = []
+        url: Optional[str] = '{}/badgeclasses'.format(self.api_url)
+        while url is not None:
+            page, url = await self._get_page(url)
+            badges.extend(Badge(b) for b in page['result'])
+        return badges
+
+    async def award_badge(self, badge_id: str, badge_data: dict) -> Badge:
+        """Given a previously created badge_id and badge_data, award badge
+
+        See BadgrLite.award_badge.
+        """
+
+        await self._load_token()
+        url = '{}/badgeclasses/{}/assertions'.format(self.api_url, badge_id)
+        status, body, _ = await self._request('POST', url, json=badge_data)
+
+        data = json.loads(body) if status in (400, 201) else None
+        validate_award_result(status, data)
+        assert data is not None
+        return Badge(data['result'][0])
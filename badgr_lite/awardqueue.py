@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=R0902, R0913
+"""Durable local queue of awards, drained by a pool of workers
+
+Request handlers `enqueue` awards and return at once; `badgr queue worker`
+(QueueWorker) awards them later with BadgrLite. Example:
+
+>>> queue = AwardQueue.beside('./token.json')
+>>> job_id = queue.enqueue('2TfNNqMLT8CoAhfGKqSv6Q',
+...                        {"recipient": {"identity": "joe@example.com"}})
+>>> queue.status()
+{'pending': 1, 'leased': 0, 'done': 0, 'failed': 0}
+
+Jobs live in a SQLite database (WAL mode), so they survive the processes
+enqueueing and awarding them. Enqueues from concurrent threads are
+group-committed: one writer thread commits everything enqueued while the
+previous commit ran in a single transaction.
+
+Workers lease jobs for `visibility_timeout` seconds. A job whose worker
+died is leased again once its lease expires, so an award may be sent
+twice; give the worker an AwardIndex (`badgr queue worker --dedup`) to
+skip awards already issued.
+"""
+
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import (Callable, Dict, Iterable, Iterator, List, Optional,
+                    Tuple, Union)
+
+from badgr_lite import exceptions
+from .models import Badge, BadgrLite
+from .retry import RetryPolicy
+
+STATES = ('pending', 'leased', 'done', 'failed')
+
+# Errors that fail a job at once: awarding it again cannot succeed
+PERMANENT_ERRORS = (exceptions.BadBadgeIdError,
+                    exceptions.AwardBadgeBadDataError,
+                    exceptions.RequiredAttributesMissingError)
+
+
+class Job:
+    """Leased award: what to award and the lease that must be answered"""
+    # A record; pylint: disable=R0903
+
+    def __init__(self, job_id: str, badge_id: str, badge_data: dict,
+                 attempts: int, lease: str) -> None:
+        self.job_id = job_id
+        self.badge_id = badge_id
+        self.badge_data = badge_data
+        self.attempts = attempts
+        self.lease = lease
+
+    def __repr__(self) -> str:
+        return 'Job({!r}, {!r}, attempts={})'.format(
+            self.job_id, self.badge_id, self.attempts)
+
+
+class AwardQueue:
+    """SQLite queue of awards shared by processes and threads
+
+    Jobs move from pending to leased (by `lease`), then to done
+    (`complete`), back to pending (`retry`) or to failed (`fail`). A leased
+    job whose lease expires is pending again.
+
+    `enqueue(wait=True)` returns once the job is committed. With
+    `wait=False` it returns immediately and the job is committed by the
+    writer thread shortly after; `flush` or `close` waits for that. Once a
+    commit failed, its error is raised by every later `enqueue`, `flush`
+    and `close`: the jobs still waiting are not committed.
+    Commits survive the process dying; with `fsync=True` they also survive
+    the machine crashing, at the cost of an fsync per commit.
+    """
+
+    FILENAME = 'award-queue.sqlite3'
+
+    def __init__(self, filename: str, fsync: bool = False) -> None:
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            filename, timeout=30, isolation_level=None,
+            check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous={}'.format(
+            'FULL' if fsync else 'NORMAL'))
+        with self._transaction():
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                ' seq INTEGER PRIMARY KEY,'
+                ' id TEXT NOT NULL UNIQUE,'
+                ' badge_id TEXT NOT NULL,'
+                ' badge_data TEXT NOT NULL,'
+                " state TEXT NOT NULL DEFAULT 'pending',"
+                ' attempts INTEGER NOT NULL DEFAULT 0,'
+                ' lease TEXT,'
+                ' available_at REAL NOT NULL,'
+                ' enqueued_at REAL NOT NULL,'
+                ' finished_at REAL,'
+                ' result TEXT)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS jobs_ready ON jobs'
+                " (available_at) WHERE state IN ('pending', 'leased')")
+
+        # Group commit of enqueued jobs
+        self._pending: List[tuple] = []
+        self._enqueued = 0
+        self._committed = 0
+        self._commit_error: Optional[BaseException] = None
+        self._closing = False
+        self._writer: Optional[threading.Thread] = None
+        self._condition = threading.Condition()
+
+    @classmethod
+    def beside(cls, token_filename: str, **options) -> 'AwardQueue':
+        """Return queue kept in the directory of token_filename"""
+
+        directory = os.path.dirname(os.path.abspath(token_filename))
+        return cls(os.path.join(directory, cls.FILENAME), **options)
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[None]:
+        """Run statements of the with block in one transaction
+
+        BEGIN IMMEDIATE takes the write lock up front, so that concurrent
+        processes cannot lease the same job.
+        """
+
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+
+    def enqueue(self, badge_id: str, badge_data: dict,
+                wait: bool = True) -> str:
+        """Queue award of badge_id with badge_data, return job id"""
+
+        return self.enqueue_many([(badge_id, badge_data)], wait)[0]
+
+    def enqueue_many(self, awards: Iterable[Tuple[str, dict]],
+                     wait: bool = True) -> List[str]:
+        """Queue many awards at once, return their job ids"""
+
+        now = time.time()
+        rows = [(os.urandom(8).hex(), badge_id, json.dumps(badge_data), now,
+                 now) for badge_id, badge_data in awards]
+        with self._condition:
+            if self._closing:
+                raise ValueError('AwardQueue is closed')
+            if self._commit_error is not None:
+                # The writer stopped: these jobs would never be committed
+                raise self._commit_error
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write,
+                                                daemon=True)
+                self._writer.start()
+            self._pending.extend(rows)
+            self._enqueued += len(rows)
+            ticket = self._enqueued
+            self._condition.notify_all()
+            if wait:
+                self._wait_for(ticket)
+        return [row[0] for row in rows]
+
+    def flush(self) -> None:
+        """Wait until every job enqueued so far is committed"""
+
+        with self._condition:
+            self._wait_for(self._enqueued)
+
+    def _wait_for(self, ticket: int) -> None:
+        """Wait (holding the condition) until ticket jobs are committed"""
+
+        while self._committed < ticket and self._commit_error is None:
+            self._condition.wait()
+        if self._commit_error is not None:
+            raise self._commit_error
+
+    def _write(self) -> None:
+        """Commit enqueued jobs, all those waiting in one transaction"""
+
+        while True:
+            with self._condition:
+                while not self._pending and not self._closing:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                rows, self._pending = self._pending, []
+                ticket = self._enqueued
+            try:
+                with self._transaction():
+                    self._connection.executemany(
+                        'INSERT INTO jobs (id, badge_id, badge_data,'
+                        ' available_at, enqueued_at) VALUES (?, ?, ?, ?, ?)',
+                        rows)
+            except BaseException as error:  # pylint: disable=W0703
+                with self._condition:
+                    self._commit_error = error
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                self._committed = ticket
+                self._condition.notify_all()
+
+    def lease(self, count: int, visibility_timeout: float = 60.0
+              ) -> List[Job]:
+        """Lease up to count jobs for visibility_timeout seconds
+
+        Pending jobs and jobs whose lease expired are leased, oldest first.
+        """
+
+        now = time.time()
+        lease = os.urandom(8).hex()
+        with self._transaction():
+            rows = self._connection.execute(
+                'SELECT seq, id, badge_id, badge_data, attempts FROM jobs'
+                " WHERE state IN ('pending', 'leased') AND available_at <= ?"
+                ' ORDER BY available_at LIMIT ?', (now, count)).fetchall()
+            self._connection.executemany(
+                "UPDATE jobs SET state = 'leased', lease = ?,"
+                ' attempts = attempts + 1, available_at = ? WHERE seq = ?',
+                [(lease, now + visibility_timeout, row[0]) for row in rows])
+        return [Job(job_id, badge_id, json.loads(badge_data), attempts + 1,
+                    lease)
+                for _, job_id, badge_id, badge_data, attempts in rows]
+
+    def complete(self, job: Job, assertion: dict) -> None:
+        """Record job as done with the assertion awarded"""
+
+        with self._transaction():
+            self._connection.execute(
+                "UPDATE jobs SET state = 'done', lease = NULL,"
+                ' finished_at = ?, result = ? WHERE id = ?',
+                (time.time(), json.dumps(assertion), job.job_id))
+
+    def retry(self, job: Job, delay: float, error: BaseException) -> None:
+        """Make job pending again in delay seconds, unless re-leased"""
+
+        with self._transaction():
+            self._connection.execute(
+                "UPDATE jobs SET state = 'pending', lease = NULL,"
+                ' available_at = ?, result = ?'
+                " WHERE id = ? AND lease = ? AND state = 'leased'",
+                (time.time() + delay, _describe(error), job.job_id,
+                 job.lease))
+
+    def fail(self, job: Job, error: BaseException) -> None:
+        """Give up on job, unless re-leased"""
+
+        with self._transaction():
+            self._connection.execute(
+                "UPDATE jobs SET state = 'failed', lease = NULL,"
+                ' finished_at = ?, result = ?'
+                " WHERE id = ? AND lease = ? AND state = 'leased'",
+                (time.time(), _describe(error), job.job_id, job.lease))
+
+    def status(self) -> Dict[str, int]:
+        """Return number of jobs in each state
+
+        Leased jobs whose lease expired count as pending.
+        """
+
+        counts = dict.fromkeys(STATES, 0)
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT CASE WHEN state = 'leased' AND available_at <= ?"
+                " THEN 'pending' ELSE state END, COUNT(*) FROM jobs"
+                ' GROUP BY 1', (time.time(),)).fetchall()
+        counts.update(rows)
+        return counts
+
+    def jobs(self, state: str, limit: int = 100) -> List[dict]:
+        """Return oldest jobs in state, with their last result or error"""
+
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT id, badge_id, badge_data, attempts, enqueued_at,'
+                ' finished_at, result FROM jobs WHERE state = ?'
+                ' ORDER BY seq LIMIT ?', (state, limit)).fetchall()
+        return [{'id': job_id, 'badge_id': badge_id,
+                 'badge_data': json.loads(badge_data), 'attempts': attempts,
+                 'enqueued_at': enqueued_at, 'finished_at': finished_at,
+                 'result': json.loads(result) if result else None}
+                for job_id, badge_id, badge_data, attempts, enqueued_at,
+                finished_at, result in rows]
+
+    def purge(self, state: str = 'done') -> int:
+        """Delete jobs in state (done by default), return their number"""
+
+        with self._transaction():
+            return self._connection.execute(
+                'DELETE FROM jobs WHERE state = ?', (state,)).rowcount
+
+    def close(self) -> None:
+        """Commit jobs still enqueued, then close the database
+
+        Raises the error of a failed commit, if any.
+        """
+
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        if self._writer is not None:
+            self._writer.join()
+        with self._lock:
+            self._connection.close()
+        if self._commit_error is not None:
+            raise self._commit_error
+
+
+def _describe(error: BaseException) -> str:
+    """Return error as JSON recorded in place of a job's result"""
+
+    return json.dumps({'error': type(error).__name__,
+                       'args': [str(arg) for arg in error.args]})
+
+
+class QueueWorker:
+    """Drain an AwardQueue with `concurrency` awards in flight
+
+    Each job is awarded with `badgr.award_badge` on a pool of threads
+    sharing the session. Jobs failing with one of PERMANENT_ERRORS fail at
+    once; other failures are retried after `retry_policy.backoff` until
+    `retry_policy.max_attempts` attempts were made. `on_result(job,
+    outcome)` is called from worker threads with the awarded Badge or the
+    exception raised.
+    """
+
+    def __init__(self, queue: AwardQueue, badgr: BadgrLite,
+                 concurrency: int = 8, visibility_timeout: float = 60.0,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 poll_interval: float = 0.5,
+                 on_result: Optional[Callable] = None) -> None:
+        self.queue = queue
+        self.badgr = badgr
+        self.concurrency = concurrency
+        self.visibility_timeout = visibility_timeout
+        self.retry_policy = retry_policy or RetryPolicy(
+            max_attempts=5, backoff_base=1.0, backoff_cap=300.0)
+        self.poll_interval = poll_interval
+        self.on_result = on_result
+        self.counts = {'done': 0, 'retried': 0, 'failed': 0}
+        self._counts_lock = threading.Lock()
+
+    def _count(self, outcome: str) -> None:
+        with self._counts_lock:
+            self.counts[outcome] += 1
+
+    def process(self, job: Job) -> None:
+        """Award job and record the outcome in the queue"""
+
+        outcome: Union[Badge, BaseException]
+        try:
+            result = self.badgr.award_badge(job.badge_id, job.badge_data)
+        except BaseException as error:  # pylint: disable=W0703
+            if isinstance(error, PERMANENT_ERRORS) or \
+                    job.attempts >= self.retry_policy.max_attempts:
+                self.queue.fail(job, error)
+                self._count('failed')
+            else:
+                self.queue.retry(
+                    job, self.retry_policy.backoff(job.attempts - 1), error)
+                self._count('retried')
+            outcome = error
+        else:
+            self.queue.complete(job, result.to_dict())
+            self._count('done')
+            outcome = result
+        if self.on_result is not None:
+            self.on_result(job, outcome)
+
+    def run(self, drain: bool = False,
+            stop: Optional[threading.Event] = None) -> Dict[str, int]:
+        """Award jobs until stop is set, or until none is left if drain
+
+        Jobs retried later (after a backoff) do not keep a draining worker
+        running. Returns the number of jobs done, retried and failed.
+        """
+        from concurrent.futures import (FIRST_COMPLETED, ThreadPoolExecutor,
+                                        wait)
+
+        stop = stop or threading.Event()
+        self.badgr.load_token()
+        in_flight: set = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            try:
+                while not stop.is_set():
+                    free = self.concurrency - len(in_flight)
+                    jobs = self.queue.lease(
+                        free, self.visibility_timeout) if free else []
+                    in_flight.update(executor.submit(self.process, job)
+                                     for job in jobs)
+                    if not in_flight:
+                        if drain:
+                            break
+                        stop.wait(self.poll_interval)
+                        continue
+                    done, in_flight = wait(
+                        in_flight, timeout=self.poll_interval,
+                        return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+            finally:
+                # Leased jobs not started yet are leased again later
+                for future in in_flight:
+                    future.cancel()
+        return dict(self.counts)
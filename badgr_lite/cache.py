@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+"""On-disk cache of API listings revalidated with ETag/Last-Modified"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Optional
+
+
+def default_cache_dir() -> str:
+    """Return directory used by the CLI for the response cache
+
+    $BADGR_CACHE_DIR if set, else badgr-lite under $XDG_CACHE_HOME
+    (~/.cache by default).
+    """
+
+    if os.environ.get('BADGR_CACHE_DIR'):
+        return os.environ['BADGR_CACHE_DIR']
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'badgr-lite')
+
+
+class CacheEntry:
+    """Stored response body with its validators and next-page URL"""
+    # A record; pylint: disable=R0903
+
+    def __init__(self, body: bytes, etag: Optional[str] = None,
+                 last_modified: Optional[str] = None,
+                 next_url: Optional[str] = None,
+                 validated_at: Optional[float] = None) -> None:
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.next_url = next_url
+        self.validated_at = time.time() if validated_at is None \
+            else validated_at
+
+    def conditional_headers(self) -> dict:
+        """Headers turning a GET into a conditional GET for this entry"""
+
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """Persistent cache of GET responses, keyed by URL and account
+
+    Stored responses are revalidated with a conditional GET (If-None-Match
+    / If-Modified-Since); on 304 Not Modified the local copy is used, so a
+    repeated listing costs one small request instead of a full payload.
+
+    - `ttl`: seconds after a (re)validation during which an entry is used
+      without asking the server at all (0, the default, always
+      revalidates).
+    - `max_entries`: bound on stored entries; the least recently validated
+      are evicted first.
+    - `refresh`: ignore stored entries (but still store fresh responses).
+
+    Entries are written atomically, so one cache directory may be shared
+    by threads and processes. An entry's modification time is the time it
+    was last validated: a revalidation only touches the file.
+    """
+
+    def __init__(self, directory: str, ttl: float = 0,
+                 max_entries: int = 256, refresh: bool = False) -> None:
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.refresh = refresh
+        os.makedirs(directory, exist_ok=True)
+        # Number of stored entries, counted on first put and then tracked
+        self._entries: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(url: str, account: str) -> str:
+        """Return cache key for url fetched on behalf of account"""
+
+        import hashlib
+
+        return hashlib.sha256(
+            '{}\n{}'.format(account, url).encode('utf8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, '{}.cache'.format(key))
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Return stored entry for key, or None"""
+
+        if self.refresh:
+            return None
+        try:
+            with open(self._path(key), 'rb') as entry_h:
+                meta = json.loads(entry_h.readline())
+                body = entry_h.read()
+                validated_at = os.fstat(entry_h.fileno()).st_mtime
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(body, meta['etag'], meta['last_modified'],
+                          meta['next_url'], validated_at)
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        """Return True if entry may be used without revalidation"""
+
+        return time.time() - entry.validated_at < self.ttl
+
+    def put(self, key: str, entry: CacheEntry) -> None:
+        """Store entry for key, evicting old entries beyond max_entries"""
+
+        meta = {'etag': entry.etag, 'last_modified': entry.last_modified,
+                'next_url': entry.next_url}
+        path = self._path(key)
+        file_descriptor, temp_filename = tempfile.mkstemp(
+            dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as entry_h:
+                entry_h.write(json.dumps(meta).encode('utf8') + b'\n')
+                entry_h.write(entry.body)
+            os.utime(temp_filename, (entry.validated_at, entry.validated_at))
+            added = not os.path.exists(path)
+            os.replace(temp_filename, path)
+        except BaseException:
+            os.remove(temp_filename)
+            raise
+
+        with self._lock:
+            if self._entries is None:
+                self._entries = len(self._paths())
+            elif added:
+                self._entries += 1
+            if self._entries > self.max_entries:
+                self._evict()
+
+    def revalidated(self, key: str, entry: CacheEntry) -> None:
+        """Record that the server confirmed entry is still current
+
+        Only the entry's modification time is updated; the body is not
+        written again.
+        """
+
+        entry.validated_at = time.time()
+        try:
+            os.utime(self._path(key), (entry.validated_at,
+                                       entry.validated_at))
+        except FileNotFoundError:
+            # Evicted meanwhile
+            self.put(key, entry)
+
+    def _paths(self) -> list:
+        """Return paths of all stored entries"""
+
+        return [os.path.join(self.directory, name)
+                for name in os.listdir(self.directory)
+                if name.endswith('.cache')]
+
+    def _evict(self) -> None:
+        """Remove least recently validated entries beyond max_entries"""
+
+        paths = self._paths()
+        self._entries = len(paths)
+        if len(paths) <= self.max_entries:
+            return
+
+        def modified(path):
+            try:
+                return os.stat(path).st_mtime
+            except OSError:
+                return 0
+
+        for path in sorted(paths, key=modified)[:-self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._entries = self.max_entries
+
+    def clear(self) -> None:
+        """Remove all stored entries"""
+
+        for path in self._paths():
+            os.remove(path)
+        with self._lock:
+            self._entries = 0
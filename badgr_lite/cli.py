@@ -3,9 +3,20 @@
 """Console script for badgr_lite."""
 
 
+import contextlib
+import csv
+import json
+import os
+import sys
+
 import click
 
-from badgr_lite.models import BadgrLite
+# Heavy modules (requests, sqlite3) are only imported once a command
+# needs them, so that `badgr --help` and shell completion start quickly
+from badgr_lite.cache import ResponseCache, default_cache_dir
+from badgr_lite.helpers import imap_bounded
+from badgr_lite.models import Badge, BadgrLite
+from badgr_lite.ratelimit import RateLimiter
 from badgr_lite import exceptions
 
 
@@ -14,6 +25,7 @@ class Config:
 
     def __init__(self):
         self.token_file = None
+        self.queue_file = None
 
 
 pass_config = click.make_pass_decorator(Config, ensure=True)
@@ -33,6 +45,131 @@ def ensure_evidence(badge_data: dict) -> dict:
     return badge_data
 
 
+def build_badge_data(recipient: str, notify: bool, evidence_url=None,
+                     evidence_narrative=None) -> dict:
+    """Return badge_data for awarding a badge to recipient"""
+
+    badge_data: dict = {
+        "recipient": {
+            "identity": recipient,
+        },
+        "notify": notify,
+    }
+
+    if evidence_url:
+        badge_data = ensure_evidence(badge_data)
+        badge_data['evidence'][0]['url'] = evidence_url
+        badge_data['evidence'][0]['narrative'] = evidence_narrative
+    return badge_data
+
+
+def to_bool(value) -> bool:
+    """Interpret a CSV/JSONL cell (e.g., "yes", "1", true) as boolean"""
+
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 't', 'yes', 'y')
+    return bool(value)
+
+
+def guess_input_format(input_file, input_format=None) -> str:
+    """Return input_format, or guess it from the name of input_file
+
+    Files named *.jsonl or *.ndjson are JSONL, others CSV.
+    """
+
+    if input_format is not None:
+        return input_format
+    return 'jsonl' if input_file.name.endswith(('.jsonl', '.ndjson')) \
+        else 'csv'
+
+
+def describe_error(error: BaseException) -> str:
+    """Return "ExceptionName: args" for a result line"""
+
+    return '{}: {}'.format(type(error).__name__,
+                           ' '.join(str(arg) for arg in error.args))
+
+
+def read_batch_rows(handle, input_format: str):
+    """Lazily yield (row_number, row) from a CSV or JSONL file handle
+
+    Row numbers start at 1 for the first data row. Blank JSONL lines are
+    skipped but still counted, so row numbers stay stable across runs.
+    """
+
+    if input_format == 'csv':
+        for row_number, row in enumerate(csv.DictReader(handle), 1):
+            yield row_number, row
+    else:
+        for row_number, line in enumerate(handle, 1):
+            if line.strip():
+                yield row_number, json.loads(line)
+
+
+def row_to_award(row: dict, default_badge_id=None) -> tuple:
+    """Given a batch row, return (badge_id, badge_data)
+
+    A row either carries `badge_data` verbatim (JSONL only) or the same
+    fields as the award-badge command: recipient, notify, evidence_url and
+    evidence_narrative. `badge_id` falls back to default_badge_id.
+    """
+
+    badge_id = row.get('badge_id') or default_badge_id
+    if not badge_id:
+        raise click.UsageError(
+            "Row has no badge_id and --badge-id was not given")
+    if 'badge_data' in row:
+        return badge_id, row['badge_data']
+    return badge_id, build_badge_data(
+        row['recipient'], to_bool(row.get('notify', False)),
+        row.get('evidence_url'), row.get('evidence_narrative'))
+
+
+def load_checkpoint(checkpoint) -> set:
+    """Return set of row numbers already awarded according to checkpoint"""
+
+    if not checkpoint or not os.path.exists(checkpoint):
+        return set()
+    with open(checkpoint) as checkpoint_h:
+        return {int(line) for line in checkpoint_h if line.strip()}
+
+
+@contextlib.contextmanager
+def open_checkpoint(checkpoint):
+    """Open checkpoint for appending, give a function recording numbers
+
+    Without checkpoint, the function records nothing.
+    """
+
+    if not checkpoint:
+        yield lambda number: None
+        return
+
+    with open(checkpoint, 'a') as checkpoint_h:
+        def record(number: int) -> None:
+            checkpoint_h.write('{}\n'.format(number))
+            checkpoint_h.flush()
+        yield record
+
+
+def open_cache(cache_dir, refresh: bool):
+    """Return ResponseCache in cache_dir, or None if it can't be written
+
+    Listings still work without the cache; a warning says why.
+    """
+
+    try:
+        response_cache = ResponseCache(cache_dir, refresh=refresh)
+    except OSError as err:
+        click.echo("Not caching listings: {}".format(err), err=True)
+        return None
+    if not os.access(cache_dir, os.W_OK):
+        click.echo("Not caching listings: {} is not writable".format(
+            cache_dir), err=True)
+        return None
+    return response_cache
+
+
 @click.group()
 @click.option('--token-file', type=click.Path(),
               default='./token.json',
@@ -44,18 +181,128 @@ def main(config, token_file):
     config.token_file = token_file
 
 
+# Columns of list-badges --format csv/tsv without --fields
+DEFAULT_FIELDS = ('entity_id', 'name', 'issuer', 'open_badge_id',
+                  'created_at')
+
+
+def csv_cell(value) -> str:
+    """Return API value as a CSV cell: nested values as JSON, None empty"""
+
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list, bool)):
+        return json.dumps(value)
+    return str(value)
+
+
+def write_badges(badgr, output_format: str, fields, stream,
+                 prefetch: bool = True) -> None:
+    """Write badges from badgr to stream as each one is decoded
+
+    Formats are those of list-badges. Lines go through the stream's buffer
+    rather than being flushed one by one.
+    """
+
+    if output_format == 'text':
+        for badge in badgr.iter_badges(prefetch=prefetch):
+            stream.write('{}\n'.format(badge))
+    elif output_format == 'jsonl':
+        for record in badgr.iter_badges(prefetch=prefetch, fields=fields):
+            # Without fields, write each Badge's API mapping
+            stream.write(json.dumps(record if fields else record.to_dict()))
+            stream.write('\n')
+    else:
+        fields = fields or DEFAULT_FIELDS
+        writer = csv.writer(stream, lineterminator='\n',
+                            delimiter='\t' if output_format == 'tsv' else ',')
+        writer.writerow(fields)
+        for record in badgr.iter_badges(prefetch=prefetch, fields=fields):
+            writer.writerow([csv_cell(value) for value in record.values()])
+
+
+@main.command()
+@pass_config
+@click.option('--cache/--no-cache', default=True, show_default=True,
+              help="Keep listings on disk and revalidate them with the "
+                   "server instead of downloading them again")
+@click.option('--refresh', is_flag=True,
+              help="Ignore the cached listing and download it again")
+@click.option('--cache-dir', type=click.Path(), default=default_cache_dir,
+              show_default="$BADGR_CACHE_DIR or ~/.cache/badgr-lite",
+              help="Directory holding cached listings")
+@click.option('--format', 'output_format', default='text',
+              show_default=True,
+              type=click.Choice(['text', 'jsonl', 'csv', 'tsv']),
+              help="Output one line per badge: text, JSON object, or "
+                   "CSV/TSV row (after a header row)")
+@click.option('--fields',
+              help="Comma separated fields to output with --format "
+                   "jsonl/csv/tsv, e.g. entity_id,name,created_at")
+def list_badges(config, cache, refresh, cache_dir, output_format, fields):
+    """Pull and print a list of badges from server
+
+
+    Badges are written as they are decoded, so memory stays flat however
+    large the catalog. With --format jsonl and no --fields, each line is
+    the badge class as sent by the API; csv and tsv default to the fields
+    entity_id, name, issuer, open_badge_id and created_at.
+    """
+
+    if fields is not None:
+        if output_format == 'text':
+            raise click.UsageError(
+                "--fields needs --format jsonl, csv or tsv")
+        fields = [field.strip() for field in fields.split(',')
+                  if field.strip()]
+
+    badgr = BadgrLite(token_filename=config.token_file,
+                      cache=open_cache(cache_dir, refresh) if cache
+                      else None)
+    try:
+        write_badges(badgr, output_format, fields,
+                     sys.stdout)
+    except exceptions.TokenFileNotFoundError as err:
+        for line in err.args:
+            click.echo(line)
+    finally:
+        badgr.close()
+
+
 @main.command()
 @pass_config
-def list_badges(config):
-    """Pull and print a list of badges from server"""
+@click.argument('dest', type=click.Path(file_okay=False))
+@click.option('--workers', default=8, show_default=True,
+              help="Number of images downloaded at once")
+def fetch_images(config, dest, workers):
+    """Download the image of every badge class into DEST.
 
-    badgr = BadgrLite(token_filename=config.token_file)
+
+    Images are stored once per content under DEST/objects, and images
+    downloaded by an earlier run are only downloaded again if they changed.
+    One line is written per badge: its ID and the path of its image.
+    """
+
+    badgr = BadgrLite(token_filename=config.token_file,
+                      pool_maxsize=workers)
+    failed = 0
     try:
-        for badge in badgr.badges:
-            click.echo(badge)
+        for badge, outcome in badgr.fetch_images(
+                badgr.iter_badges(prefetch=True), dest, max_workers=workers):
+            if isinstance(outcome, BaseException):
+                failed += 1
+                click.echo('ERROR\t{}\t{}'.format(
+                    badge.entity_id, describe_error(outcome)))
+            else:
+                click.echo('{}\t{}'.format(badge.entity_id, outcome or ''))
     except exceptions.TokenFileNotFoundError as err:
         for line in err.args:
             click.echo(line)
+    finally:
+        badgr.close()
+
+    if failed:
+        raise click.ClickException("{} image(s) failed".format(failed))
 
 
 @main.command()
@@ -84,17 +331,8 @@ def award_badge(config, badge_id, recipient, notify,
             """If one evidence paramater is used, both are needed:
             --evidence-url and --evidence-narrative""")
 
-    badge_data = {
-        "recipient": {
-            "identity": recipient,
-        },
-        "notify": notify,
-    }
-
-    if evidence_url:
-        badge_data = ensure_evidence(badge_data)
-        badge_data['evidence'][0]['url'] = evidence_url
-        badge_data['evidence'][0]['narrative'] = evidence_narrative
+    badge_data = build_badge_data(recipient, notify,
+                                  evidence_url, evidence_narrative)
 
     try:
         badgr = BadgrLite(token_filename=config.token_file)
@@ -105,5 +343,363 @@ def award_badge(config, badge_id, recipient, notify,
             click.echo(line)
 
 
+@main.command()
+@pass_config
+@click.argument('input_file', type=click.File('r'))
+@click.option('--input-format', type=click.Choice(['csv', 'jsonl']),
+              help="Format of INPUT_FILE (default: guessed from extension)")
+@click.option('--badge-id',
+              help="ID of badge to award for rows without a badge_id")
+@click.option('--concurrency', default=8, show_default=True,
+              help="Number of awards in flight at once")
+@click.option('--checkpoint', type=click.Path(),
+              help="File recording finished rows, used to resume a run")
+@click.option('--results', type=click.File('a'), default='-',
+              help="File to append result lines to (default: stdout)")
+@click.option('--dedup/--no-dedup', default=False,
+              help="Skip recipients already awarded the badge, according "
+                   "to the award index next to the token file")
+@click.option('--rate', type=float,
+              help="Maximum requests per second sent to the server")
+def award_batch(config, input_file, input_format, badge_id, concurrency,
+                checkpoint, results, dedup, rate):
+    """Award badges to every recipient listed in INPUT_FILE.
+
+
+    INPUT_FILE is a CSV file (with a header row) or a JSONL file. Columns
+    or keys are those of award-badge: badge_id, recipient, notify,
+    evidence_url and evidence_narrative. JSONL rows may instead give
+    badge_data verbatim.
+
+    Rows are streamed, and one result line is written per row as it
+    completes. With --checkpoint, awarded rows are recorded so that an
+    interrupted run can be repeated and resumes where it stopped.
+
+    With --rate, requests are paced below the server's rate limit and
+    answers of 429 Too Many Requests are retried after backing off.
+    """
+
+    input_format = guess_input_format(input_file, input_format)
+    done = load_checkpoint(checkpoint)
+    pending = ((row_number, row)
+               for row_number, row in read_batch_rows(input_file,
+                                                      input_format)
+               if row_number not in done)
+
+    badgr = BadgrLite(token_filename=config.token_file,
+                      pool_maxsize=concurrency,
+                      rate_limiter=RateLimiter(rate) if rate else None)
+    try:
+        badgr.load_token()
+        if dedup:
+            from badgr_lite.dedup import AwardIndex
+            badgr.award_index = AwardIndex.beside(config.token_file)
+    except exceptions.TokenFileNotFoundError as err:
+        for line in err.args:
+            click.echo(line)
+        return
+
+    def award(numbered_row):
+        return badgr.award_badge(*row_to_award(numbered_row[1], badge_id))
+
+    failed = 0
+    try:
+        with open_checkpoint(checkpoint) as record_done:
+            for (row_number, _), result in imap_bounded(
+                    award, pending, concurrency):
+                if isinstance(result, Badge):
+                    click.echo(result, file=results)
+                    record_done(row_number)
+                else:
+                    failed += 1
+                    click.echo('ERROR\trow {}\t{}'.format(
+                        row_number, describe_error(result)), file=results)
+    finally:
+        badgr.close()
+
+    if failed:
+        raise click.ClickException("{} row(s) failed".format(failed))
+
+
+def read_revocations(handle, default_reason: str):
+    """Lazily yield (line_number, entity_id, reason) from a file handle
+
+    Each line holds an assertion ID, optionally followed by white space and
+    a reason of its own. Blank lines and lines starting with # are skipped
+    but still counted, so line numbers stay stable across runs.
+    """
+
+    for line_number, line in enumerate(handle, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        entity_id, *reason = line.split(None, 1)
+        yield line_number, entity_id, reason[0] if reason else default_reason
+
+
+@main.command()
+@pass_config
+@click.argument('input_file', type=click.File('r'))
+@click.option('--reason', required=True,
+              help="Revocation reason for lines without one")
+@click.option('--concurrency', default=8, show_default=True,
+              help="Number of revocations in flight at once")
+@click.option('--checkpoint', type=click.Path(),
+              help="File recording finished lines, used to resume a run")
+@click.option('--results', type=click.File('a'), default='-',
+              help="File to append result lines to (default: stdout)")
+@click.option('--rate', type=float,
+              help="Maximum requests per second sent to the server")
+def revoke_batch(config, input_file, reason, concurrency, checkpoint,
+                 results, rate):
+    """Revoke every assertion listed in INPUT_FILE.
+
+
+    INPUT_FILE holds one assertion ID per line, optionally followed by a
+    reason for that assertion; other lines are revoked for --reason.
+
+    One result line is written per assertion as it completes. With
+    --checkpoint, revoked lines are recorded so that an interrupted run
+    can be repeated and resumes where it stopped.
+    """
+
+    done = load_checkpoint(checkpoint)
+    pending = (revocation
+               for revocation in read_revocations(input_file, reason)
+               if revocation[0] not in done)
+
+    badgr = BadgrLite(token_filename=config.token_file,
+                      pool_maxsize=concurrency,
+                      rate_limiter=RateLimiter(rate) if rate else None)
+    try:
+        badgr.load_token()
+    except exceptions.TokenFileNotFoundError as err:
+        for line in err.args:
+            click.echo(line)
+        return
+
+    def revoke(revocation):
+        badgr.revoke_assertion(*revocation[1:])
+
+    failed = 0
+    try:
+        with open_checkpoint(checkpoint) as record_done:
+            for (line_number, entity_id, _), outcome in imap_bounded(
+                    revoke, pending, concurrency):
+                if outcome is None:
+                    click.echo('{}\trevoked'.format(entity_id),
+                               file=results)
+                    record_done(line_number)
+                else:
+                    failed += 1
+                    click.echo('ERROR\tline {}\t{}\t{}'.format(
+                        line_number, entity_id, describe_error(outcome)),
+                               file=results)
+    finally:
+        badgr.close()
+
+    if failed:
+        raise click.ClickException("{} assertion(s) failed".format(failed))
+
+
+@main.command()
+@pass_config
+@click.option('--socket', 'socket_path', type=click.Path(),
+              help="Listen on this Unix socket (default: badgr.sock next to "
+                   "the token file)")
+@click.option('--port', type=int,
+              help="Listen on this localhost port instead of a Unix socket")
+@click.option('--host', default='127.0.0.1', show_default=True,
+              help="Address to listen on with --port")
+@click.option('--secret-file', type=click.Path(),
+              help="Shared secret required from clients with --port, created "
+                   "if missing (default: badgr-serve.secret next to the "
+                   "token file)")
+@click.option('--workers', default=8, show_default=True,
+              help="Number of awards in flight at once")
+@click.option('--batch-window', default=0.005, show_default=True,
+              help="Seconds to collect concurrent awards into one batch")
+@click.option('--catalog-ttl', default=300.0, show_default=True,
+              help="Seconds the badge catalog is served from memory")
+@click.option('--verbose', is_flag=True, help="Log every request")
+def serve(config, socket_path, port, host, secret_file, workers,
+          batch_window, catalog_ttl, verbose):
+    """Serve awards and badge listings to local clients.
+
+
+    Runs until interrupted, keeping the token, connection pool and badge
+    catalog warm. Clients (badgr_lite.client.BadgrClient) connect to
+    unix:SOCKET or, with --port, to http://HOST:PORT sending the secret
+    kept in --secret-file.
+    """
+
+    from badgr_lite import server
+
+    if socket_path and port is not None:
+        raise click.UsageError("--socket and --port are exclusive")
+
+    badgr = BadgrLite(token_filename=config.token_file,
+                      pool_maxsize=workers)
+    try:
+        badgr.load_token()
+    except exceptions.TokenFileNotFoundError as err:
+        for line in err.args:
+            click.echo(line)
+        return
+
+    secret = None
+    if port is None:
+        socket_path = socket_path or server.beside(config.token_file,
+                                                   server.SOCKET_FILENAME)
+        click.echo("Serving on unix:{}".format(socket_path))
+    else:
+        secret_file = secret_file or server.beside(config.token_file,
+                                                   server.SECRET_FILENAME)
+        secret = server.read_secret(secret_file)
+        click.echo("Serving on http://{}:{} (secret in {})".format(
+            host, port, secret_file))
+    server.serve(badgr, socket_path, host, port, verbose=verbose,
+                 secret=secret, max_workers=workers,
+                 batch_window=batch_window, catalog_ttl=catalog_ttl)
+
+
+@main.group()
+@pass_config
+@click.option('--queue-file', type=click.Path(),
+              help="SQLite award queue (default: award-queue.sqlite3 next "
+                   "to the token file)")
+def queue(config, queue_file):
+    """Queue awards durably and award them with workers."""
+
+    config.queue_file = queue_file
+
+
+def open_queue(config):
+    """Return AwardQueue chosen by the queue command's options"""
+
+    from badgr_lite.awardqueue import AwardQueue
+
+    if config.queue_file:
+        return AwardQueue(config.queue_file)
+    return AwardQueue.beside(config.token_file)
+
+
+@queue.command()
+@pass_config
+@click.argument('input_file', type=click.File('r'))
+@click.option('--input-format', type=click.Choice(['csv', 'jsonl']),
+              help="Format of INPUT_FILE (default: guessed from extension)")
+@click.option('--badge-id',
+              help="ID of badge to award for rows without a badge_id")
+def enqueue(config, input_file, input_format, badge_id):
+    """Queue an award for every recipient listed in INPUT_FILE.
+
+
+    INPUT_FILE is read as by award-batch. Nothing is sent to the server.
+    """
+
+    input_format = guess_input_format(input_file, input_format)
+    award_queue = open_queue(config)
+    count = 0
+    try:
+        for _, row in read_batch_rows(input_file, input_format):
+            award_queue.enqueue(*row_to_award(row, badge_id), wait=False)
+            count += 1
+    finally:
+        award_queue.close()
+    click.echo("Queued {} award(s)".format(count))
+
+
+@queue.command()
+@pass_config
+@click.option('--concurrency', default=8, show_default=True,
+              help="Number of awards in flight at once")
+@click.option('--visibility-timeout', default=60.0, show_default=True,
+              help="Seconds a job stays leased before another worker may "
+                   "take it over")
+@click.option('--max-attempts', default=5, show_default=True,
+              help="Attempts before a failing job is given up")
+@click.option('--drain', is_flag=True,
+              help="Stop once no job is ready instead of waiting for more")
+@click.option('--dedup/--no-dedup', default=False,
+              help="Skip recipients already awarded the badge, according "
+                   "to the award index next to the token file")
+@click.option('--rate', type=float,
+              help="Maximum requests per second sent to the server")
+@click.option('--results', type=click.File('a'), default='-',
+              help="File to append result lines to (default: stdout)")
+def worker(config, concurrency, visibility_timeout, max_attempts, drain,
+           dedup, rate, results):
+    """Award queued jobs until interrupted (or drained).
+
+
+    Failed jobs are retried with exponential backoff, except those that
+    cannot succeed (e.g., an unknown badge ID). Several workers, in other
+    processes, may drain the same queue.
+    """
+
+    from badgr_lite.awardqueue import QueueWorker
+    from badgr_lite.retry import RetryPolicy
+
+    def on_result(job, outcome):
+        if isinstance(outcome, Badge):
+            click.echo(outcome, file=results)
+        else:
+            click.echo('ERROR\tjob {}\t{}'.format(
+                job.job_id, describe_error(outcome)), file=results)
+
+    award_queue = open_queue(config)
+    badgr = BadgrLite(token_filename=config.token_file,
+                      pool_maxsize=concurrency,
+                      rate_limiter=RateLimiter(rate) if rate else None)
+    queue_worker = QueueWorker(
+        award_queue, badgr, concurrency, visibility_timeout,
+        RetryPolicy(max_attempts=max_attempts, backoff_base=1.0,
+                    backoff_cap=300.0),
+        on_result=on_result)
+    try:
+        if dedup:
+            from badgr_lite.dedup import AwardIndex
+            badgr.award_index = AwardIndex.beside(config.token_file)
+        counts = queue_worker.run(drain=drain)
+    except exceptions.TokenFileNotFoundError as err:
+        for line in err.args:
+            click.echo(line)
+        return
+    except KeyboardInterrupt:
+        counts = queue_worker.counts
+    finally:
+        badgr.close()
+        award_queue.close()
+    click.echo("{done} done, {retried} retried, {failed} failed".format(
+        **counts), err=True)
+
+
+@queue.command()
+@pass_config
+@click.option('--failed', is_flag=True,
+              help="Also list failed jobs with their last error")
+def status(config, failed):
+    """Print the number of queued jobs in each state.
+
+
+    With --failed, failed jobs are listed as: job ID, badge ID, recipient,
+    attempts and last error.
+    """
+
+    award_queue = open_queue(config)
+    try:
+        for state, count in award_queue.status().items():
+            click.echo('{}\t{}'.format(state, count))
+        if failed:
+            for job in award_queue.jobs('failed'):
+                recipient = job['badge_data'].get('recipient') or {}
+                click.echo('{}\t{}\t{}\t{}\t{}'.format(
+                    job['id'], job['badge_id'], recipient.get('identity'),
+                    job['attempts'], json.dumps(job['result'])))
+    finally:
+        award_queue.close()
+
+
 if __name__ == "__main__":
     main()
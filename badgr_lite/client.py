@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""Thin client of the `badgr serve` daemon
+
+Example:
+
+>>> client = BadgrClient('unix:/run/user/1000/badgr.sock')
+>>> for badge in client.badges():
+...     print(badge)
+>>> result = client.award_badge('2TfNNqMLT8CoAhfGKqSv6Q',
+...                             {"recipient": {"identity": "joe@example.com"}})
+
+A daemon listening on a localhost port (`badgr serve --port 8765`) needs
+its shared secret:
+
+>>> client = BadgrClient('http://127.0.0.1:8765',
+...                      secret=read_secret_file('badgr-serve.secret'))
+
+The client only needs the standard library (no requests), so it starts
+quickly; the daemon keeps the token, connections and badge catalog warm.
+"""
+
+import http.client
+import json
+import socket
+import threading
+from typing import Iterable, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+from badgr_lite import exceptions
+from .models import Badge
+
+UNIX_PREFIX = 'unix:'
+SECRET_HEADER = 'X-Badgr-Secret'
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection over a Unix socket"""
+
+    def __init__(self, socket_path: str, timeout: float) -> None:
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def read_secret_file(filename: str) -> str:
+    """Return the daemon's shared secret kept in filename"""
+
+    with open(filename) as secret_h:
+        return secret_h.read().strip()
+
+
+def raise_for_error(body: dict) -> None:
+    """Re-raise an error answered by the daemon as the same exception
+
+    Exceptions of badgr_lite.exceptions are raised as such; anything else
+    as exceptions.ServerError.
+    """
+
+    error_class = getattr(exceptions, body['error'], None)
+    if not isinstance(error_class, type) or \
+            not issubclass(error_class, BaseException):
+        raise exceptions.ServerError(body['error'], *body.get('args', []))
+    raise error_class(*body.get('args', []))
+
+
+class BadgrClient:
+    """Talk to a `badgr serve` daemon on address
+
+    address is `unix:PATH` for a Unix socket or `http://HOST:PORT`, which
+    requires the daemon's secret. One connection is kept open per thread,
+    so a client may be shared by threads.
+    """
+
+    def __init__(self, address: str, timeout: float = 60.0,
+                 secret: Optional[str] = None) -> None:
+        self.address = address
+        self.timeout = timeout
+        self.secret = secret
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self.address.startswith(UNIX_PREFIX):
+                connection = _UnixHTTPConnection(
+                    self.address[len(UNIX_PREFIX):], self.timeout)
+            else:
+                url = urlsplit(self.address)
+                connection = http.client.HTTPConnection(
+                    url.hostname or '127.0.0.1', url.port,
+                    timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def _call(self, method: str, path: str, body=None) -> dict:
+        """Send request to the daemon, return decoded answer or raise"""
+
+        data = None if body is None else json.dumps(body).encode('utf8')
+        headers = {'Content-Type': 'application/json'} if data else {}
+        if self.secret is not None:
+            headers[SECRET_HEADER] = self.secret
+        for attempt in (1, 2):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=data, headers=headers)
+                response = connection.getresponse()
+                answer = json.loads(response.read())
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError,
+                    ConnectionResetError) as error:
+                # Kept-alive connection closed by the daemon (e.g., it was
+                # restarted): reconnect once, unless an award may have
+                # reached the daemon already
+                connection.close()
+                self._local.connection = None
+                if attempt == 2 or not (
+                        method == 'GET' or isinstance(error, BrokenPipeError)):
+                    raise
+        if response.status >= 400:
+            raise_for_error(answer)
+        return answer
+
+    def health(self) -> bool:
+        """Return True if the daemon answers"""
+
+        return self._call('GET', '/health').get('status') == 'ok'
+
+    def badges(self, refresh: bool = False) -> List[Badge]:
+        """Return badge classes from the daemon's catalog"""
+
+        return [Badge(raw) for raw in self._call(
+            'GET', '/badges?refresh=1' if refresh else '/badges')['result']]
+
+    def award_badge(self, badge_id: str, badge_data: dict) -> Badge:
+        """Award badge through the daemon, see BadgrLite.award_badge"""
+
+        return Badge(self._call('POST', '/awards', {
+            'badge_id': badge_id, 'badge_data': badge_data})['result'])
+
+    def award_badges(self, awards: Iterable[Tuple[str, dict]]) -> List[
+            Union[Badge, BaseException]]:
+        """Award many badges in one call, in order
+
+        Returns the awarded Badge or the exception raised, per award.
+        """
+
+        results: List[Union[Badge, BaseException]] = []
+        for raw in self._call('POST', '/awards', {'awards': [
+                {'badge_id': badge_id, 'badge_data': badge_data}
+                for badge_id, badge_data in awards]})['result']:
+            if 'error' in raw:
+                try:
+                    raise_for_error(raw)
+                except BaseException as error:  # pylint: disable=W0703
+                    results.append(error)
+            else:
+                results.append(Badge(raw))
+        return results
+
+    def close(self) -> None:
+        """Close this thread's connection"""
+
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""Local index of issued awards, so re-runs skip existing assertions"""
+
+import json
+import os
+import sqlite3
+import threading
+from typing import Iterable, Optional
+
+_AWARDS_COLUMNS = ('('
+                   ' badge_id TEXT NOT NULL,'
+                   ' recipient TEXT NOT NULL,'
+                   ' assertion TEXT NOT NULL,'
+                   ' entity_id TEXT,'
+                   ' PRIMARY KEY (badge_id, recipient)) WITHOUT ROWID')
+
+
+class AwardIndex:
+    """SQLite index of awards keyed on (badge_id, recipient identity)
+
+    Given to `BadgrLite(award_index=...)`, `award_badge` looks the pair up
+    before calling the server and, if it was already awarded, returns the
+    recorded assertion instead of issuing a duplicate. Every new award is
+    recorded. `rebuild` fills the index from the server in bulk.
+
+    Recipient identities are compared after `normalize` (surrounding white
+    space removed, lower case). Revoked assertions are not indexed, and
+    `BadgrLite.revoke_assertion` forgets the awards it revokes.
+
+    One index may be shared by the threads of a BadgrLite instance.
+    """
+
+    FILENAME = 'awards.sqlite3'
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename,
+                                           check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS awards ' + _AWARDS_COLUMNS)
+            columns = [row[1] for row in self._connection.execute(
+                'PRAGMA table_info(awards)')]
+            if 'entity_id' not in columns:
+                # Index written before assertions were looked up by ID
+                self._connection.execute(
+                    'ALTER TABLE awards ADD COLUMN entity_id TEXT')
+                self._connection.execute(
+                    "UPDATE awards"
+                    " SET entity_id = json_extract(assertion, '$.entityId')")
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS awards_entity_id'
+                ' ON awards (entity_id)')
+
+    @classmethod
+    def beside(cls, token_filename: str) -> 'AwardIndex':
+        """Return index kept in the directory of token_filename"""
+
+        directory = os.path.dirname(os.path.abspath(token_filename))
+        return cls(os.path.join(directory, cls.FILENAME))
+
+    @staticmethod
+    def normalize(identity: str) -> str:
+        """Return recipient identity in the form used as key"""
+
+        return identity.strip().lower()
+
+    @classmethod
+    def _key_of(cls, assertion: dict) -> Optional[tuple]:
+        """Return (badge_id, recipient) of an assertion from the server"""
+
+        recipient = assertion.get('recipient') or {}
+        identity = recipient.get('plaintextIdentity') or \
+            recipient.get('identity')
+        if not identity or not assertion.get('badgeclass'):
+            return None
+        return assertion['badgeclass'], cls.normalize(identity)
+
+    def get(self, badge_id: str, recipient: str) -> Optional[dict]:
+        """Return recorded assertion awarding badge_id to recipient"""
+
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT assertion FROM awards'
+                ' WHERE badge_id = ? AND recipient = ?',
+                (badge_id, self.normalize(recipient))).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def record(self, badge_id: str, recipient: str,
+               assertion: dict) -> None:
+        """Record that assertion awarded badge_id to recipient"""
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO awards VALUES (?, ?, ?, ?)',
+                (badge_id, self.normalize(recipient), json.dumps(assertion),
+                 assertion.get('entityId')))
+
+    def forget(self, entity_id: str) -> None:
+        """Forget the award recorded with assertion entity_id"""
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                'DELETE FROM awards WHERE entity_id = ?', (entity_id,))
+
+    def record_assertions(self, assertions: Iterable[dict],
+                          batch_size: int = 1000,
+                          table: str = 'awards') -> int:
+        """Record assertions from the server in batches, return count
+
+        Revoked assertions and assertions without a plain text recipient
+        identity are skipped.
+        """
+
+        count = 0
+        batch = []
+        for assertion in assertions:
+            key = self._key_of(assertion)
+            if key is None or assertion.get('revoked'):
+                continue
+            batch.append(key + (json.dumps(assertion),
+                                assertion.get('entityId')))
+            if len(batch) >= batch_size:
+                count += self._insert_many(batch, table)
+                batch = []
+        return count + self._insert_many(batch, table)
+
+    def _insert_many(self, rows: list, table: str = 'awards') -> int:
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?)'.format(
+                    table),
+                rows)
+        return len(rows)
+
+    def rebuild(self, badgr, badge_ids: Optional[Iterable[str]] = None,
+                max_workers: int = 4) -> int:
+        """Replace index contents with assertions fetched from the server
+
+        All badge classes (or only `badge_ids`) are listed in parallel
+        through `badgr.iter_assertions`. Returns the number of indexed
+        awards.
+
+        Assertions are collected in a temporary table that replaces the
+        index contents in one transaction once all were fetched, so the
+        index is left as it was if fetching fails.
+        """
+
+        with self._lock, self._connection:
+            self._connection.execute('DROP TABLE IF EXISTS temp.rebuild')
+            self._connection.execute(
+                'CREATE TEMP TABLE rebuild ' + _AWARDS_COLUMNS)
+        try:
+            self.record_assertions(
+                (assertion.to_dict() for assertion in badgr.iter_assertions(
+                    badge_ids=badge_ids, max_workers=max_workers)),
+                table='temp.rebuild')
+            with self._lock, self._connection:
+                # Rows replaced by a later assertion were counted twice
+                count = self._connection.execute(
+                    'SELECT COUNT(*) FROM temp.rebuild').fetchone()[0]
+                self._connection.execute('DELETE FROM awards')
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO awards SELECT * FROM temp.rebuild')
+        finally:
+            with self._lock, self._connection:
+                self._connection.execute('DROP TABLE IF EXISTS temp.rebuild')
+        return count
+
+    def clear(self) -> None:
+        """Forget all recorded awards"""
+
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM awards')
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM awards').fetchone()[0]
+
+    def close(self) -> None:
+        """Close the underlying database connection"""
+
+        with self._lock:
+            self._connection.close()
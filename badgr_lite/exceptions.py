@@ -39,3 +39,37 @@ class BadBadgeIdError(BaseException):
 
 class AwardBadgeBadDataError(BaseException):
     """Award Badge given bad data"""
+
+
+class BadAssertionIdError(BaseException):
+    """Revoke Assertion given bad entity_id
+
+    Please consider the assertion ID that you are trying to revoke is
+    correct.
+    """
+
+
+class RevokeAssertionBadDataError(BaseException):
+    """Revoke Assertion refused by server
+
+    The server did not accept the revocation, e.g. because the reason is
+    missing or the assertion is already revoked.
+    """
+
+
+class RateLimitedError(BaseException):
+    """Rate limited by server
+
+    The server kept answering 429 Too Many Requests. Consider a lower rate
+    for the RateLimiter given to BadgrLite. The first argument is the
+    number of seconds the server asked to wait (Retry-After), if given.
+    """
+
+
+class ServerError(BaseException):
+    """Unexpected answer from server
+
+    The server answered with an unexpected status code (e.g., 500 Internal
+    Server Error), even after any retries allowed by the RetryPolicy given
+    to BadgrLite. The arguments are the status code and the URL.
+    """
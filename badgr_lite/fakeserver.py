@@ -0,0 +1,496 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=R0902, R0913
+"""Local stand-in for the Badgr server, for offline tests and load tests
+
+FakeBadgrServer implements the parts of the Badgr API used by BadgrLite:
+
+- POST /o/token (refresh_token grant; refresh tokens are single use)
+- GET /v2/badgeclasses (paginated with `Link: <...>; rel="next"`,
+  revalidated with ETag)
+- GET and POST /v2/badgeclasses/{id}/assertions
+- DELETE /v2/assertions/{id} (revocation, with a `revocation_reason`)
+- GET /media/badges/{id}.png (badge class images, revalidated with ETag)
+
+with configurable latency, error rate (500), 429 Too Many Requests,
+access token expiry (401) and gzip-compressed answers.
+
+Example:
+
+>>> with FakeBadgrServer(latency=0.05, error_rate=0.01) as server:
+...     server.write_token_file('./token.json')
+...     badgr = BadgrLite(token_filename='./token.json',
+...                       base_url=server.base_url)
+...     print(len(badgr.badges))
+
+Run standalone with `python -m badgr_lite.fakeserver --help`.
+"""
+
+import gzip
+import hashlib
+import json
+import random
+import re
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import click
+
+from .server import ThreadingHTTPServer
+
+_ASSERTIONS_PATH = re.compile(r'^/v2/badgeclasses/([^/]+)/assertions$')
+_ASSERTION_PATH = re.compile(r'^/v2/assertions/([^/]+)$')
+_IMAGE_PATH = re.compile(r'^/media/badges/([^/]+)\.png$')
+
+# Size of the fake badge images, enough to span several read chunks
+IMAGE_SIZE = 100 * 1024
+
+
+def _entity_id(prefix: str, number: int) -> str:
+    """Return a stable 22 character entity ID"""
+
+    return hashlib.sha256('{}{}'.format(prefix, number).encode(
+        'utf8')).hexdigest()[:22]
+
+
+def fake_image(name: str) -> bytes:
+    """Return the stable content of the fake PNG image called name"""
+
+    seed = hashlib.sha256(name.encode('utf8')).digest()
+    return (b'\x89PNG\r\n\x1a\n' + seed * (IMAGE_SIZE // len(seed)))[
+        :IMAGE_SIZE]
+
+
+class FakeBadgrServer:
+    """Threaded HTTP server imitating the Badgr API on localhost
+
+    - `badge_count`: badge classes to serve (with `assertion_count`
+      assertions each)
+    - `page_size`: entries per page of a listing
+    - `latency`: seconds each request takes; a (low, high) pair picks a
+      uniformly random latency per request
+    - `error_rate`: fraction of requests answered 500 (before processing)
+    - `throttle_rate`: fraction of requests answered 429 with
+      Retry-After: `retry_after`
+    - `token_lifetime`: seconds an access token is valid (None: forever)
+    - `seed`: seed of the random choices, for repeatable runs
+    - `issuer_id`: issuer of every badge class; badge class IDs derive
+      from it, so servers with different issuers serve different badges
+    - `compress`: gzip JSON answers to clients accepting gzip
+
+    Counts of answered requests by status code are kept in `stats`.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 badge_count: int = 10, assertion_count: int = 10,
+                 page_size: int = 100, latency=0.0, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, retry_after: float = 1.0,
+                 token_lifetime: Optional[float] = None,
+                 seed: Optional[int] = None,
+                 issuer_id: str = 'fakeissuer',
+                 compress: bool = False) -> None:
+        self.issuer_id = issuer_id
+        self.compress = compress
+        self.page_size = page_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.token_lifetime = token_lifetime
+        self.stats: Dict[int, int] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._access_tokens: Dict[str, float] = {}
+        self._refresh_tokens: set = set()
+        self._badges: List[dict] = []
+        self._assertions: Dict[str, List[dict]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.fake = self  # type: ignore
+
+        created_at = '2019-09-04T20:12:57Z'
+        for number in range(badge_count):
+            entity_id = _entity_id('{}badgeclass'.format(issuer_id), number)
+            self._badges.append({
+                'entityType': 'BadgeClass', 'entityId': entity_id,
+                'openBadgeId': 'https://api.badgr.io/public/badges/{}'.format(
+                    entity_id),
+                'createdAt': created_at, 'createdBy': 'fake',
+                'issuer': self.issuer_id, 'issuerOpenBadgeId':
+                    'https://api.badgr.io/public/issuers/{}'.format(
+                        self.issuer_id),
+                'name': 'Fake badge {}'.format(number),
+                'image': '{}/media/badges/{}.png'.format(self.base_url,
+                                                         entity_id),
+                'description': 'Served by FakeBadgrServer',
+                'criteriaUrl': None, 'criteriaNarrative': None,
+                'alignments': [], 'tags': [], 'expires': None,
+                'extensions': {}})
+            self._assertions[entity_id] = []
+            for recipient in range(assertion_count):
+                self._add_assertion(entity_id, {
+                    'recipient': {'identity': 'user{}@example.com'.format(
+                        recipient)}}, created_at)
+
+    @property
+    def base_url(self) -> str:
+        """URL to pass to BadgrLite(base_url=...)"""
+
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(str(host), port)
+
+    def issue_token(self) -> dict:
+        """Return new token data, as found in a token file"""
+
+        access_token, refresh_token = secrets.token_urlsafe(), \
+            secrets.token_urlsafe()
+        with self._lock:
+            self._access_tokens[access_token] = time.time()
+            self._refresh_tokens.add(refresh_token)
+        return {'access_token': access_token, 'token_type': 'Bearer',
+                'expires_in': self.token_lifetime or 86400,
+                'refresh_token': refresh_token, 'scope': 'rw:profile'}
+
+    def write_token_file(self, token_filename: str) -> None:
+        """Write a freshly issued token to token_filename"""
+
+        with open(token_filename, 'w') as token_h:
+            json.dump(self.issue_token(), token_h)
+
+    def expire_tokens(self) -> None:
+        """Expire all access tokens issued so far"""
+
+        with self._lock:
+            self._access_tokens.clear()
+
+    def start(self) -> 'FakeBadgrServer':
+        """Serve requests in a background thread"""
+
+        self._thread = threading.Thread(target=self.httpd.serve_forever,
+                                        kwargs={'poll_interval': 0.05},
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and release the port"""
+
+        if self._thread is not None:
+            self.httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.httpd.server_close()
+
+    def __enter__(self) -> 'FakeBadgrServer':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _add_assertion(self, badge_id: str, badge_data: dict,
+                       created_at: Optional[str] = None) -> dict:
+        """Store and return an assertion of badge_id"""
+
+        entity_id = secrets.token_urlsafe(16)[:22]
+        identity = badge_data['recipient']['identity']
+        assertion = {
+            'entityType': 'Assertion', 'entityId': entity_id,
+            'openBadgeId': 'https://api.badgr.io/public/assertions/{}'.format(
+                entity_id),
+            'createdAt': created_at or time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                                     time.gmtime()),
+            'createdBy': 'fake', 'badgeclass': badge_id,
+            'issuer': self.issuer_id, 'issuerOpenBadgeId':
+                'https://api.badgr.io/public/issuers/{}'.format(
+                    self.issuer_id),
+            'image': 'https://media.badgr.io/uploads/badges/assertion.png',
+            'recipient': {'identity': identity, 'type': 'email',
+                          'hashed': False, 'plaintextIdentity': identity},
+            'revoked': False, 'revocationReason': None, 'expires': None,
+            'notify': badge_data.get('notify', False),
+            'evidence': badge_data.get('evidence', []), 'extensions': {}}
+        self._assertions[badge_id].append(assertion)
+        return assertion
+
+    def _revoke(self, entity_id: str, reason: str) -> int:
+        """Revoke assertion entity_id, return status to answer"""
+
+        with self._lock:
+            for assertions in self._assertions.values():
+                for assertion in assertions:
+                    if assertion['entityId'] != entity_id:
+                        continue
+                    if assertion['revoked'] or not reason:
+                        return 400
+                    assertion['revoked'] = True
+                    assertion['revocationReason'] = reason
+                    return 200
+        return 404
+
+    def _count(self, status: int) -> None:
+        with self._lock:
+            self.stats[status] = self.stats.get(status, 0) + 1
+
+    def _injected_failure(self) -> Optional[int]:
+        """Return status of an injected failure, if any, after latency"""
+
+        with self._lock:
+            latency = self.latency
+            if isinstance(latency, (tuple, list)):
+                latency = self._random.uniform(*latency)
+            draw = self._random.random()
+        if latency:
+            time.sleep(latency)
+        if draw < self.error_rate:
+            return 500
+        if draw < self.error_rate + self.throttle_rate:
+            return 429
+        return None
+
+    def _authorized(self, authorization: Optional[str]) -> bool:
+        if not authorization or not authorization.startswith('Bearer '):
+            return False
+        with self._lock:
+            issued_at = self._access_tokens.get(authorization[7:])
+        if issued_at is None:
+            return False
+        return self.token_lifetime is None or \
+            time.time() - issued_at < self.token_lifetime
+
+    def _refresh(self, form: dict) -> Optional[dict]:
+        """Exchange single use refresh token for new token data"""
+
+        refresh_token = form.get('refresh_token', [''])[0]
+        with self._lock:
+            if refresh_token not in self._refresh_tokens:
+                return None
+            self._refresh_tokens.discard(refresh_token)
+        return self.issue_token()
+
+    def _page(self, entries: List[dict], path: str, query: dict) -> tuple:
+        """Return (body, next page URL or None) of a listing"""
+
+        cursor = int(query.get('cursor', ['0'])[0])
+        page = entries[cursor:cursor + self.page_size]
+        next_url = None
+        if cursor + self.page_size < len(entries):
+            next_url = '{}{}?cursor={}'.format(self.base_url, path,
+                                               cursor + self.page_size)
+        return {'status': {'success': True, 'description': 'ok'},
+                'result': page}, next_url
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Answer one connection's requests on behalf of FakeBadgrServer"""
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; don't wait for ACKs
+    disable_nagle_algorithm = True
+
+    @property
+    def fake(self) -> FakeBadgrServer:
+        """Server state"""
+
+        return self.server.fake  # type: ignore
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        """Keep quiet; counts are kept in FakeBadgrServer.stats"""
+
+    def _answer(self, status: int, body=None, headers=None) -> None:
+        # Counted first, so that stats are complete once a client has read
+        # the answer
+        self.fake._count(status)  # pylint: disable=W0212
+        data = b'' if body is None else json.dumps(body).encode('utf8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if data:
+            self.send_header('Content-Type', 'application/json')
+            if self.fake.compress and \
+                    'gzip' in self.headers.get('Accept-Encoding', ''):
+                data = gzip.compress(data)
+                self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _fail_or_unauthorized(self) -> bool:
+        """Answer injected failures and 401; return True if answered"""
+        # Server internals; pylint: disable=W0212
+
+        failure = self.fake._injected_failure()
+        if failure == 429:
+            self._answer(429, {'detail': 'Request was throttled.'},
+                         {'Retry-After': str(self.fake.retry_after)})
+            return True
+        if failure is not None:
+            self._answer(failure, {'detail': 'Server error'})
+            return True
+        if not self.fake._authorized(self.headers.get('Authorization')):
+            self._answer(401, {'detail': 'Invalid token.'})
+            return True
+        return False
+
+    def do_POST(self):  # pylint: disable=C0103
+        """Refresh a token or award a badge"""
+        # Server internals; pylint: disable=W0212
+
+        body = self._read_body()
+        path = urlsplit(self.path).path
+        if path == '/o/token':
+            token_data = self.fake._refresh(parse_qs(body.decode('utf8')))
+            if token_data is None:
+                self._answer(401, {'error': 'invalid_grant'})
+            else:
+                self._answer(200, token_data)
+            return
+
+        match = _ASSERTIONS_PATH.match(path)
+        if match is None:
+            self._answer(404, {'detail': 'Not found.'})
+            return
+        if self._fail_or_unauthorized():
+            return
+        badge_id = match.group(1)
+        if badge_id not in self.fake._assertions:
+            self._answer(404, {'detail': 'Not found.'})
+            return
+        try:
+            badge_data = json.loads(body)
+        except ValueError:
+            badge_data = None
+        if not isinstance(badge_data, dict) or not isinstance(
+                badge_data.get('recipient'), dict) or \
+                not badge_data['recipient'].get('identity'):
+            self._answer(400, {'status': {'success': False},
+                               'fieldErrors': {'recipient': ['required']}})
+            return
+        with self.fake._lock:
+            assertion = self.fake._add_assertion(badge_id, badge_data)
+        self._answer(201, {'status': {'success': True, 'description': 'ok'},
+                           'result': [assertion]})
+
+    def do_DELETE(self):  # pylint: disable=C0103
+        """Revoke an assertion"""
+        # Server internals; pylint: disable=W0212
+
+        body = self._read_body()
+        match = _ASSERTION_PATH.match(urlsplit(self.path).path)
+        if match is None:
+            self._answer(404, {'detail': 'Not found.'})
+            return
+        if self._fail_or_unauthorized():
+            return
+        try:
+            reason = (json.loads(body) or {}).get('revocation_reason')
+        except (ValueError, AttributeError):
+            reason = None
+        status = self.fake._revoke(match.group(1), reason)
+        if status == 200:
+            self._answer(200, {'status': {'success': True,
+                                          'description': 'ok'},
+                               'result': []})
+        elif status == 400:
+            self._answer(400, {'status': {'success': False},
+                               'fieldErrors': {'revocation_reason': [
+                                   'required, or already revoked']}})
+        else:
+            self._answer(404, {'detail': 'Not found.'})
+
+    def _answer_image(self, name: str) -> None:
+        """Answer a badge image, or 304 if the client has it already"""
+
+        data = fake_image(name)
+        etag = '"{}"'.format(hashlib.sha256(data).hexdigest()[:32])
+        status = 304 if self.headers.get('If-None-Match') == etag else 200
+        self.fake._count(status)  # pylint: disable=W0212
+        self.send_response(status)
+        if status == 304:
+            data = b''
+        else:
+            self.send_header('Content-Type', 'image/png')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):  # pylint: disable=C0103
+        """List badge classes or assertions, or serve an image"""
+        # Server internals; pylint: disable=W0212
+
+        url = urlsplit(self.path)
+        image = _IMAGE_PATH.match(url.path)
+        if image and image.group(1) in self.fake._assertions:
+            # Public, like the media host: no token needed
+            self._answer_image(image.group(1))
+            return
+        match = _ASSERTIONS_PATH.match(url.path)
+        if url.path == '/v2/badgeclasses':
+            entries = self.fake._badges
+        elif match and match.group(1) in self.fake._assertions:
+            entries = self.fake._assertions[match.group(1)]
+        else:
+            self._answer(404, {'detail': 'Not found.'})
+            return
+        if self._fail_or_unauthorized():
+            return
+
+        with self.fake._lock:
+            body, next_url = self.fake._page(list(entries), url.path,
+                                             parse_qs(url.query))
+        headers = {}
+        if next_url:
+            headers['Link'] = '<{}>; rel="next"'.format(next_url)
+        etag = '"{}"'.format(hashlib.sha256(json.dumps(
+            body, sort_keys=True).encode('utf8')).hexdigest()[:32])
+        headers['ETag'] = etag
+        if self.headers.get('If-None-Match') == etag:
+            self._answer(304, None, headers)
+        else:
+            self._answer(200, body, headers)
+
+
+@click.command()
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', default=8000, show_default=True)
+@click.option('--token-file', type=click.Path(), default='token.json',
+              show_default=True, help="Token file to write for clients")
+@click.option('--badge-count', default=10, show_default=True)
+@click.option('--assertion-count', default=10, show_default=True)
+@click.option('--latency', default=0.0, show_default=True,
+              help="Seconds each request takes")
+@click.option('--error-rate', default=0.0, show_default=True,
+              help="Fraction of requests answered 500")
+@click.option('--throttle-rate', default=0.0, show_default=True,
+              help="Fraction of requests answered 429")
+@click.option('--token-lifetime', type=float,
+              help="Seconds access tokens are valid")
+def main(host, port, token_file, badge_count, assertion_count, latency,
+         error_rate, throttle_rate, token_lifetime):
+    """Serve a fake Badgr API until interrupted."""
+
+    server = FakeBadgrServer(
+        host, port, badge_count=badge_count,
+        assertion_count=assertion_count, latency=latency,
+        error_rate=error_rate, throttle_rate=throttle_rate,
+        token_lifetime=token_lifetime)
+    server.write_token_file(token_file)
+    click.echo("Serving fake Badgr API at {} (token in {})".format(
+        server.base_url, token_file))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=E1120
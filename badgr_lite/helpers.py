@@ -4,14 +4,142 @@
 
 import re
 import datetime
+import itertools
+import json
+import threading
+from typing import (Callable, Dict, Iterable, Iterator, Optional, Sequence,
+                    Tuple)
 
-import pytz
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
 
 
-UTC = pytz.timezone("UTC")
+# queue and concurrent.futures are imported where first needed, so that
+# importing badgr_lite (e.g., for `badgr --help`) stays fast
+UTC = datetime.timezone.utc
 DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 DATETIME_MILLISECOND_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
 
+_CAMEL_WORD = re.compile('(.)([A-Z][a-z]+)')
+_CAMEL_BOUNDARY = re.compile('([a-z0-9])([A-Z])')
+_JSON_DELIMITER = re.compile(r'[,\]}\s]')
+
+# Marks the end of an iterator shared between threads
+_EXHAUSTED = object()
+
+# The API uses a small, fixed vocabulary of keys: translate each only once
+_PYTHONIC_NAMES: Dict[str, str] = {}
+
+
+def json_loads(data):
+    """Decode JSON from str or bytes, with orjson when it is installed"""
+
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def iter_json_items(chunks: Iterable[bytes],
+                    key: str = 'result') -> Iterator:
+    """Yield the elements of array `key` of a JSON object, as they arrive
+
+    `chunks` is the UTF-8 encoded object in pieces of any size (e.g., a
+    response's `iter_content()`). Elements are decoded one at a time from
+    a buffer holding the current chunk and the element being decoded, so
+    memory is bounded by the largest element rather than by the whole
+    document. Other members of the object are decoded and dropped (those
+    after the array are not read at all). Nothing is yielded if the object
+    has no `key`.
+
+    Raises ValueError on malformed or truncated JSON.
+    """
+    import codecs
+
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    pieces = iter(chunks)
+    buffer = ''
+    position = 0
+    exhausted = False
+
+    def read_more() -> bool:
+        """Append the next chunk to the buffer; False at the end"""
+
+        nonlocal buffer, position, exhausted
+        if exhausted:
+            return False
+        for chunk in pieces:
+            text = text_decoder.decode(chunk)
+            if text:
+                buffer = buffer[position:] + text
+                position = 0
+                return True
+        text_decoder.decode(b'', final=True)
+        exhausted = True
+        return False
+
+    def peek() -> str:
+        """Return next non-whitespace character, '' at the end"""
+
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n':
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not read_more():
+                return ''
+
+    def expect(character: str) -> None:
+        nonlocal position
+        if peek() != character:
+            raise ValueError('Expected {!r} in JSON stream, got {!r}'.format(
+                character, buffer[position:position + 20]))
+        position += 1
+
+    def value():
+        """Decode the next JSON value, reading as much as it needs"""
+
+        nonlocal position
+        if peek() not in '{["':
+            # Numbers and literals are complete once followed by a delimiter
+            while not _JSON_DELIMITER.search(buffer, position) and \
+                    read_more():
+                pass
+        while True:
+            try:
+                decoded, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if read_more():
+                    continue
+                raise
+            position = end
+            return decoded
+
+    expect('{')
+    if peek() == '}':
+        return
+    while True:
+        name = value()
+        expect(':')
+        if name == key:
+            break
+        value()
+        if peek() == '}':
+            return
+        expect(',')
+
+    expect('[')
+    if peek() == ']':
+        return
+    while True:
+        yield value()
+        if peek() == ']':
+            return
+        expect(',')
+
 
 def pythonic(name: str) -> str:
     """Convert camelCase identifier to pythonic identifier
@@ -23,21 +151,205 @@ def pythonic(name: str) -> str:
     The Badgr API returns attributes in camel case (e.g., issuerOpenBadgeId).
     We wish to also see those attributes in a pythonic way
     (e.g., issuer_open_badgee_id).
+
+    Translations are memoized.
+    """
+    try:
+        return _PYTHONIC_NAMES[name]
+    except KeyError:
+        regex_s1 = _CAMEL_WORD.sub(r'\1_\2', name)
+        result = _CAMEL_BOUNDARY.sub(r'\1_\2', regex_s1).lower()
+        _PYTHONIC_NAMES[name] = result
+        return result
+
+
+def projector(fields: Sequence[str]) -> Callable[[dict], dict]:
+    """Return function projecting API mappings onto fields
+
+    Fields are pythonic attribute names (e.g., `entity_id`) or the API's
+    own keys (`entityId`). The returned function maps a dictionary from the
+    API to a dictionary of the requested fields, in order, holding the
+    values as sent by the API (None when missing). Keys are matched once
+    and remembered, so later records with the same keys cost one lookup
+    per field.
     """
-    regex_s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
-    return re.sub('([a-z0-9])([A-Z])', r'\1_\2', regex_s1).lower()
+
+    keys: Dict[str, str] = {}
+
+    def project(raw: dict) -> dict:
+        record: dict = {}
+        for field in fields:
+            key = keys.get(field)
+            if key is None or key not in raw:
+                key = next((candidate for candidate in raw
+                            if candidate == field or
+                            pythonic(candidate) == field), None)
+                if key is None:
+                    record[field] = None
+                    continue
+                keys[field] = key
+            record[field] = raw[key]
+        return record
+
+    return project
+
+
+def _parse_timestamp(timestamp: str) -> Optional[datetime.datetime]:
+    """Parse DATETIME_FORMAT or DATETIME_MILLISECOND_FORMAT by slicing
+
+    Return None if timestamp is not in either shape.
+    """
+
+    length = len(timestamp)
+    if (length < 20 or timestamp[-1] != 'Z' or timestamp[4] != '-' or
+            timestamp[7] != '-' or timestamp[10] != 'T' or
+            timestamp[13] != ':' or timestamp[16] != ':'):
+        return None
+
+    microsecond = 0
+    if length > 20:
+        fraction = timestamp[20:-1]
+        if (timestamp[19] != '.' or not 1 <= len(fraction) <= 6 or
+                not fraction.isdigit()):
+            return None
+        microsecond = int(fraction.ljust(6, '0'))
+    elif length != 20:
+        return None
+
+    try:
+        return datetime.datetime(
+            int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+            int(timestamp[11:13]), int(timestamp[14:16]),
+            int(timestamp[17:19]), microsecond, tzinfo=UTC)
+    except ValueError:
+        return None
 
 
 def to_datetime(potential_datetime):
-    """Given string, return UTC aware datetime"""
+    """Given string, return UTC aware datetime
+
+    Both API timestamp shapes are parsed without exceptions on the common
+    path; anything else falls back to `strptime`.
+    """
 
     final_datetime = potential_datetime
     if isinstance(potential_datetime, str):
+        final_datetime = _parse_timestamp(potential_datetime)
+        if final_datetime is not None:
+            return final_datetime
         try:
             final_datetime = datetime.datetime.strptime(
                 potential_datetime, DATETIME_FORMAT)
         except ValueError:
             final_datetime = datetime.datetime.strptime(
                 potential_datetime, DATETIME_MILLISECOND_FORMAT)
-        final_datetime = UTC.localize(final_datetime)
+        final_datetime = final_datetime.replace(tzinfo=UTC)
     return final_datetime
+
+
+def imap_bounded(func: Callable, items: Iterable,
+                 max_workers: int) -> Iterator[Tuple]:
+    """Apply func to each item in a thread pool, yielding as completed
+
+    At most `max_workers` items are in flight at any time, and `items` is
+    consumed lazily, so arbitrarily long (or infinite) iterables can be fed
+    without being loaded into memory.
+
+    Yields (item, outcome) pairs in completion order, where outcome is the
+    return value of func(item) or the exception it raised.
+    """
+    from concurrent.futures import (FIRST_COMPLETED, ThreadPoolExecutor,
+                                    wait)
+
+    iterator = iter(items)
+    pending = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for item in itertools.islice(iterator, max_workers):
+                pending[executor.submit(func, item)] = item
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    for next_item in itertools.islice(iterator, 1):
+                        pending[executor.submit(func, next_item)] = next_item
+                    error = future.exception()
+                    yield item, (future.result() if error is None else error)
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def put_unless_stopped(box, item, stop: threading.Event) -> bool:
+    """Put item in queue box, waiting for room until stop is set
+
+    Return False if stop was set first (e.g., the consumer went away).
+    """
+    import queue
+
+    while not stop.is_set():
+        try:
+            box.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def interleave_bounded(func: Callable, items: Iterable, max_workers: int,
+                       buffer_size: int = 1000) -> Iterator:
+    """Consume the iterators func(item) in parallel, yielding as they arrive
+
+    Up to `max_workers` threads each take the next item from `items` and
+    drain the iterator returned by func(item). Elements of all iterators
+    are yielded as they arrive, in no particular order. At most
+    `buffer_size` elements wait for the caller, so memory stays flat
+    however long the iterators are.
+
+    The first exception raised by func or an iterator is re-raised to the
+    caller. Closing the generator stops the threads.
+    """
+    import queue
+
+    iterator = iter(items)
+    iterator_lock = threading.Lock()
+    arrived: queue.Queue = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+
+    def put(kind: str, payload=None) -> bool:
+        """Hand payload to the caller unless it went away"""
+
+        return put_unless_stopped(arrived, (kind, payload), stop)
+
+    def worker() -> None:
+        try:
+            while not stop.is_set():
+                with iterator_lock:
+                    item = next(iterator, _EXHAUSTED)
+                if item is _EXHAUSTED:
+                    break
+                for element in func(item):
+                    if not put('element', element):
+                        return
+        except BaseException as error:  # pylint: disable=W0703
+            put('error', error)
+        finally:
+            put('done')
+
+    workers = [threading.Thread(target=worker, daemon=True)
+               for _ in range(max_workers)]
+    for thread in workers:
+        thread.start()
+
+    running = len(workers)
+    try:
+        while running:
+            kind, payload = arrived.get()
+            if kind == 'element':
+                yield payload
+            elif kind == 'error':
+                raise payload
+            else:
+                running -= 1
+    finally:
+        stop.set()
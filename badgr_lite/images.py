@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""Content-addressed local store of badge images
+
+Images are stored once per content, under their SHA-256:
+
+    DEST/objects/ab/ab12...ef.png
+
+and DEST/index.json remembers, per image URL, the stored file and the
+validators (ETag, Last-Modified) used to revalidate it with a conditional
+GET. Unchanged images are therefore neither downloaded nor written again,
+and badges sharing an image share one file.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+# Bytes read from the network and written to disk at a time
+CHUNK_SIZE = 64 * 1024
+
+# Extension of stored images by Content-Type; others keep the URL's suffix
+EXTENSIONS = {
+    'image/png': '.png',
+    'image/svg+xml': '.svg',
+    'image/jpeg': '.jpg',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+}
+
+
+class ImageStore:
+    """Images of a directory, indexed by URL, stored by content hash
+
+    One store may be shared by the threads fetching images; `save` writes
+    the index back to disk.
+    """
+
+    INDEX = 'index.json'
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        try:
+            with open(os.path.join(directory, self.INDEX)) as index_h:
+                self._index: Dict[str, dict] = json.load(index_h)
+        except (OSError, ValueError):
+            self._index = {}
+
+    def path_of(self, url: str) -> Optional[str]:
+        """Return path of the stored image of url, if it is still there"""
+
+        with self._lock:
+            entry = self._index.get(url)
+        if entry is None:
+            return None
+        path = os.path.join(self.directory, entry['path'])
+        return path if os.path.exists(path) else None
+
+    def conditional_headers(self, url: str) -> dict:
+        """Headers turning a GET of url into a conditional GET"""
+
+        if self.path_of(url) is None:
+            return {}
+        with self._lock:
+            entry = self._index[url]
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, url: str, response) -> str:
+        """Stream the body of response (a 200 OK for url) into the store
+
+        The body is hashed while it is written to a temporary file, which
+        then becomes the object named by the hash (or is dropped, if that
+        content is already stored). Return the object's path.
+        """
+
+        content_type = response.headers.get('Content-Type', '').split(';')[0]
+        extension = EXTENSIONS.get(content_type.strip().lower()) or \
+            os.path.splitext(urlsplit(url).path)[1].lower()
+
+        digest = hashlib.sha256()
+        handle, temp_path = tempfile.mkstemp(dir=self.directory,
+                                             prefix='.fetch-')
+        try:
+            with os.fdopen(handle, 'wb') as temp_h:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    digest.update(chunk)
+                    temp_h.write(chunk)
+            sha256 = digest.hexdigest()
+            relative = os.path.join('objects', sha256[:2],
+                                    sha256 + extension)
+            path = os.path.join(self.directory, relative)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path):
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        with self._lock:
+            self._index[url] = {
+                'path': relative, 'sha256': sha256,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')}
+        return path
+
+    def save(self) -> None:
+        """Write the index to disk (atomically)"""
+
+        with self._lock:
+            data = json.dumps(self._index, indent=1, sort_keys=True)
+        handle, temp_path = tempfile.mkstemp(dir=self.directory,
+                                             prefix='.index-')
+        with os.fdopen(handle, 'w') as temp_h:
+            temp_h.write(data)
+        os.replace(temp_path, os.path.join(self.directory, self.INDEX))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._index)
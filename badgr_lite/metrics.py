@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+"""In-process metrics of BadgrLite traffic, exportable to Prometheus"""
+
+import bisect
+import re
+import threading
+from typing import Callable, Dict, Iterable, Optional, Tuple, Union
+
+# Upper bounds (seconds) of request latency buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+# Path segments naming collections; the segment after one is an entity ID
+_COLLECTIONS = frozenset(['badgeclasses', 'issuers', 'assertions',
+                          'users', 'backpack'])
+_URL_PATH = re.compile(r'^[a-z]+://[^/]+(?P<path>[^?#]*)')
+# First path segments of the API (versions and the OAuth token endpoint)
+_API_ROOTS = frozenset(['v1', 'v2', 'o'])
+
+# Endpoint label of requests outside the API, so that images or unknown
+# paths do not create one label value each
+IMAGE_ENDPOINT = 'image'
+OTHER_ENDPOINT = 'other'
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def endpoint_of(url: str) -> str:
+    """Return URL path with entity IDs replaced by {id}
+
+    E.g., https://api.badgr.io/v2/badgeclasses/2TfNNq/assertions gives
+    /v2/badgeclasses/{id}/assertions, so that metrics are kept per endpoint
+    rather than per entity. Paths outside the API give OTHER_ENDPOINT.
+    """
+
+    match = _URL_PATH.match(url)
+    path = match.group('path') if match else url
+    segments = path.split('/')
+    if len(segments) < 2 or segments[1] not in _API_ROOTS:
+        return OTHER_ENDPOINT
+    for index in range(1, len(segments)):
+        if segments[index - 1] in _COLLECTIONS and segments[index]:
+            segments[index] = '{id}'
+    return '/'.join(segments)
+
+
+def status_class(status: Union[int, BaseException]) -> str:
+    """Return '2xx', '4xx', ... for a status code, 'error' for exceptions"""
+
+    if isinstance(status, int):
+        return '{}xx'.format(status // 100)
+    return 'error'
+
+
+class Histogram:
+    """Cumulative histogram of observed values, as in Prometheus"""
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Record one observed value"""
+
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list:
+        """Return [(upper bound, count of values <= bound)], +Inf last"""
+
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, value.replace('\\', r'\\').replace('"', r'\"'))
+        for name, value in labels))
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """Latency histograms and counters of one or more BadgrLite clients
+
+    Given to `BadgrLite(metrics=...)`, every request is recorded:
+
+    - badgr_request_duration_seconds: histogram per method, endpoint
+      (see `endpoint_of`, or "image" for images) and status class (2xx,
+      4xx, 5xx, error)
+    - badgr_request_bytes_total: bytes sent and received (bodies, as on
+      the wire)
+    - badgr_token_refreshes_total: access tokens refreshed
+    - badgr_unauthorized_total: 401 answers
+    - badgr_retries_total: retries, by reason (status code, exception
+      name or rate_limited)
+
+    `render` returns all metrics in the Prometheus text exposition format,
+    e.g., to be served on a /metrics endpoint. `callback`, if given, is
+    called with (name, labels, value) for each observation, to push metrics
+    to another system (StatsD, logs, ...).
+
+    Without a registry, BadgrLite records nothing.
+    """
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS,
+                 callback: Optional[Callable] = None) -> None:
+        self.buckets = tuple(buckets)
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Record value in histogram name with the given labels"""
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+        if self.callback is not None:
+            self.callback(name, labels, value)
+
+    def increment(self, name: str, amount: float = 1, **labels: str) -> None:
+        """Add amount to counter name with the given labels"""
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+        if self.callback is not None:
+            self.callback(name, labels, amount)
+
+    def observe_request(self, method: str, url: str,
+                        status: Union[int, BaseException], seconds: float,
+                        bytes_sent: int = 0, bytes_received: int = 0,
+                        api: bool = True) -> None:
+        """Record one request to url answered with status (or failed)
+
+        Requests outside the API (`api=False`, e.g., badge images) are all
+        recorded under the IMAGE_ENDPOINT endpoint.
+        """
+        # pylint: disable=R0913
+
+        self.observe('badgr_request_duration_seconds', seconds,
+                     method=method,
+                     endpoint=endpoint_of(url) if api else IMAGE_ENDPOINT,
+                     status=status_class(status))
+        if bytes_sent:
+            self.increment('badgr_request_bytes_total', bytes_sent,
+                           direction='sent')
+        if bytes_received:
+            self.increment('badgr_request_bytes_total', bytes_received,
+                           direction='received')
+        if status == 401:
+            self.increment('badgr_unauthorized_total')
+
+    def counter(self, name: str, **labels: str) -> float:
+        """Return current value of counter name with the given labels"""
+
+        with self._lock:
+            return self._counters.get(
+                (name, tuple(sorted(labels.items()))), 0)
+
+    def histogram(self, name: str, **labels: str) -> Optional[Histogram]:
+        """Return histogram name with the given labels, if observed"""
+
+        with self._lock:
+            return self._histograms.get(
+                (name, tuple(sorted(labels.items()))))
+
+    def render(self) -> str:
+        """Return all metrics in Prometheus text exposition format"""
+
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, histogram.cumulative(), histogram.sum, histogram.count)
+                for key, histogram in self._histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} counter'.format(name))
+            lines.append('{}{} {}'.format(name, _format_labels(labels),
+                                          _format_value(value)))
+
+        for (name, labels), cumulative, total, count in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} histogram'.format(name))
+            for bound, bucket_count in cumulative:
+                lines.append('{}_bucket{} {}'.format(
+                    name, _format_labels(
+                        labels + (('le', _format_value(bound)),)),
+                    bucket_count))
+            lines.append('{}_sum{} {}'.format(name, _format_labels(labels),
+                                              _format_value(total)))
+            lines.append('{}_count{} {}'.format(name, _format_labels(labels),
+                                                count))
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def reset(self) -> None:
+        """Forget all recorded metrics"""
+
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
@@ -5,14 +5,44 @@
 # pylint: disable=R1710
 # pylint: disable=R1710
 
+import contextlib
 import json
 import os
-
-import requests
-from requests.models import Response
+import shutil
+import tempfile
+import threading
+import time
+from typing import (TYPE_CHECKING, Any, Callable, Dict, Generator, Iterable,
+                    Iterator, Optional, Sequence, Tuple)
 
 from badgr_lite import exceptions
-from .helpers import pythonic, to_datetime
+from .cache import CacheEntry, ResponseCache
+from .ratelimit import RateLimiter, parse_retry_after
+from .retry import RetryPolicy
+from .helpers import (imap_bounded, interleave_bounded, iter_json_items,
+                      json_loads, projector, pythonic, to_datetime)
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+# requests, sqlite3 and concurrent.futures are imported where first needed,
+# so that importing badgr_lite (e.g., for `badgr --help`) stays fast
+if TYPE_CHECKING:  # pragma: no cover
+    from concurrent.futures import Future
+    import requests
+    from requests.models import Response
+    from .dedup import AwardIndex
+    from .metrics import MetricsRegistry
+
+
+BASE_URL = 'https://api.badgr.io'
+API_URL = '{}/v2'.format(BASE_URL)
+TOKEN_URL = '{}/o/token'.format(BASE_URL)
+
+# Bytes of a streamed listing read from the network at a time
+STREAM_CHUNK_SIZE = 64 * 1024
 
 
 class Badge:
@@ -23,15 +53,29 @@ class Badge:
 
     The JSON object given by the Badgr API, loaded as a dict, can be used to
     instantiate the Badge class.
+
+    To stay compact when hundreds of thousands are held in memory, a Badge
+    keeps only a reference to the given dictionary. Pythonic attributes
+    (e.g., `issuer_open_badge_id` for `issuerOpenBadgeId`) are looked up in
+    it on access, and converted values (`created_at`) are decoded on first
+    access and then kept.
     """
     # There are enough public methods; pylint: disable=R0903
     # Attrs are dynamically assigned;  pylint: disable=E1101
 
+    __slots__ = ('_raw', '_decoded')
+
     REQUIRED_JSON = ['entityId', 'expires', 'entityType', 'extensions',
                      'openBadgeId', 'createdBy', 'issuer', 'image',
                      'issuerOpenBadgeId', 'createdAt']
     REQUIRED_ATTRS = [pythonic(attr) for attr in REQUIRED_JSON]
 
+    # Pythonic attribute name -> JSON key, shared by all badges
+    _JSON_KEYS: Dict[str, str] = {}
+
+    # Pythonic attribute name -> conversion applied on first access
+    _CONVERTERS: Dict[str, Callable] = {'created_at': to_datetime}
+
     def __init__(self, attrs: dict) -> None:
         """Initialize with single dictionary
 
@@ -44,30 +88,93 @@ class Badge:
         Also, `created_at` (createdAt) is converted from string to
         datetime.
         """
-        pythonic_attrs = {pythonic(k): v for k, v in attrs.items()}
-        if "created_at" in pythonic_attrs:
-            converted_value = to_datetime(pythonic_attrs['created_at'])
-            pythonic_attrs['created_at'] = converted_value
-
-        for pythonic_key, value in pythonic_attrs.items():
-            setattr(self, pythonic_key, value)
+        self._raw = attrs
+        self._decoded: Optional[dict] = None
 
-        self._attrs = pythonic_attrs
-        self._check_missing_but_required(pythonic_attrs)
+        json_keys = self._JSON_KEYS
+        pythonic_keys = set()
+        for key in attrs:
+            pythonic_key = pythonic(key)
+            pythonic_keys.add(pythonic_key)
+            if pythonic_key != key:
+                json_keys.setdefault(pythonic_key, key)
+        self._check_missing_but_required(pythonic_keys)
 
-    def _check_missing_but_required(self, pythonic_attrs: dict) -> None:
-        """Raise exception if required attributes not in pythonic_attrs
+    def _check_missing_but_required(self, pythonic_keys: set) -> None:
+        """Raise exception if required attributes not in pythonic_keys
 
         Raise exceptions.RequiredAttributesMissingError if required attributes
         are not given.
         """
-        missing_but_required =\
-            set(self.REQUIRED_ATTRS) - set(pythonic_attrs.keys())
+        missing_but_required = set(self.REQUIRED_ATTRS) - pythonic_keys
 
         if missing_but_required:
             raise exceptions.RequiredAttributesMissingError(
                 ", ".join(missing_but_required))
 
+    def _json_key(self, name: str) -> Optional[str]:
+        """Return key of the given dictionary holding attribute name"""
+
+        raw = self._raw
+        if name in raw:
+            return name
+        key = self._JSON_KEYS.get(name)
+        if key in raw:
+            return key
+        for key in raw:
+            if pythonic(key) == name:
+                return key
+        return None
+
+    def __getattr__(self, name: str):
+        """Look up (and decode on first access) a pythonic attribute"""
+
+        if name in Badge.__slots__:
+            # Not initialized (e.g., while unpickling)
+            raise AttributeError(name)
+
+        decoded = self._decoded
+        if decoded is not None and name in decoded:
+            return decoded[name]
+
+        key = self._json_key(name)
+        if key is None:
+            raise AttributeError(
+                "'Badge' object has no attribute '{}'".format(name))
+
+        value = self._raw[key]
+        converter = self._CONVERTERS.get(name)
+        if converter is not None:
+            value = converter(value)
+            if decoded is None:
+                decoded = self._decoded = {}
+            decoded[name] = value
+        return value
+
+    def __setattr__(self, name: str, value) -> None:
+        if name in Badge.__slots__:
+            object.__setattr__(self, name, value)
+            return
+        if self._decoded is None:
+            self._decoded = {}
+        self._decoded[name] = value
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) |
+                      {pythonic(key) for key in self._raw} |
+                      set(self._decoded or ()))
+
+    def __reduce__(self):
+        return self.__class__, (self._raw,)
+
+    def to_dict(self) -> dict:
+        """Return the API mapping the badge was created from
+
+        The mapping is returned as is (not copied), keys in camel case.
+        """
+
+        return self._raw
+
     def __str__(self):
         url = "https://badgr.io/public/assertions/{}".format(self.entity_id)
         name = "<No name>"
@@ -77,45 +184,174 @@ class Badge:
         return "{}\t{}\t{}".format(self.entity_id, url, name)
 
 
-class BadgrLite:
-    """Automate using Badgr API without the overhead of badgr-server"""
-    # pylint: disable=R0903
+def validate_award_result(status_code: int, data: Optional[dict]) -> None:
+    """Review status and JSON data of an award and raise any exceptions
+
+    `data` is the decoded response body; it is only consulted for 201 and
+    400 responses.
+    """
+
+    if status_code == 404:
+        raise exceptions.BadBadgeIdError(
+            exceptions.BadBadgeIdError.__doc__)
 
-    def __init__(self, token_filename: str) -> None:
+    if status_code == 400:
+        raise exceptions.AwardBadgeBadDataError(str(data))
+
+    if status_code != 201 or data is None or \
+            not data['status']['success'] or len(data['result']) != 1:
+        raise exceptions.ServerError(status_code, 'award')
+
+
+def validate_revoke_result(status_code: int, data: Optional[dict]) -> None:
+    """Review status and JSON data of a revocation and raise any exceptions
+
+    `data` is the decoded response body, if any.
+    """
+
+    if status_code == 404:
+        raise exceptions.BadAssertionIdError(
+            exceptions.BadAssertionIdError.__doc__)
+
+    if status_code == 400:
+        raise exceptions.RevokeAssertionBadDataError(str(data))
+
+    if status_code not in (200, 204) or (
+            data is not None and not data.get('status', {}).get(
+                'success', True)):
+        raise exceptions.ServerError(status_code, 'revoke')
+
+
+class TokenFileMixin:
+    """OAuth token handling shared by BadgrLite and AsyncBadgrLite
+
+    The token is kept in the JSON file `token_filename` (see
+    `prime_initial_token` in the Installation instructions). It is read by
+    `load_token` and rewritten whenever the token is refreshed.
+
+    `base_url` is the server to talk to (e.g., a badgr_lite.fakeserver for
+    testing); it defaults to BASE_URL.
+    """
+
+    def __init__(self, token_filename: str, token_cache: bool = True,
+                 base_url: str = BASE_URL) -> None:
+        self.base_url = base_url.rstrip('/')
+        self.api_url = '{}/v2'.format(self.base_url)
+        self.token_url = '{}/o/token'.format(self.base_url)
         self.token_filename = token_filename
-        self._token_data = None
+        self.token_cache = token_cache
+        self._token_data: Any = None
+        self._token_signature: Optional[tuple] = None
+        self._token_lock = threading.RLock()
+
+    def _stat_token_file(self) -> tuple:
+        """Return (inode, mtime, size) of token_filename
+
+        Raise exceptions.TokenFileNotFoundError if it does not exist.
+        """
+
+        try:
+            stat = os.stat(self.token_filename)
+        except FileNotFoundError:
+            raise exceptions.TokenFileNotFoundError(
+                "Token File Not Found.",
+                exceptions.TokenFileNotFoundError.__doc__) from None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
 
     def load_token(self) -> None:
         """Given initialization with token_filename, load token data
 
         Ensure token_filename exists. Load JSON data from the filename.
         Store in self._token_data
+
+        With `token_cache` (the default), the token is kept in memory and
+        the file is only read again once its inode, modification time or
+        size changes. Pass `token_cache=False` to read it on every call.
         """
-        if not os.path.exists(self.token_filename):
-            raise exceptions.TokenFileNotFoundError(
-                "Token File Not Found.",
-                exceptions.TokenFileNotFoundError.__doc__)
+        signature = self._stat_token_file()
+
+        with self._token_lock:
+            if (self.token_cache and self._token_data is not None and
+                    signature == self._token_signature):
+                return
+            with open(self.token_filename, 'r') as token_handler:
+                self._token_data = json.load(token_handler)
+            self._token_signature = signature
 
-        with open(self.token_filename, 'r') as token_handler:
-            self._token_data = json.load(token_handler)
+    def _is_stale(self, stale_access_token: Optional[str]) -> bool:
+        """Return True unless the stale token was already replaced
 
-    def refresh_token(self):
-        """Refresh access token from refresh_token"""
+        Refresh tokens are single use, so a caller that saw a 401 for
+        `stale_access_token` must not refresh again if someone else already
+        did while it waited.
+        """
 
-        response = requests.post(
-            'https://api.badgr.io/o/token',
-            data={'grant_type': 'refresh_token',
-                  'refresh_token': self._token_data['refresh_token']})
+        return (stale_access_token is None or
+                self._token_data['access_token'] == stale_access_token)
 
-        # An else after a raise is perfectly valid here; pylint: disable=R1720
-        if response.status_code == 401:
-            raise exceptions.TokenAndRefreshExpiredError
-        else:
-            assert response.status_code == 200
-            raw_data = response.json()
-            self._token_data = raw_data
-            with open(self.token_filename, 'w') as token_handler:
+    def _refresh_data(self) -> dict:
+        """Form data for exchanging the refresh token at token_url"""
+
+        return {'grant_type': 'refresh_token',
+                'refresh_token': self._token_data['refresh_token']}
+
+    def _store_token(self, raw_data: dict) -> None:
+        """Keep freshly issued token data and write it to token_filename
+
+        The file is replaced atomically (write to a temporary file in the
+        same directory, then rename), so other processes never read a
+        partially written token.
+        """
+
+        self._token_data = raw_data
+        directory = os.path.dirname(os.path.abspath(self.token_filename))
+        file_descriptor, temp_filename = tempfile.mkstemp(
+            dir=directory, prefix='.token', suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'w') as token_handler:
                 token_handler.write(json.dumps(raw_data))
+                token_handler.flush()
+                os.fsync(token_handler.fileno())
+            if os.path.exists(self.token_filename):
+                shutil.copymode(self.token_filename, temp_filename)
+            os.replace(temp_filename, self.token_filename)
+        except BaseException:
+            os.remove(temp_filename)
+            raise
+        self._token_signature = self._stat_token_file()
+
+    def _lock_token_file(self):
+        """Take exclusive advisory lock shared by all users of token file
+
+        The lock is held on a `.lock` file next to token_filename (the
+        token file itself is replaced on refresh). Returns the open lock
+        file, to be given to `_unlock_token_file`. On platforms without
+        `fcntl`, returns None and only in-process locking applies.
+        """
+
+        if fcntl is None:
+            return None
+        lock_handler = open(self.token_filename + '.lock', 'a')
+        fcntl.flock(lock_handler.fileno(), fcntl.LOCK_EX)
+        return lock_handler
+
+    @staticmethod
+    def _unlock_token_file(lock_handler) -> None:
+        """Release lock taken by `_lock_token_file`"""
+
+        if lock_handler is not None:
+            fcntl.flock(lock_handler.fileno(), fcntl.LOCK_UN)
+            lock_handler.close()
+
+    @contextlib.contextmanager
+    def _token_file_locked(self):
+        """Context manager holding the token file lock"""
+
+        lock_handler = self._lock_token_file()
+        try:
+            yield
+        finally:
+            self._unlock_token_file(lock_handler)
 
     def prepare_headers(self):
         """Prepare headers for communication with the server"""
@@ -124,17 +360,472 @@ class BadgrLite:
             self._token_data['access_token']),
                 'Content-Type': 'application/json'}
 
-    def get_from_server(self, url: str) -> dict:
-        """Communicate with the server"""
 
-        response = requests.get(url, headers=self.prepare_headers())
+class BadgrLite(TokenFileMixin):
+    """Automate using Badgr API without the overhead of badgr-server
+
+    All HTTP traffic goes through one long-lived `requests.Session` whose
+    connection pool is sized by `pool_connections` and `pool_maxsize`, so
+    repeated calls reuse the TCP/TLS connection to the server instead of
+    paying a handshake per call.
+
+    Thread safety: a single BadgrLite instance may be shared by concurrent
+    callers (e.g., the threads of a Django worker). The connection pool is
+    thread safe, and token loading and refreshing are serialized by an
+    internal lock so that only one thread refreshes an expired token while
+    the others pick up the result.
+
+    A caller-supplied `session` is used as is (no adapters are mounted and
+    it is not closed by `close()`).
+
+    With a `cache` (see badgr_lite.cache.ResponseCache), badge class
+    listings are stored on disk and revalidated with conditional GETs.
+
+    With an `award_index` (see badgr_lite.dedup.AwardIndex), badges already
+    awarded to a recipient are not awarded again.
+
+    With a `rate_limiter` (see badgr_lite.ratelimit.RateLimiter), requests
+    are paced to stay under the server's rate limit, and 429 Too Many
+    Requests answers are retried after Retry-After. Without one, a 429
+    raises exceptions.RateLimitedError.
+
+    Transient failures (5xx answers, connection errors, timeouts) are
+    retried with backoff according to `retry_policy` (see
+    badgr_lite.retry.RetryPolicy; the default makes up to 4 attempts).
+    Awards are only retried when the server cannot have issued them.
+
+    With `metrics` (see badgr_lite.metrics.MetricsRegistry), latency, bytes,
+    token refreshes and retries of every request are recorded.
+
+    With `stream_listings`, listings that do not go through the cache are
+    read as a gzip-compressed stream and decoded one record at a time (see
+    `iter_pages`), so memory is bounded by the largest record instead of
+    the size of a page.
+    """
+    # pylint: disable=R0903,R0913
+
+    def __init__(self, token_filename: str, session=None,
+                 pool_connections: int = 10, pool_maxsize: int = 10,
+                 keep_alive: bool = True, token_cache: bool = True,
+                 cache: Optional[ResponseCache] = None,
+                 award_index: Optional['AwardIndex'] = None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 metrics: Optional['MetricsRegistry'] = None,
+                 base_url: str = BASE_URL,
+                 stream_listings: bool = False) -> None:
+        super().__init__(token_filename, token_cache, base_url)
+        self.stream_listings = stream_listings
+        self.cache = cache
+        self.award_index = award_index
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.metrics = metrics
+        self._owns_session = session is None
+        if session is None:
+            session = self._create_session(
+                pool_connections, pool_maxsize, keep_alive)
+        self.session = session
+
+    @staticmethod
+    def _create_session(pool_connections: int, pool_maxsize: int,
+                        keep_alive: bool) -> 'requests.Session':
+        """Create a connection-pooled session for talking to the server"""
+
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def close(self) -> None:
+        """Release pooled connections if the session is owned by us"""
+
+        if self._owns_session:
+            self.session.close()
+
+    def __enter__(self) -> 'BadgrLite':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def refresh_token(self, stale_access_token: Optional[str] = None) -> None:
+        """Refresh access token from refresh_token
+
+        Refresh tokens are single use, so refreshing is single-flight
+        across the threads of this process and, through an advisory lock
+        on the token file, across processes sharing the token file. Once
+        the locks are held, the token file is read again: if another thread
+        or process already replaced `stale_access_token` (by default, the
+        token currently loaded), its new token is used and no request is
+        made.
+        """
+
+        with self._token_lock:
+            if stale_access_token is None:
+                stale_access_token = self._token_data['access_token']
+            if not self._is_stale(stale_access_token):
+                return
+
+            with self._token_file_locked():
+                self.load_token()
+                if not self._is_stale(stale_access_token):
+                    return
+
+                # Paced and retried like API requests, without the
+                # (stale) access token
+                response = self._send('POST', self.token_url, {},
+                                      authorize=False,
+                                      data=self._refresh_data())
+                if response.status_code == 401:
+                    raise exceptions.TokenAndRefreshExpiredError
+                self._ensure_ok(response)
+                self._store_token(response.json())
+                if self.metrics is not None:
+                    self.metrics.increment('badgr_token_refreshes_total')
+
+    def _request(self, method: str, url: str, headers=None,
+                 **kwargs) -> 'Response':
+        """Send request over the pooled session
+
+        `headers` are sent in addition to the authorization headers. If the
+        server answers 401, refresh the token once and try again.
+        """
+
+        extra_headers = headers or {}
+        access_token = self._token_data['access_token']
+        response = self._send(method, url, extra_headers, **kwargs)
         if response.status_code == 401:
-            self.refresh_token()
-            response = requests.get(url, headers=self.prepare_headers())
+            # Give the connection back before sending again
+            self._close(response, kwargs.get('stream', False))
+            self.refresh_token(stale_access_token=access_token)
+            response = self._send(method, url, extra_headers, **kwargs)
             if response.status_code == 401:
+                self._close(response, kwargs.get('stream', False))
                 raise exceptions.TokenAndRefreshExpiredError
-        assert response.status_code == 200
-        return response.json()
+        return response
+
+    def _send(self, method: str, url: str, extra_headers: dict,
+              api: bool = True, authorize: bool = True,
+              **kwargs) -> 'Response':
+        """Send request paced by the rate limiter, retrying 429 answers
+
+        Transient failures are retried according to the retry policy.
+        Requests to other hosts than the API (`api=False`, e.g., images on
+        the media host) carry no token and are not paced. Requests to the
+        token endpoint (`authorize=False`) are paced but carry no token.
+        """
+
+        limiter = self.rate_limiter if api else None
+        streamed = kwargs.get('stream', False)
+        rate_limited = retries = 0
+        while True:
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                response = self._session_request(
+                    method, url, api,
+                    headers=dict(self.prepare_headers(), **extra_headers)
+                    if api and authorize else extra_headers,
+                    **kwargs)
+            except self.retry_policy.retry_exceptions as error:
+                delay = self.retry_policy.retry_delay(
+                    method, url, retries, error)
+                if delay is None:
+                    raise
+                self._count_retry(type(error).__name__)
+                retries += 1
+                time.sleep(delay)
+                continue
+
+            if response.status_code == 429:
+                self._close(response, streamed)
+                retry_after = parse_retry_after(
+                    response.headers.get('Retry-After'))
+                if limiter is None or rate_limited >= limiter.max_retries:
+                    raise exceptions.RateLimitedError(retry_after)
+                limiter.throttle(retry_after)
+                self._count_retry('rate_limited')
+                rate_limited += 1
+                continue
+
+            if limiter is not None:
+                limiter.succeeded()
+            delay = self.retry_policy.retry_delay(
+                method, url, retries, response.status_code) \
+                if response.status_code >= 500 else None
+            if delay is None:
+                return response
+            self._close(response, streamed)
+            self._count_retry(str(response.status_code))
+            retries += 1
+            time.sleep(delay)
+
+    def _session_request(self, method: str, url: str, api: bool = True,
+                         **kwargs) -> 'Response':
+        """Send one request over the session, recording it in metrics"""
+
+        if self.metrics is None:
+            return self.session.request(method, url, **kwargs)
+
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except BaseException as error:
+            self.metrics.observe_request(method, url, error,
+                                         time.perf_counter() - started,
+                                         api=api)
+            raise
+        body = response.request.body if response.request else None
+        # A streamed body is counted once read, when it is closed
+        received = 0 if kwargs.get('stream') else self._bytes_read(response)
+        self.metrics.observe_request(
+            method, url, response.status_code, time.perf_counter() - started,
+            len(body) if body else 0, received, api)
+        return response
+
+    @staticmethod
+    def _bytes_read(response: 'Response') -> int:
+        """Return number of body bytes read off the wire so far
+
+        These are the bytes as sent, before any gzip decoding.
+        """
+
+        tell = getattr(response.raw, 'tell', None)
+        if tell is None:
+            return len(response.content or b'')
+        return tell()
+
+    def _close(self, response: 'Response', streamed: bool = True) -> None:
+        """Close response, returning its connection to the pool
+
+        The bytes read from a streamed response are counted now; those of
+        other responses were counted by `_session_request`.
+        """
+
+        response.close()
+        if streamed and self.metrics is not None:
+            received = self._bytes_read(response)
+            if received:
+                self.metrics.increment('badgr_request_bytes_total', received,
+                                       direction='received')
+
+    def _count_retry(self, reason: str) -> None:
+        if self.metrics is not None:
+            self.metrics.increment('badgr_retries_total', reason=reason)
+
+    @staticmethod
+    def _ensure_ok(response: 'Response') -> None:
+        """Raise ServerError unless the server answered 200 OK"""
+
+        if response.status_code != 200:
+            raise exceptions.ServerError(response.status_code, response.url)
+
+    def get_from_server(self, url: str) -> dict:
+        """Communicate with the server"""
+
+        response = self._request('GET', url)
+        self._ensure_ok(response)
+        return json_loads(response.content)
+
+    def _get_listing(self, url: str,
+                     use_cache: bool = False) -> Tuple[bytes, Optional[str]]:
+        """GET one page of a listing
+
+        Return the response body and the URL of the next page (from the
+        `Link: <...>; rel="next"` header), or None on the last page. With
+        `use_cache` and a configured cache, a stored copy is revalidated
+        instead of downloaded again.
+        """
+
+        if not use_cache or self.cache is None:
+            response = self._request('GET', url)
+            self._ensure_ok(response)
+            return (response.content,
+                    response.links.get('next', {}).get('url'))
+
+        key = self.cache.key(url, os.path.abspath(self.token_filename))
+        entry = self.cache.get(key)
+        if entry is not None and self.cache.is_fresh(entry):
+            return entry.body, entry.next_url
+
+        response = self._request(
+            'GET', url,
+            headers=entry.conditional_headers() if entry else None)
+        if response.status_code == 304 and entry is not None:
+            self.cache.revalidated(key, entry)
+            return entry.body, entry.next_url
+
+        self._ensure_ok(response)
+        entry = CacheEntry(response.content, response.headers.get('ETag'),
+                           response.headers.get('Last-Modified'),
+                           response.links.get('next', {}).get('url'))
+        self.cache.put(key, entry)
+        return entry.body, entry.next_url
+
+    def _fetch_page(self, url: str,
+                    use_cache: bool = False) -> Tuple[list, Optional[str]]:
+        """Fetch one page of a listing
+
+        Return the page's `result` list and the URL of the next page, or
+        None on the last page.
+        """
+
+        content, next_url = self._get_listing(url, use_cache)
+        return json_loads(content)['result'], next_url
+
+    def _stream_page(self, url: str) -> Tuple[Generator,
+                                              Optional[str]]:
+        """Open one page of a listing as a stream
+
+        Return an iterator decoding the page's `result` records as they
+        are read from the socket (gzip-decoded, as requests accepts gzip by
+        default), and the URL of the next page (known from the headers
+        alone), or None on the last page. The response is closed once the
+        iterator is exhausted or closed.
+        """
+
+        response = self._request('GET', url, stream=True)
+        if response.status_code != 200:
+            self._close(response)
+            self._ensure_ok(response)
+
+        def records() -> Generator:
+            try:
+                yield from iter_json_items(
+                    response.iter_content(STREAM_CHUNK_SIZE))
+            finally:
+                self._close(response)
+
+        return records(), response.links.get('next', {}).get('url')
+
+    def iter_pages(self, url: str, prefetch: bool = False,
+                   use_cache: bool = False) -> Iterator[Iterable]:
+        """Yield the `result` list of each page of a listing at url
+
+        Pagination cursors are followed until the last page. With
+        `prefetch`, the next page is requested in the background while the
+        caller works on the current one. With `use_cache`, pages go through
+        the configured response cache.
+
+        With `stream_listings` (and unless the page comes from the cache),
+        each page is instead an iterator of its records, decoded while the
+        response is read. The next page is only requested once the caller
+        moves on, and records of a page left unread are dropped
+        (`prefetch` does not apply: it would hold a whole page in memory).
+        """
+
+        if self.stream_listings and not (use_cache and
+                                         self.cache is not None):
+            next_url: Optional[str] = url
+            while next_url:
+                records, next_url = self._stream_page(next_url)
+                try:
+                    yield records
+                finally:
+                    records.close()
+            return
+
+        if not prefetch:
+            next_url = url
+            while next_url:
+                result, next_url = self._fetch_page(next_url, use_cache)
+                yield result
+            return
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future: Optional['Future'] = executor.submit(
+                self._fetch_page, url, use_cache)
+            while future is not None:
+                result, next_url = future.result()
+                future = (executor.submit(self._fetch_page, next_url,
+                                          use_cache)
+                          if next_url else None)
+                yield result
+
+    def iter_badges(self, prefetch: bool = False,
+                    fields: Optional[Sequence[str]] = None) -> Iterator:
+        """Lazily yield badges from Server, page by page
+
+        Unlike `badges`, the first Badge is available as soon as the first
+        page arrives, and only one page (two with `prefetch`) is held in
+        memory at a time. Pages go through the response cache, if any;
+        without one, `stream_listings` holds only one badge at a time.
+
+        With `fields` (pythonic names such as `entity_id`, or API keys),
+        dictionaries of only those fields are yielded instead of Badges:
+        other fields are never looked at, and values are left as sent by
+        the API (e.g., `created_at` is not parsed).
+
+        Example:
+
+        >>> badgr = BadgrLite(token_filename='./token.json')
+        >>> for badge in badgr.iter_badges(prefetch=True):
+        ...     print(badge)
+        >>> for record in badgr.iter_badges(fields=['entity_id', 'name']):
+        ...     print(record['entity_id'], record['name'])
+        """
+        self.load_token()
+        wrap = Badge if fields is None else projector(fields)
+        for page in self.iter_pages('{}/badgeclasses'.format(self.api_url),
+                                    prefetch=prefetch, use_cache=True):
+            for raw_badge in page:
+                yield wrap(raw_badge)
+
+    def iter_assertions(self, badge_id: Optional[str] = None,
+                        issuer_id: Optional[str] = None,
+                        badge_ids: Optional[Iterable[str]] = None,
+                        max_workers: int = 4,
+                        buffer_size: int = 1000) -> Iterator[Badge]:
+        """Lazily yield assertions (awarded badges) from Server
+
+        - `badge_id`: assertions of one badge class
+        - `issuer_id`: assertions of one issuer
+        - `badge_ids`: assertions of several badge classes
+        - none of these: assertions of every badge class
+
+        Single listings are paged through lazily. Several badge classes are
+        fetched in parallel, `max_workers` assertion streams at once over
+        the pooled session, and their assertions are yielded as they arrive
+        (in no particular order). At most `buffer_size` assertions wait for
+        the caller, so memory stays flat however many there are.
+
+        Example:
+
+        >>> badgr = BadgrLite(token_filename='./token.json')
+        >>> for assertion in badgr.iter_assertions(max_workers=8):
+        ...     print(assertion.badgeclass, assertion.recipient['identity'])
+        """
+        self.load_token()
+        if badge_id is not None:
+            return self._iter_assertions_of(
+                '{}/badgeclasses/{}/assertions'.format(self.api_url, badge_id))
+        if issuer_id is not None:
+            return self._iter_assertions_of(
+                '{}/issuers/{}/assertions'.format(self.api_url, issuer_id))
+
+        if badge_ids is None:
+            badge_ids = (badge.entity_id for badge in self.iter_badges())
+        return interleave_bounded(
+            lambda each_id: self._iter_assertions_of(
+                '{}/badgeclasses/{}/assertions'.format(self.api_url, each_id)),
+            badge_ids, max_workers, buffer_size)
+
+    def _iter_assertions_of(self, url: str) -> Iterator[Badge]:
+        """Yield assertions listed at url, page by page"""
+
+        for page in self.iter_pages(url):
+            for raw_assertion in page:
+                yield Badge(raw_assertion)
 
     @property
     def badges(self) -> list:
@@ -151,30 +842,139 @@ class BadgrLite:
         yzExTDvOTnOx_R3YhwPf3A: Test Driven Development Fundamentals Champion
         yNjcY70FSn603SO9vMGhBA: Install Python with Virtual Environments
         """
+        return list(self.iter_badges())
+
+    def revoke_assertion(self, entity_id: str, reason: str) -> None:
+        """Revoke the assertion (awarded badge) entity_id for reason
+
+        Raises exceptions.BadAssertionIdError for an unknown assertion and
+        exceptions.RevokeAssertionBadDataError if the server refuses the
+        revocation (e.g., it is already revoked). With an `award_index`,
+        the revoked award is forgotten, so the badge can be awarded again.
+
+        Example:
+
+        >>> badgr = BadgrLite(token_filename='./token.json')
+        >>> badgr.revoke_assertion('qv4DMvnYT0Gwz7wquRasvg',
+        ...                        'Awarded by mistake')
+        """
+
         self.load_token()
-        raw_data = self.get_from_server(
-            'https://api.badgr.io/v2/badgeclasses')['result']
+        url = '{}/assertions/{}'.format(self.api_url, entity_id)
+        response = self._request('DELETE', url,
+                                 json={'revocation_reason': reason})
+        data = None
+        if response.content:
+            try:
+                data = response.json()
+            except ValueError:
+                pass
+        validate_revoke_result(response.status_code, data)
+        if self.award_index is not None:
+            self.award_index.forget(entity_id)
 
-        return [Badge(b) for b in raw_data]
+    def revoke_assertions(self, revocations: Iterable[Tuple[str, str]],
+                          max_workers: int = 8) -> Iterator[Tuple]:
+        """Revoke many assertions concurrently
 
-    def _validate_award_badge_response(self, response: Response) -> None:
-        """Review response from Badge().award and raise any exceptions"""
-        # It's okay as a function here; pylint: disable=R0201
+        Given an iterable of (entity_id, reason) pairs, revoke each
+        assertion using a pool of `max_workers` threads sharing this
+        instance's session. At most `max_workers` revocations are in
+        flight, and `revocations` is consumed lazily.
+
+        Yields (entity_id, reason, outcome) as each revocation completes,
+        where outcome is None or the exception raised for that item.
 
-        if response.status_code == 404:
-            raise exceptions.BadBadgeIdError(
-                exceptions.BadBadgeIdError.__doc__)
+        Example:
+
+        >>> badgr = BadgrLite(token_filename='./token.json')
+        >>> revocations = [(entity_id, 'Awarded by mistake')
+        ...                for entity_id in entity_ids]
+        >>> for entity_id, _, outcome in badgr.revoke_assertions(revocations):
+        ...     print(entity_id, outcome or 'revoked')
+        """
+
+        self.load_token()
+
+        def revoke(pair: Tuple[str, str]) -> None:
+            self.revoke_assertion(*pair)
 
-        if response.status_code == 400:
-            raise exceptions.AwardBadgeBadDataError(str(response.json()))
+        for (entity_id, reason), outcome in imap_bounded(
+                revoke, revocations, max_workers):
+            yield entity_id, reason, outcome
 
-        assert response.status_code == 201 and\
-            response.json()['status']['success']
-        assert len(response.json()['result']) == 1
+    def fetch_images(self, badges: Iterable[Badge], dest: str,
+                     max_workers: int = 8) -> Iterator[Tuple]:
+        """Download the images of badges into directory dest, in parallel
+
+        Images are fetched by a pool of `max_workers` threads sharing this
+        instance's session, streamed to disk, and stored once per content
+        (see badgr_lite.images.ImageStore). Images fetched before are
+        revalidated with conditional GETs and not downloaded again unless
+        they changed. `badges` is consumed lazily.
+
+        Yields (badge, outcome) as each image is stored, where outcome is
+        the path of the image file, None for a badge without image, or the
+        exception raised.
+
+        Example:
+
+        >>> badgr = BadgrLite(token_filename='./token.json')
+        >>> for badge, path in badgr.fetch_images(badgr.iter_badges(),
+        ...                                       'images', max_workers=16):
+        ...     print(badge.entity_id, path)
+        """
+        from .images import ImageStore
+
+        store = ImageStore(dest)
+
+        def fetch(badge: Badge) -> Optional[str]:
+            url = getattr(badge, 'image', None)
+            return self._fetch_image(store, url) if url else None
+
+        try:
+            yield from imap_bounded(fetch, badges, max_workers)
+        finally:
+            store.save()
+
+    def _fetch_image(self, store, url: str) -> str:
+        """Revalidate or download the image at url into store
+
+        If the stored copy was removed meanwhile, the image is downloaded
+        again, once: raise ServerError if the server still answers 304.
+        """
+
+        unconditional: dict = {}
+        for headers in (store.conditional_headers(url), unconditional):
+            response = self._send('GET', url, headers, api=False,
+                                  stream=True)
+            try:
+                if response.status_code != 304:
+                    self._ensure_ok(response)
+                    return store.store(url, response)
+                path = store.path_of(url)
+                if path is not None:
+                    return path
+            finally:
+                self._close(response)
+        raise exceptions.ServerError(response.status_code, url)
+
+    def _validate_award_badge_response(self,
+                                       response: 'Response') -> None:
+        """Review response from Badge().award and raise any exceptions"""
+        # It's okay as a function here; pylint: disable=R0201
+
+        data = None
+        if response.status_code in (400, 201):
+            data = response.json()
+        validate_award_result(response.status_code, data)
 
     def award_badge(self, badge_id: str, badge_data: dict) -> Badge:
         """Given a previously created badge_id and badge_data, award badge
 
+        With an `award_index`, a badge already awarded to the recipient is
+        not awarded again: the recorded assertion is returned instead.
+
         Example:
 
         >>> badgr = BadgrLite(token_filename='./token.json')
@@ -197,15 +997,48 @@ class BadgrLite:
         """
 
         self.load_token()
-        base = 'https://api.badgr.io/v2'
-        url = '{}/badgeclasses/{}/assertions'.format(base, badge_id)
-        headers = self.prepare_headers()
-        response = requests.post(url, headers=headers, json=badge_data)
-        if response.status_code == 401:
-            self.refresh_token()
-            response = requests.post(url, headers=headers, json=badge_data)
-            if response.status_code == 401:
-                raise exceptions.TokenAndRefreshExpiredError
+        recipient = (badge_data.get('recipient') or {}).get('identity')
+        if self.award_index is not None and recipient:
+            known_assertion = self.award_index.get(badge_id, recipient)
+            if known_assertion is not None:
+                return Badge(known_assertion)
 
+        url = '{}/badgeclasses/{}/assertions'.format(self.api_url, badge_id)
+        response = self._request('POST', url, json=badge_data)
         self._validate_award_badge_response(response)
-        return Badge(response.json()['result'][0])
+        assertion = response.json()['result'][0]
+        if self.award_index is not None and recipient:
+            self.award_index.record(badge_id, recipient, assertion)
+        return Badge(assertion)
+
+    def award_badges(self, awards: Iterable[Tuple[str, dict]],
+                     max_workers: int = 8) -> Iterator[Tuple]:
+        """Award many badges concurrently
+
+        Given an iterable of (badge_id, badge_data) pairs, award each badge
+        using a pool of `max_workers` threads sharing this instance's
+        session. At most `max_workers` awards are in flight, and `awards` is
+        consumed lazily.
+
+        Yields (badge_id, badge_data, result) as each award completes, where
+        result is the awarded Badge or the exception raised for that item.
+        If the token has expired, it is refreshed only once no matter how
+        many in-flight awards see a 401.
+
+        Example:
+
+        >>> badgr = BadgrLite(token_filename='./token.json')
+        >>> awards = [(badge_id, {"recipient": {"identity": email}})
+        ...           for email in emails]
+        >>> for badge_id, badge_data, result in badgr.award_badges(awards):
+        ...     print(result)
+        """
+
+        self.load_token()
+
+        def award(pair: Tuple[str, dict]) -> Badge:
+            return self.award_badge(*pair)
+
+        for (badge_id, badge_data), result in imap_bounded(
+                award, awards, max_workers):
+            yield badge_id, badge_data, result
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+"""Pool of BadgrLite clients, one per Badgr account
+
+Organizations issuing under several accounts (one token file each) can
+drive all of them from one process:
+
+>>> pool = AccountPool.from_token_files(
+...     {'acme': 'acme/token.json', 'globex': 'globex/token.json'}, rate=5)
+>>> pool.award_badge(badge_id, badge_data)  # routed to the owning account
+>>> for badge_id, badge_data, result in pool.award_badges(awards):
+...     print(result)
+
+Every account keeps its own token, connection pool and rate limiter, so
+awards of different accounts proceed in parallel, each at its own rate.
+"""
+
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from badgr_lite import exceptions
+from .helpers import interleave_bounded, put_unless_stopped
+from .models import Badge, BadgrLite
+from .ratelimit import RateLimiter
+
+# Marks the end of a stream between threads
+_END = object()
+
+
+class AccountPool:
+    """Route calls to the BadgrLite client of the account owning a badge
+
+    `clients` maps account names to BadgrLite instances. Which account owns
+    a badge class (or an issuer) is learnt by listing the badge classes of
+    every account (`discover`), on first use and again, at most every
+    `rediscover_interval` seconds, when an unknown badge ID is asked for.
+    `routes` may map badge class or issuer IDs to account names up front.
+
+    An account whose badge classes cannot be listed (e.g., its credentials
+    were revoked) is recorded in `unavailable`, mapped to the exception
+    raised, until it is listed again; the other accounts are still routed
+    to.
+
+    A pool may be shared by threads.
+    """
+
+    def __init__(self, clients: Dict[str, BadgrLite],
+                 routes: Optional[Dict[str, str]] = None,
+                 rediscover_interval: float = 60.0) -> None:
+        if not clients:
+            raise ValueError('AccountPool needs at least one client')
+        self.clients = clients
+        self.rediscover_interval = rediscover_interval
+        self._routes: Dict[str, str] = dict(routes or {})
+        self._lock = threading.Lock()
+        self._discover_lock = threading.Lock()
+        self._discovered_at: Optional[float] = None
+        self.unavailable: Dict[str, BaseException] = {}
+
+    @classmethod
+    def from_token_files(cls, token_files: Union[Dict[str, str],
+                                                 Iterable[str]],
+                         rate: Optional[float] = None, burst: int = 1,
+                         **options) -> 'AccountPool':
+        """Return pool of one BadgrLite per token file
+
+        token_files maps account names to token files (a plain list of
+        token files names each account after its file). With `rate`, each
+        account gets its own RateLimiter(rate, burst). Other options are
+        given to every BadgrLite.
+        """
+
+        if not isinstance(token_files, dict):
+            token_files = {path: path for path in token_files}
+        return cls({name: BadgrLite(
+            token_filename=path,
+            rate_limiter=RateLimiter(rate, burst) if rate else None,
+            **options) for name, path in token_files.items()})
+
+    def load_token(self) -> None:
+        """Load the token of every account"""
+
+        for client in self.clients.values():
+            client.load_token()
+
+    def _map_accounts(self, func) -> List[tuple]:
+        """Return [(name, outcome), ...], calling func(client) in parallel
+
+        outcome is the return value of func or the exception it raised.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=len(self.clients)) as executor:
+            futures = [(name, executor.submit(func, client))
+                       for name, client in self.clients.items()]
+            return [(name, future.exception() or future.result())
+                    for name, future in futures]
+
+    def discover(self) -> int:
+        """Learn which account owns each badge class and issuer
+
+        The badge classes of all accounts are listed in parallel. Return the
+        number of badge classes found (accounts that fail are recorded in
+        `unavailable`).
+        """
+
+        return len(self.badges())
+
+    def _learn(self, name: str, badges: List[Badge]) -> None:
+        """Route badges, and their issuers, to account name"""
+
+        with self._lock:
+            for badge in badges:
+                self._routes[badge.entity_id] = name
+                issuer = getattr(badge, 'issuer', None)
+                if issuer:
+                    self._routes[issuer] = name
+
+    def account_of(self, entity_id: str) -> str:
+        """Return name of the account owning badge class or issuer ID
+
+        Raises exceptions.BadBadgeIdError if no account owns it.
+        """
+
+        with self._lock:
+            name = self._routes.get(entity_id)
+        if name is not None:
+            return name
+
+        # One thread lists badge classes; the others wait for its result
+        asked_at = time.monotonic()
+        with self._discover_lock:
+            discovered_at = self._discovered_at
+            if discovered_at is None or (
+                    discovered_at < asked_at and
+                    asked_at - discovered_at >= self.rediscover_interval):
+                self.discover()
+        with self._lock:
+            name = self._routes.get(entity_id)
+        if name is None:
+            raise exceptions.BadBadgeIdError(
+                exceptions.BadBadgeIdError.__doc__)
+        return name
+
+    def client_of(self, entity_id: str) -> BadgrLite:
+        """Return client of the account owning badge class or issuer ID"""
+
+        return self.clients[self.account_of(entity_id)]
+
+    def badges(self, issuer_id: Optional[str] = None) -> List[Badge]:
+        """Return badge classes of all accounts, or of issuer_id's account
+
+        Accounts are listed in parallel; badges come in account order.
+        Accounts that cannot be listed are skipped and recorded in
+        `unavailable`; the first error is raised if no account could be.
+        """
+
+        if issuer_id is not None:
+            name = self.account_of(issuer_id)
+            badges = self.clients[name].badges
+            self._learn(name, badges)
+            return badges
+
+        listed = []
+        for name, outcome in self._map_accounts(
+                lambda client: client.badges):
+            if isinstance(outcome, BaseException):
+                self.unavailable[name] = outcome
+                continue
+            self.unavailable.pop(name, None)
+            self._learn(name, outcome)
+            listed.append(outcome)
+        self._discovered_at = time.monotonic()
+        if not listed:
+            raise self.unavailable[next(iter(self.clients))]
+        return [badge for badges in listed for badge in badges]
+
+    def award_badge(self, badge_id: str, badge_data: dict) -> Badge:
+        """Award badge_id with the client of the account owning it
+
+        See BadgrLite.award_badge.
+        """
+
+        return self.client_of(badge_id).award_badge(badge_id, badge_data)
+
+    def award_badges(self, awards: Iterable[Tuple[str, dict]],
+                     max_workers: int = 8,
+                     buffer_size: int = 100) -> Iterator[Tuple]:
+        """Award many badges, every account in parallel
+
+        Awards are routed to per-account streams, each awarded by
+        `BadgrLite.award_badges` with `max_workers` threads of its own, so
+        that a slow or rate limited account does not hold the others back
+        (until `buffer_size` of its awards wait, at which point reading
+        `awards` waits for it).
+
+        Yields (badge_id, badge_data, result) as each award completes, where
+        result is the awarded Badge or the exception raised for that item
+        (exceptions.BadBadgeIdError for badges of no account). If the token
+        of an account cannot be loaded, each of its awards gives that error
+        and the account is recorded in `unavailable`.
+        """
+        import queue
+
+        stop = threading.Event()
+        inboxes: Dict[str, queue.Queue] = {
+            name: queue.Queue(maxsize=buffer_size) for name in self.clients}
+
+        def dispatch() -> Iterator[Tuple]:
+            """Route awards to inboxes, yield those of no account"""
+
+            try:
+                for badge_id, badge_data in awards:
+                    try:
+                        name = self.account_of(badge_id)
+                    except exceptions.BadBadgeIdError as error:
+                        yield badge_id, badge_data, error
+                        continue
+                    if not put_unless_stopped(inboxes[name],
+                                              (badge_id, badge_data), stop):
+                        return
+            finally:
+                for inbox in inboxes.values():
+                    put_unless_stopped(inbox, _END, stop)
+
+        def stream(name: str) -> Iterator[Tuple[str, dict]]:
+            inbox = inboxes[name]
+            while not stop.is_set():
+                try:
+                    item = inbox.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _END:
+                    return
+                yield item
+
+        def award(name: Optional[str]) -> Iterator[Tuple]:
+            if name is None:
+                return dispatch()
+            client = self.clients[name]
+            try:
+                client.load_token()
+            except BaseException as error:  # pylint: disable=W0703
+                self.unavailable[name] = failure = error
+                return ((badge_id, badge_data, failure)
+                        for badge_id, badge_data in stream(name))
+            return client.award_badges(stream(name), max_workers)
+
+        try:
+            # The dispatcher (None) runs beside one thread per account
+            yield from interleave_bounded(
+                award, [None] + list(self.clients), len(self.clients) + 1,
+                buffer_size)
+        finally:
+            stop.set()
+
+    def close(self) -> None:
+        """Release the connection pools of all accounts"""
+
+        for client in self.clients.values():
+            client.close()
+
+    def __enter__(self) -> 'AccountPool':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
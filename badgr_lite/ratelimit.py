@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+"""Client-side rate limiting shared by concurrent BadgrLite callers"""
+
+import json
+import threading
+import time
+from typing import Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Return seconds to wait from a Retry-After header, or None
+
+    Retry-After is either a number of seconds or an HTTP date.
+    """
+
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    import email.utils
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RateLimiter:
+    """Token bucket limiting requests per second, adapting to 429s
+
+    All callers of `acquire` share one bucket of `burst` requests refilled
+    at `rate` requests per second, so the threads of one BadgrLite (or,
+    with `shared_filename`, all local processes naming the same file) stay
+    under one budget instead of bursting into rate limiting.
+
+    When the server answers 429 Too Many Requests, `throttle` pauses every
+    caller for Retry-After seconds and halves the rate (not below
+    `min_rate`). Each success (`succeeded`) adds back a twentieth of the
+    configured rate, so throughput settles near what the server
+    tolerates.
+
+    A 429 is retried up to `max_retries` times before
+    exceptions.RateLimitedError is raised.
+    """
+
+    def __init__(self, rate: float, burst: float = 1,
+                 min_rate: Optional[float] = None,
+                 shared_filename: Optional[str] = None,
+                 max_retries: int = 5) -> None:
+        self.max_rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.min_rate = float(min_rate) if min_rate else self.max_rate / 20
+        self.shared_filename = shared_filename
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        # Theoretical arrival time of next request (GCRA) and current rate
+        self._state: Tuple[float, float] = (0.0, self.max_rate)
+
+    @property
+    def rate(self) -> float:
+        """Current (adapted) rate in requests per second"""
+
+        return self._update(lambda now, tat, rate: (tat, rate, rate))
+
+    def _update(self, change):
+        """Apply change(now, tat, rate) -> (tat, rate, result) atomically
+
+        State lives in this object, or in shared_filename (under an
+        advisory lock) when shared between processes.
+        """
+
+        with self._lock:
+            now = time.time()
+            if self.shared_filename is None or fcntl is None:
+                tat, rate, result = change(now, *self._state)
+                self._state = (tat, rate)
+                return result
+
+            with open(self.shared_filename, 'a+') as state_h:
+                fcntl.flock(state_h.fileno(), fcntl.LOCK_EX)
+                try:
+                    state_h.seek(0)
+                    try:
+                        state = json.loads(state_h.read())
+                        old_tat, old_rate = state['tat'], state['rate']
+                    except (ValueError, KeyError):
+                        old_tat, old_rate = self._state
+                    tat, rate, result = change(now, old_tat, old_rate)
+                    state_h.seek(0)
+                    state_h.truncate()
+                    state_h.write(json.dumps({'tat': tat, 'rate': rate}))
+                    state_h.flush()
+                finally:
+                    fcntl.flock(state_h.fileno(), fcntl.LOCK_UN)
+            self._state = (tat, rate)
+            return result
+
+    def acquire(self) -> float:
+        """Wait until a request may be sent, return seconds waited"""
+
+        def reserve(now, tat, rate):
+            interval = 1.0 / rate
+            tat = max(tat, now)
+            wait = tat - (self.burst - 1) * interval - now
+            return tat + interval, rate, max(0.0, wait)
+
+        wait = self._update(reserve)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def throttle(self, retry_after: Optional[float] = None) -> None:
+        """Back off after a 429: pause all callers and lower the rate"""
+
+        def back_off(now, tat, rate):
+            rate = max(self.min_rate, rate / 2)
+            pause = retry_after if retry_after is not None else 1.0 / rate
+            # Let the pause pass before even a full bucket is used
+            resume = now + pause + (self.burst - 1) / rate
+            return max(tat, resume), rate, None
+
+        self._update(back_off)
+
+    def succeeded(self) -> None:
+        """Recover rate after a request that was not rate limited"""
+
+        def recover(now, tat, rate):
+            return tat, min(self.max_rate, rate + self.max_rate / 20), None
+
+        if self._state[1] < self.max_rate:
+            self._update(recover)
+
+    def reset(self) -> None:
+        """Forget pauses and adaptations (also for other processes)"""
+
+        self._update(lambda now, tat, rate: (0.0, self.max_rate, None))
+
+    def __repr__(self) -> str:
+        return 'RateLimiter(rate={}, burst={})'.format(self.max_rate,
+                                                       self.burst)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""Retrying transient server and network failures"""
+
+import logging
+import random
+from typing import Callable, Iterable, Optional, Tuple, Type, Union
+
+LOGGER = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+
+class RetryPolicy:
+    """When and how long to wait before repeating a failed request
+
+    A request failing with one of `retry_statuses` or raising one of
+    `retry_exceptions` (by default, requests.ConnectionError and
+    requests.Timeout) is sent again, up to `max_attempts` sends in total.
+    Before retry n (counting from 0) the caller sleeps a random time
+    between 0 and min(`backoff_cap`, `backoff_base` * 2 ** n) seconds
+    ("full jitter"), so that concurrent callers do not retry in lock step.
+
+    Idempotent requests (GET, ...) are retried on any of these failures.
+    Other requests, such as the POST awarding a badge, are retried only
+    when the server cannot have acted on them: the connection was never
+    established (requests.ConnectTimeout), or the answer was one of
+    `unprocessed_statuses` (503 Service Unavailable by default). Otherwise a
+    retry could award a badge twice.
+
+    Every retry is logged at WARNING level on the `badgr_lite.retry`
+    logger and reported to `on_retry(method, url, attempt, delay, cause)`
+    if given; cause is the status code or the exception.
+
+    `max_attempts=1` disables retrying.
+    """
+    # pylint: disable=R0913
+
+    def __init__(self, max_attempts: int = 4, backoff_base: float = 0.5,
+                 backoff_cap: float = 30.0,
+                 retry_statuses: Iterable[int] = (500, 502, 503, 504),
+                 retry_exceptions: Optional[
+                     Tuple[Type[BaseException], ...]] = None,
+                 unprocessed_statuses: Iterable[int] = (503,),
+                 on_retry: Optional[Callable] = None) -> None:
+        import requests
+
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_exceptions = retry_exceptions or (
+            requests.ConnectionError, requests.Timeout)
+        self._connect_timeout = requests.ConnectTimeout
+        self.unprocessed_statuses = frozenset(unprocessed_statuses)
+        self.on_retry = on_retry
+
+    def backoff(self, attempt: int) -> float:
+        """Return seconds to wait before retry number attempt (from 0)"""
+
+        return random.uniform(
+            0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def is_retryable(self, method: str,
+                     cause: Union[int, BaseException]) -> bool:
+        """Return True if a request failing with cause may be sent again
+
+        cause is the status code answered or the exception raised.
+        """
+
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        if isinstance(cause, int):
+            return cause in self.retry_statuses and (
+                idempotent or cause in self.unprocessed_statuses)
+        if not isinstance(cause, self.retry_exceptions):
+            return False
+        return idempotent or isinstance(cause, self._connect_timeout)
+
+    def retry_delay(self, method: str, url: str, attempt: int,
+                    cause: Union[int, BaseException]) -> Optional[float]:
+        """Return seconds to wait before retrying, or None to give up
+
+        attempt counts the retries already made. The retry is logged and
+        reported to on_retry.
+        """
+
+        if attempt + 1 >= self.max_attempts or \
+                not self.is_retryable(method, cause):
+            return None
+
+        delay = self.backoff(attempt)
+        LOGGER.warning('Retrying %s %s in %.2fs (retry %d of %d): %r',
+                       method, url, delay, attempt + 1,
+                       self.max_attempts - 1, cause)
+        if self.on_retry is not None:
+            self.on_retry(method, url, attempt + 1, delay, cause)
+        return delay
+
+    def __repr__(self) -> str:
+        return 'RetryPolicy(max_attempts={})'.format(self.max_attempts)
@@ -0,0 +1,452 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=R0902, R0913
+"""Long-running local daemon serving BadgrLite to local clients
+
+`badgr serve` keeps one BadgrLite instance warm: the token stays loaded,
+the connection pool stays open, and the badge catalog is kept in memory.
+Local clients (see badgr_lite.client.BadgrClient) talk JSON over HTTP on a
+Unix socket only accessible to the current user or, when asked, a localhost
+port. Over TCP every request must carry the shared secret in the
+X-Badgr-Secret header. Requests naming a Host other than the daemon's own
+address (e.g., pages of a DNS rebinding attack) are refused, and so are
+POST bodies not sent as application/json:
+
+- GET /health: {"status": "ok"}
+- GET /badges[?refresh=1]: {"result": [badge, ...]}
+- POST /awards {"badge_id": ..., "badge_data": {...}}: {"result": assertion}
+- POST /awards {"awards": [{"badge_id": ..., "badge_data": ...}, ...]}:
+  {"result": [assertion or error, ...]}
+
+Errors are answered as {"error": exception name, "args": [...]}; refused
+requests as 403 (Forbidden) or 415 (UnsupportedMediaType).
+
+Award requests are handed to one long-lived pool of worker threads sharing
+the session as they arrive. Those arriving within `batch_window` seconds
+of each other (up to `batch_size` awards) form a batch sharing one token
+check.
+"""
+
+import errno
+import hmac
+import json
+import os
+import queue
+import secrets
+import socket
+import socketserver
+import stat
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+from .client import SECRET_HEADER, read_secret_file
+from .models import BadgrLite
+
+# Default socket and secret files, next to the token file
+SOCKET_FILENAME = 'badgr.sock'
+SECRET_FILENAME = 'badgr-serve.secret'
+
+# Host headers always accepted, besides the address listened on
+LOCAL_HOSTS = frozenset(('localhost', '127.0.0.1', '[::1]'))
+
+# HTTP status answered for exceptions raised by BadgrLite
+ERROR_STATUS = {
+    'BadBadgeIdError': 404,
+    'AwardBadgeBadDataError': 400,
+    'RequiredAttributesMissingError': 400,
+    'TokenFileNotFoundError': 503,
+    'TokenAndRefreshExpiredError': 503,
+    'RateLimitedError': 429,
+}
+
+
+def beside(token_filename: str, filename: str) -> str:
+    """Return path of filename in the directory of token_filename"""
+
+    directory = os.path.dirname(os.path.abspath(token_filename))
+    return os.path.join(directory, filename)
+
+
+def read_secret(filename: str) -> str:
+    """Return the shared secret kept in filename, creating it if missing
+
+    A new secret file is only readable by the current user.
+    """
+
+    try:
+        descriptor = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                             0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(descriptor, 'w') as secret_h:
+            secret_h.write(secrets.token_urlsafe(32) + '\n')
+    return read_secret_file(filename)
+
+
+def host_name(host: str) -> str:
+    """Return host (of a Host header or address) without port, IPv6 in []"""
+
+    if host.startswith('['):
+        return host[:host.find(']') + 1]
+    if host.count(':') > 1:
+        return '[{}]'.format(host)
+    return host.split(':', 1)[0]
+
+
+def error_body(error: BaseException) -> dict:
+    """Return JSON-able description of error, for the client to re-raise"""
+
+    return {'error': type(error).__name__,
+            'args': [arg if isinstance(arg, (str, int, float, type(None)))
+                     else str(arg) for arg in error.args]}
+
+
+class AwardBatcher:
+    """Award concurrent requests on a warm pool of worker threads
+
+    `submit` returns a Future of the award's result. Awards go to one
+    long-lived pool of `max_workers` threads sharing the BadgrLite session
+    as soon as they arrive, so a slow award only holds its own thread.
+    Awards arriving within `batch_window` seconds of the first one (up to
+    `batch_size` of them) form a batch, for which the token is checked
+    once. `batches` counts batches.
+    """
+
+    def __init__(self, badgr: BadgrLite, max_workers: int = 8,
+                 batch_size: int = 64, batch_window: float = 0.005) -> None:
+        self.badgr = badgr
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.batches = 0
+        self._pending: queue.Queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, badge_id: str, badge_data: dict) -> Future:
+        """Queue an award, return Future of its Badge"""
+
+        future: Future = Future()
+        self._pending.put((badge_id, badge_data, future))
+        return future
+
+    def close(self) -> None:
+        """Stop after awarding what is already pending"""
+
+        self._pending.put(None)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _award(self, badge_id: str, badge_data: dict,
+               future: Future) -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(self.badgr.award_badge(badge_id, badge_data))
+        except BaseException as error:  # pylint: disable=W0703
+            future.set_exception(error)
+
+    def _dispatch(self, pending: tuple,
+                  token_error: Optional[BaseException]) -> None:
+        """Hand one award to the pool (or fail it without a token)"""
+
+        if token_error is not None:
+            pending[2].set_exception(token_error)
+        else:
+            self._executor.submit(self._award, *pending)
+
+    def _run(self) -> None:
+        while True:
+            pending = self._pending.get()
+            if pending is None:
+                return
+            self.batches += 1
+            try:
+                # Token is checked once per batch rather than per award
+                self.badgr.load_token()
+                token_error = None
+            except BaseException as error:  # pylint: disable=W0703
+                token_error = error
+
+            deadline = time.monotonic() + self.batch_window
+            self._dispatch(pending, token_error)
+            # Only take an award from the queue when it can join the batch
+            for _ in range(self.batch_size - 1):
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    pending = self._pending.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if pending is None:
+                    return
+                self._dispatch(pending, token_error)
+
+
+class BadgrService:
+    """What the daemon serves: one warm BadgrLite and its badge catalog
+
+    The catalog is fetched from the server at most every `catalog_ttl`
+    seconds (and revalidated through the response cache, if BadgrLite has
+    one).
+    """
+
+    def __init__(self, badgr: BadgrLite, catalog_ttl: float = 300,
+                 max_workers: int = 8, batch_size: int = 64,
+                 batch_window: float = 0.005) -> None:
+        self.badgr = badgr
+        self.catalog_ttl = catalog_ttl
+        self.batcher = AwardBatcher(badgr, max_workers, batch_size,
+                                    batch_window)
+        self._catalog: Optional[list] = None
+        self._catalog_at = 0.0
+        self._catalog_lock = threading.Lock()
+
+    def badges(self, refresh: bool = False) -> list:
+        """Return raw badge classes, from memory while fresh"""
+
+        with self._catalog_lock:
+            if refresh or self._catalog is None or \
+                    time.monotonic() - self._catalog_at >= self.catalog_ttl:
+                self._catalog = [badge.to_dict()
+                                 for badge in self.badgr.iter_badges()]
+                self._catalog_at = time.monotonic()
+            return self._catalog
+
+    def award(self, badge_id: str, badge_data: dict) -> dict:
+        """Award through the batcher, return raw assertion"""
+
+        return self.batcher.submit(badge_id, badge_data).result().to_dict()
+
+    def award_many(self, awards: list) -> list:
+        """Award all (concurrently), return assertions or error bodies"""
+
+        futures = [self.batcher.submit(award['badge_id'],
+                                       award['badge_data'])
+                   for award in awards]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result().to_dict())
+            except BaseException as error:  # pylint: disable=W0703
+                results.append(error_body(error))
+        return results
+
+    def close(self) -> None:
+        """Finish pending awards and release the connection pool"""
+
+        self.batcher.close()
+        self.badgr.close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Answer local clients on behalf of BadgrService"""
+
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def service(self) -> BadgrService:
+        """The daemon's service"""
+
+        return self.server.service  # type: ignore
+
+    def address_string(self) -> str:
+        """Unix socket clients have no address"""
+
+        return str(self.client_address[0]) if self.client_address else '-'
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        """Log only when the daemon runs verbosely"""
+
+        if getattr(self.server, 'verbose', False):
+            super().log_message(format, *args)
+
+    def _answer(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _answer_error(self, error: BaseException) -> None:
+        self._answer(ERROR_STATUS.get(type(error).__name__, 502),
+                     error_body(error))
+
+    def _refuse(self, status: int, error: str, reason: str) -> None:
+        """Answer without reading the request body, then hang up"""
+
+        self.close_connection = True
+        self._answer(status, {'error': error, 'args': [reason]})
+
+    def _allowed(self) -> bool:
+        """Check Host and secret, refusing the request if they don't match"""
+
+        host = host_name(self.headers.get('Host', '').lower())
+        if host not in self.server.allowed_hosts:  # type: ignore
+            self._refuse(403, 'Forbidden', 'Unexpected Host header')
+            return False
+        secret = self.server.secret  # type: ignore
+        if secret is not None and not hmac.compare_digest(
+                self.headers.get(SECRET_HEADER, '').encode('latin-1'),
+                secret.encode('latin-1')):
+            self._refuse(403, 'Forbidden', 'Missing or wrong ' +
+                         SECRET_HEADER)
+            return False
+        return True
+
+    def do_GET(self):  # pylint: disable=C0103
+        """Health check and badge catalog"""
+
+        if not self._allowed():
+            return
+        url = urlsplit(self.path)
+        if url.path == '/health':
+            self._answer(200, {'status': 'ok'})
+        elif url.path == '/badges':
+            refresh = parse_qs(url.query).get('refresh', ['0'])[0]
+            try:
+                result = self.service.badges(refresh not in ('', '0'))
+            except BaseException as error:  # pylint: disable=W0703
+                self._answer_error(error)
+                return
+            self._answer(200, {'result': result})
+        else:
+            self._answer(404, {'error': 'NotFound', 'args': [url.path]})
+
+    def do_POST(self):  # pylint: disable=C0103
+        """Award one badge, or many"""
+
+        if not self._allowed():
+            return
+        if self.headers.get_content_type() != 'application/json':
+            self._refuse(415, 'UnsupportedMediaType',
+                         'Expected Content-Type application/json')
+            return
+        if urlsplit(self.path).path != '/awards':
+            self._answer(404, {'error': 'NotFound', 'args': [self.path]})
+            return
+        try:
+            request = json.loads(self.rfile.read(
+                int(self.headers.get('Content-Length') or 0)))
+            if 'awards' in request:
+                self._answer(200, {'result': self.service.award_many(
+                    request['awards'])})
+            else:
+                self._answer(201, {'result': self.service.award(
+                    request['badge_id'], request['badge_data'])})
+        except (ValueError, KeyError, TypeError) as error:
+            self._answer(400, error_body(error))
+        except BaseException as error:  # pylint: disable=W0703
+            self._answer_error(error)
+
+
+class _TCPHandler(_Handler):
+    """Handler for localhost TCP clients"""
+
+    # Headers and body are written separately; don't wait for ACKs
+    disable_nagle_algorithm = True
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """HTTPServer answering each connection in a thread
+
+    http.server.ThreadingHTTPServer is only available from Python 3.7.
+    """
+
+    daemon_threads = True
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn,
+                      socketserver.UnixStreamServer):
+    """Threading HTTP server listening on a Unix socket"""
+
+    daemon_threads = True
+
+    def server_bind(self):
+        """Bind, replacing a socket file left behind by an earlier run
+
+        Raises FileExistsError if the path is not a socket, and OSError
+        (EADDRINUSE) if a daemon still listens on it. The socket file is
+        made accessible to the current user only.
+        """
+
+        path = self.server_address
+        try:
+            mode = os.stat(path).st_mode  # type: ignore
+        except FileNotFoundError:
+            pass
+        else:
+            if not stat.S_ISSOCK(mode):
+                raise FileExistsError(errno.EEXIST, 'Not a socket', path)
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(path)
+                except OSError:
+                    os.remove(path)  # type: ignore
+                else:
+                    raise OSError(errno.EADDRINUSE,
+                                  'A daemon is listening already', path)
+        super().server_bind()
+        os.chmod(path, 0o600)  # type: ignore
+
+
+def make_server(service: BadgrService, socket_path: Optional[str] = None,
+                host: str = '127.0.0.1', port: int = 8765,
+                verbose: bool = False,
+                secret: Optional[str] = None) -> socketserver.BaseServer:
+    """Return daemon server for service on socket_path or host:port
+
+    The Unix socket is only accessible to the current user. Other local
+    users can reach host:port, so listening on it requires a secret, which
+    clients send in the SECRET_HEADER header.
+
+    Raises ValueError when asked to listen on host:port without a secret.
+    """
+
+    server: socketserver.BaseServer
+    if socket_path is not None:
+        server = _UnixHTTPServer(socket_path, _Handler)
+    elif not secret:
+        raise ValueError('A secret is required to listen on {}:{}'.format(
+            host, port))
+    else:
+        server = ThreadingHTTPServer((host, port), _TCPHandler)
+    server.service = service  # type: ignore
+    server.verbose = verbose  # type: ignore
+    server.secret = secret  # type: ignore
+    server.allowed_hosts = LOCAL_HOSTS | {  # type: ignore
+        host_name(host.lower())}
+    return server
+
+
+def serve(badgr: BadgrLite, socket_path: Optional[str] = None,
+          host: str = '127.0.0.1', port: int = 8765, verbose: bool = False,
+          secret: Optional[str] = None, **service_options) -> None:
+    """Serve badgr until interrupted
+
+    `service_options` are those of BadgrService.
+    """
+
+    service = BadgrService(badgr, **service_options)
+    try:
+        server = make_server(service, socket_path, host, port, verbose,
+                             secret)
+    except BaseException:
+        service.close()
+        raise
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
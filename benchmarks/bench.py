@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Microbenchmark suite for the decode and award hot paths
+
+Cases:
+
+- badge_construct_10k / _100k: Badge(...) from the recorded
+  badge_retrieval.yaml payload scaled up, reading entity_id and created_at
+- pythonic: helpers.pythonic over the keys of 10k badges
+- to_datetime: helpers.to_datetime over 10k createdAt timestamps
+- prepare_headers: 10k calls
+- award_badge: 500 full awards (request build, JSON encoding, response
+  validation and decoding) against a stubbed transport returning the
+  recorded award_badge.yaml response
+
+Timings are the best of several batches of calls. They are also expressed
+relative to a fixed pure-Python calibration loop, so that a baseline
+recorded on one machine is roughly comparable on another; the regression
+check compares these relative timings, and times apparently regressed
+cases again before failing.
+
+Run from the repository root:
+
+    PYTHONPATH=. python benchmarks/bench.py            # print timings
+    PYTHONPATH=. python benchmarks/bench.py --save --runs 3  # baseline
+    PYTHONPATH=. python benchmarks/bench.py --check    # fail on regression
+
+or use `make bench`, `make bench-baseline` and `make bench-check`.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+import requests
+import yaml
+from requests.adapters import HTTPAdapter
+
+from badgr_lite import helpers
+from badgr_lite.models import Badge, BadgrLite
+from decode import load_payload
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline.json')
+REPEAT = 7
+CONFIRM_RUNS = 2
+MIN_TIME = 0.2
+THRESHOLD = 0.25
+AWARDS = 500
+CALLS = 10000
+
+
+def calibrate() -> int:
+    """Fixed pure-Python workload the timings are expressed against"""
+
+    total = 0
+    for number in range(200000):
+        total += number * number % 7
+    return total
+
+
+class StubAdapter(HTTPAdapter):
+    """Transport answering every request with one recorded response"""
+
+    def __init__(self, cassette: str) -> None:
+        super().__init__()
+        with open(cassette) as cassette_h:
+            response = yaml.safe_load(cassette_h)['interactions'][0][
+                'response']
+        self.status_code = response['status']['code']
+        self.body = response['body']['string'].encode('utf8')
+        self.headers = {'Content-Type': 'application/json'}
+
+    def send(self, request, **kwargs):
+        """Return the recorded response without touching the network"""
+        # Keep HTTPAdapter.send signature; pylint: disable=W0221
+
+        response = requests.Response()
+        response.status_code = self.status_code
+        response.headers.update(self.headers)
+        response.request = request
+        response.url = request.url
+        # Build the Response by hand; pylint: disable=W0212
+        response._content = self.body
+        return response
+
+
+def get_stubbed_badgr(tempdir: str) -> BadgrLite:
+    """Return BadgrLite sending through StubAdapter"""
+
+    token_filename = os.path.join(tempdir, 'token.json')
+    with open(token_filename, 'w') as token_h:
+        json.dump({'access_token': 'benchmark', 'token_type': 'Bearer',
+                   'refresh_token': 'benchmark'}, token_h)
+    session = requests.Session()
+    session.mount('https://', StubAdapter(
+        'tests/vcr_cassettes/award_badge.yaml'))
+    badgr = BadgrLite(token_filename=token_filename, session=session)
+    badgr.load_token()
+    return badgr
+
+
+def get_cases(tempdir: str) -> dict:
+    """Return {name: function} of benchmark cases"""
+
+    small = json.loads(load_payload(10000))['result']
+    large = json.loads(load_payload(100000))['result']
+    keys = [key for badge in small for key in badge]
+    timestamps = [badge['createdAt'] for badge in small]
+    badgr = get_stubbed_badgr(tempdir)
+    badge_data = {'recipient': {'identity': 'joe@example.com'},
+                  'notify': True,
+                  'evidence': [{'url': 'http://example.com/',
+                                'narrative': 'Joe completed all...'}]}
+
+    def construct(raw_badges):
+        return lambda: [(badge.entity_id, badge.created_at) for badge in
+                        map(Badge, raw_badges)]
+
+    def award():
+        for _ in range(AWARDS):
+            badgr.award_badge('2TfNNqMLT8CoAhfGKqSv6Q', badge_data)
+
+    return {
+        'badge_construct_10k': construct(small),
+        'badge_construct_100k': construct(large),
+        'pythonic': lambda: [helpers.pythonic(key) for key in keys],
+        'to_datetime': lambda: [helpers.to_datetime(stamp)
+                                for stamp in timestamps],
+        'prepare_headers': lambda: [badgr.prepare_headers()
+                                    for _ in range(CALLS)],
+        'award_badge': award,
+    }
+
+
+def best_of(function) -> float:
+    """Return best wall time of a call to function, in seconds
+
+    Calls are timed in batches of at least MIN_TIME seconds, and the best
+    of REPEAT batches is taken, to keep timer and scheduling noise down.
+    """
+
+    timer = timeit.Timer(function)
+    first_call = timer.timeit(number=1)  # Also warms up caches
+    number = max(1, math.ceil(MIN_TIME / max(first_call, 1e-9)))
+    return min(timer.repeat(number=number, repeat=REPEAT)) / number
+
+
+def run(runs: int = 1, names=None) -> dict:
+    """Run all cases (or those in names), return results in baseline format
+
+    Each case is timed next to the calibration loop, so that both see the
+    same machine load. With several runs, the best timings are kept.
+    """
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        cases = get_cases(tempdir)
+        results = {}
+        for _ in range(runs):
+            for name, function in cases.items():
+                if names is not None and name not in names:
+                    continue
+                seconds = best_of(function)
+                relative = seconds / best_of(calibrate)
+                if name not in results or \
+                        relative < results[name]['relative']:
+                    results[name] = {'seconds': seconds,
+                                     'relative': relative}
+    finally:
+        shutil.rmtree(tempdir)
+    return {'python': platform.python_version(), 'cases': results}
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """Print comparison with baseline, return names of regressed cases"""
+
+    regressed = []
+    print("{:<24}{:>12}{:>12}{:>10}".format(
+        'case', 'baseline', 'current', 'change'))
+    for name, result in current['cases'].items():
+        if name not in baseline['cases']:
+            print("{:<24}{:>12}{:>12.3f}".format(
+                name, '-', result['relative']))
+            continue
+        before = baseline['cases'][name]['relative']
+        change = result['relative'] / before - 1
+        flag = ''
+        if change > threshold:
+            regressed.append(name)
+            flag = '  REGRESSED'
+        print("{:<24}{:>12.3f}{:>12.3f}{:>+9.0%}{}".format(
+            name, before, result['relative'], change, flag))
+    return regressed
+
+
+def main() -> int:
+    """Run the suite; save, print or check against the baseline"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--save', action='store_true',
+                        help="store results as the new baseline")
+    parser.add_argument('--check', action='store_true',
+                        help="exit 1 if a case regressed beyond threshold")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help="allowed slowdown, as a fraction "
+                             "(default: %(default)s)")
+    parser.add_argument('--baseline', default=BASELINE,
+                        help="baseline file (default: %(default)s)")
+    parser.add_argument('--runs', type=int, default=1,
+                        help="run suite this many times, keeping the best "
+                             "timings (default: %(default)s)")
+    args = parser.parse_args()
+
+    current = run(args.runs)
+    if args.save:
+        with open(args.baseline, 'w') as baseline_h:
+            json.dump(current, baseline_h, indent=2, sort_keys=True)
+            baseline_h.write('\n')
+
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as baseline_h:
+            baseline = json.load(baseline_h)
+        print("Relative to calibration loop; baseline on Python {}".format(
+            baseline['python']))
+        regressed = compare(baseline, current, args.threshold)
+        if args.check and regressed:
+            # Time suspects again before failing, to rule out noise
+            print("Confirming: {}".format(', '.join(regressed)))
+            for name, result in run(CONFIRM_RUNS, regressed)[
+                    'cases'].items():
+                if result['relative'] < \
+                        current['cases'][name]['relative']:
+                    current['cases'][name] = result
+            regressed = compare(baseline, current, args.threshold)
+        if args.check and regressed:
+            print("Regressed beyond {:.0%}: {}".format(
+                args.threshold, ', '.join(regressed)))
+            return 1
+        return 0
+
+    if args.check:
+        print("No baseline at {}".format(args.baseline))
+        return 1
+    print("{:<24}{:>12}".format('case', 'ms'))
+    for name, result in current['cases'].items():
+        print("{:<24}{:>12.2f}".format(name, result['seconds'] * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Microbenchmark for the badge field codec
+
+Compares, per 10k badges built from the recorded badge_retrieval.yaml
+payload, the field codec in `badgr_lite.helpers` with the implementations
+it replaced (uncached `re.sub` key translation, `strptime` with a
+try/except fallback, stdlib `json`).
+
+Run from the repository root:
+
+    PYTHONPATH=. python benchmarks/decode.py
+"""
+
+import datetime
+import json
+import re
+import timeit
+
+import pytz
+import yaml
+
+from badgr_lite import helpers
+from badgr_lite.models import Badge
+
+
+BADGES = 10000
+REPEAT = 5
+
+
+def reference_pythonic(name: str) -> str:
+    """helpers.pythonic before memoization"""
+
+    regex_s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
+    return re.sub('([a-z0-9])([A-Z])', r'\1_\2', regex_s1).lower()
+
+
+def reference_to_datetime(potential_datetime):
+    """helpers.to_datetime before the fast path (with pytz)"""
+
+    final_datetime = potential_datetime
+    if isinstance(potential_datetime, str):
+        try:
+            final_datetime = datetime.datetime.strptime(
+                potential_datetime, helpers.DATETIME_FORMAT)
+        except ValueError:
+            final_datetime = datetime.datetime.strptime(
+                potential_datetime, helpers.DATETIME_MILLISECOND_FORMAT)
+        final_datetime = pytz.UTC.localize(final_datetime)
+    return final_datetime
+
+
+def load_payload(count: int) -> bytes:
+    """Return badgeclasses response body scaled up to count badges
+
+    Every other badge gets a millisecond timestamp so both shapes are
+    decoded.
+    """
+
+    with open('tests/vcr_cassettes/badge_retrieval.yaml') as cassette_h:
+        body = json.loads(yaml.safe_load(cassette_h)['interactions'][0]
+                          ['response']['body']['string'])
+
+    recorded = body['result']
+    result = []
+    for number in range(count):
+        badge = dict(recorded[number % len(recorded)])
+        if number % 2:
+            badge['createdAt'] = badge['createdAt'][:-1] + '.277836Z'
+        result.append(badge)
+    return json.dumps(dict(body, result=result)).encode('utf8')
+
+
+def best_of(function) -> float:
+    """Return best wall time of REPEAT runs of function, in seconds"""
+
+    return min(timeit.repeat(function, number=1, repeat=REPEAT))
+
+
+def main() -> None:
+    """Print before/after timings per BADGES badges"""
+
+    payload = load_payload(BADGES)
+    raw_badges = json.loads(payload)['result']
+    keys = [key for badge in raw_badges for key in badge]
+    timestamps = [badge['createdAt'] for badge in raw_badges]
+
+    cases = [
+        ('pythonic (keys)',
+         lambda: [reference_pythonic(key) for key in keys],
+         lambda: [helpers.pythonic(key) for key in keys]),
+        ('to_datetime (createdAt)',
+         lambda: [reference_to_datetime(stamp) for stamp in timestamps],
+         lambda: [helpers.to_datetime(stamp) for stamp in timestamps]),
+        ('json decode (payload)',
+         lambda: json.loads(payload),
+         lambda: helpers.json_loads(payload)),
+        ('badge fields + created_at',
+         lambda: [reference_to_datetime(badge['createdAt']) and
+                  {reference_pythonic(k): v for k, v in badge.items()}
+                  for badge in raw_badges],
+         lambda: [Badge(badge).created_at for badge in raw_badges]),
+    ]
+
+    print("Per {:,} badges (best of {})".format(BADGES, REPEAT))
+    print("{:<26}{:>12}{:>12}{:>10}".format(
+        'case', 'before ms', 'after ms', 'speedup'))
+    for name, before, after in cases:
+        before_time, after_time = best_of(before), best_of(after)
+        print("{:<26}{:>12.2f}{:>12.2f}{:>9.1f}x".format(
+            name, before_time * 1000, after_time * 1000,
+            before_time / after_time))
+
+
+if __name__ == '__main__':
+    main()
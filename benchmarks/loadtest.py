@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Load test of BadgrLite against the local fake Badgr server
+
+Sweeps concurrency levels; at each level, one shared BadgrLite instance
+runs --operations operations from that many threads, and throughput and
+p50/p95/p99 latency per operation are reported. Everything runs offline
+against badgr_lite.fakeserver.FakeBadgrServer, unless --base-url and
+--token-file name another server.
+
+Run from the repository root, e.g.:
+
+    PYTHONPATH=. python benchmarks/loadtest.py --latency 0.02 \\
+        --error-rate 0.01 --throttle-rate 0.01 --concurrency 1,4,16,64
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from badgr_lite.fakeserver import FakeBadgrServer
+from badgr_lite.models import BadgrLite
+from badgr_lite.ratelimit import RateLimiter
+
+
+def percentile(ordered: list, fraction: float) -> float:
+    """Return fraction percentile of ordered values (nearest rank)"""
+
+    if not ordered:
+        return float('nan')
+    index = min(len(ordered) - 1, max(0, int(round(
+        fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def operation_of(badgr: BadgrLite, kind: str, badge_id: str):
+    """Return function running one operation of kind with badgr"""
+
+    def award(number):
+        badgr.award_badge(badge_id, {'recipient': {
+            'identity': 'load{}@example.com'.format(number)}})
+
+    def get(_):
+        badgr.get_from_server('{}/badgeclasses'.format(badgr.api_url))
+
+    def mixed(number):
+        return award(number) if number % 4 == 0 else get(number)
+
+    return {'award': award, 'get': get, 'mixed': mixed}[kind]
+
+
+def run_level(args, token_filename: str, base_url: str,
+              concurrency: int) -> dict:
+    """Run args.operations operations at concurrency, return summary"""
+
+    limiter = RateLimiter(args.rate, burst=concurrency) if args.rate \
+        else None
+    badgr = BadgrLite(token_filename=token_filename, base_url=base_url,
+                      pool_maxsize=concurrency, rate_limiter=limiter)
+    badgr.load_token()
+    badge_id = badgr.badges[0].entity_id
+    operation = operation_of(badgr, args.operation, badge_id)
+
+    def timed(number):
+        started = time.perf_counter()
+        try:
+            operation(number)
+        except BaseException:  # pylint: disable=W0703
+            return time.perf_counter() - started, False
+        return time.perf_counter() - started, True
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed, range(args.operations)))
+    elapsed = time.perf_counter() - started
+    badgr.close()
+
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        'concurrency': concurrency,
+        'operations': len(results),
+        'errors': sum(1 for _, succeeded in results if not succeeded),
+        'throughput': len(results) / elapsed,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+    }
+
+
+def main() -> int:
+    """Run the concurrency sweep and print (or dump) the results"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', default='1,2,4,8,16,32',
+                        help="comma separated thread counts to sweep "
+                             "(default: %(default)s)")
+    parser.add_argument('--operations', type=int, default=500,
+                        help="operations per level (default: %(default)s)")
+    parser.add_argument('--operation', default='mixed',
+                        choices=['award', 'get', 'mixed'],
+                        help="operation to run; mixed is 1 award per 3 "
+                             "badge class listings (default: %(default)s)")
+    parser.add_argument('--rate', type=float,
+                        help="client-side RateLimiter requests per second")
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help="fake server latency in seconds "
+                             "(default: %(default)s)")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="fraction of 500 answers")
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help="fraction of 429 answers")
+    parser.add_argument('--retry-after', type=float, default=0.1,
+                        help="Retry-After of 429 answers, in seconds "
+                             "(default: %(default)s)")
+    parser.add_argument('--token-lifetime', type=float,
+                        help="seconds fake access tokens are valid")
+    parser.add_argument('--base-url',
+                        help="test this server instead of a fake one")
+    parser.add_argument('--token-file',
+                        help="token file for --base-url")
+    parser.add_argument('--json', action='store_true',
+                        help="print results as JSON lines")
+    parser.add_argument('--verbose', action='store_true',
+                        help="log every retry")
+    args = parser.parse_args()
+    if not args.verbose:
+        logging.getLogger('badgr_lite').setLevel(logging.ERROR)
+
+    server = None
+    tempdir = tempfile.mkdtemp()
+    token_filename = args.token_file or os.path.join(tempdir, 'token.json')
+    base_url = args.base_url
+    if base_url is None:
+        server = FakeBadgrServer(
+            latency=args.latency, error_rate=args.error_rate,
+            throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+            token_lifetime=args.token_lifetime, badge_count=1,
+            assertion_count=0).start()
+        server.write_token_file(token_filename)
+        base_url = server.base_url
+
+    try:
+        if not args.json:
+            print("{:>11}{:>8}{:>12}{:>10}{:>10}{:>10}".format(
+                'concurrency', 'errors', 'ops/s', 'p50 ms', 'p95 ms',
+                'p99 ms'))
+        for concurrency in (int(level)
+                            for level in args.concurrency.split(',')):
+            summary = run_level(args, token_filename, base_url, concurrency)
+            if args.json:
+                print(json.dumps(summary))
+                continue
+            print("{concurrency:>11}{errors:>8}{throughput:>12.1f}".format(
+                **summary) + ''.join(
+                    '{:>10.1f}'.format(summary[name] * 1000)
+                    for name in ('p50', 'p95', 'p99')))
+    finally:
+        if server is not None:
+            server.stop()
+        shutil.rmtree(tempdir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
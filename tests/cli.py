@@ -4,15 +4,20 @@
 """Tests for `badgr_lite` package."""
 
 
+import csv
 import os
 import json
+import shutil
+import subprocess
+import sys
 import tempfile
 import unittest
+import unittest.mock
 
 from click.testing import CliRunner
 import vcr
 
-from badgr_lite import cli
+from badgr_lite import cli, exceptions, models
 
 
 class TestBadgrLiteBase(unittest.TestCase):
@@ -128,6 +133,119 @@ class TestBadgrLiteCLIListBadges(TestBadgrLiteBase):
         result = self.runner.invoke(cli.main, ['list-badges', '--help'])
         self.assertEqual(0, result.exit_code)
 
+    def test_cli_subcommand_list_badges(self):
+        """CLI list-badges prints one line per badge"""
+
+        with vcr.use_cassette('tests/vcr_cassettes/badge_retrieval.yaml'):
+            result = self.runner.invoke(
+                cli.main, ['--token-file', self.token_file, 'list-badges',
+                           '--no-cache'])
+        self.assertEqual(0, result.exit_code)
+        self.assertIn('https://badgr.io/public/assertions/', result.output)
+
+    def test_cli_subcommand_list_badges_cache(self):
+        """CLI list-badges caches listings in --cache-dir"""
+
+        cache_dir = tempfile.mkdtemp()
+        with vcr.use_cassette('tests/vcr_cassettes/badge_retrieval.yaml'):
+            result = self.runner.invoke(
+                cli.main, ['--token-file', self.token_file, 'list-badges',
+                           '--cache-dir', cache_dir])
+        self.assertEqual(0, result.exit_code)
+        self.assertEqual(1, len(os.listdir(cache_dir)))
+        shutil.rmtree(cache_dir)
+
+    def test_cli_list_badges_without_writable_cache(self):
+        """CLI list-badges lists without cache if --cache-dir fails"""
+
+        cache_dir = os.path.join(self.token_file, 'cache')
+        with unittest.mock.patch.object(models.BadgrLite, 'close') as close:
+            with vcr.use_cassette(
+                    'tests/vcr_cassettes/badge_retrieval.yaml'):
+                result = self.runner.invoke(
+                    cli.main, ['--token-file', self.token_file,
+                               'list-badges', '--cache-dir', cache_dir])
+        self.assertEqual(0, result.exit_code)
+        self.assertIn('Not caching listings', result.output)
+        self.assertIn('https://badgr.io/public/assertions/', result.output)
+        self.assertTrue(close.called)
+
+    def list_badges(self, *options):
+        """Invoke list-badges without cache on the recorded listing"""
+
+        with vcr.use_cassette('tests/vcr_cassettes/badge_retrieval.yaml'):
+            return self.runner.invoke(
+                cli.main, ['--token-file', self.token_file, 'list-badges',
+                           '--no-cache'] + list(options))
+
+    def test_cli_list_badges_jsonl(self):
+        """CLI list-badges --format jsonl prints one object per badge"""
+
+        result = self.list_badges('--format', 'jsonl')
+        self.assertEqual(0, result.exit_code)
+        records = [json.loads(line) for line in result.output.splitlines()]
+        self.assertIn('entityId', records[0])
+        self.assertIn('description', records[0])
+
+        result = self.list_badges('--format', 'jsonl',
+                                  '--fields', 'entity_id,name')
+        self.assertEqual(list(json.loads(result.output.splitlines()[0])),
+                         ['entity_id', 'name'])
+
+    def test_cli_list_badges_csv_and_tsv(self):
+        """CLI list-badges --format csv/tsv prints a header, then rows"""
+
+        result = self.list_badges('--format', 'csv',
+                                  '--fields', 'entity_id,created_at,tags')
+        self.assertEqual(0, result.exit_code)
+        rows = list(csv.reader(result.output.splitlines()))
+        self.assertEqual(rows[0], ['entity_id', 'created_at', 'tags'])
+        self.assertEqual(len(rows[1]), 3)
+        self.assertIsInstance(json.loads(rows[1][2]), list)
+
+        result = self.list_badges('--format', 'tsv')
+        self.assertEqual(result.output.splitlines()[0],
+                         '\t'.join(cli.DEFAULT_FIELDS))
+
+    def test_cli_list_badges_fields_need_structured_format(self):
+        """CLI list-badges refuses --fields with text output"""
+
+        result = self.runner.invoke(cli.main, ['list-badges', '--fields',
+                                               'name'])
+        self.assertNotEqual(0, result.exit_code)
+
+
+class TestBadgrLiteCLIFetchImages(TestBadgrLiteBase):
+    """BadgrLite CLI fetch-images subcommand tests"""
+
+    def test_cli_subcommand_fetch_images_help(self):
+        """CLI has subcommand fetch-images"""
+
+        result = self.runner.invoke(cli.main, ['fetch-images', '--help'])
+        self.assertEqual(0, result.exit_code)
+
+    def test_cli_fetch_images_prints_paths_and_errors(self):
+        """CLI fetch-images prints one line per badge, failing on errors"""
+
+        def fetch_images(_, badges, dest, max_workers):
+            self.assertEqual(max_workers, 4)
+            for badge in badges:
+                yield badge, os.path.join(dest, badge.entity_id)
+            yield badge, exceptions.ServerError(404, 'https://media/x.png')
+
+        dest = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dest)
+        with vcr.use_cassette('tests/vcr_cassettes/badge_retrieval.yaml'), \
+                unittest.mock.patch('badgr_lite.models.BadgrLite.fetch_images',
+                                    fetch_images):
+            result = self.runner.invoke(
+                cli.main, ['--token-file', self.token_file, 'fetch-images',
+                           dest, '--workers', '4'])
+        self.assertNotEqual(0, result.exit_code)
+        self.assertIn('\t{}{}'.format(dest, os.sep), result.output)
+        self.assertIn('ERROR\t', result.output)
+        self.assertIn('1 image(s) failed', result.output)
+
 
 class TestBadgrLiteCLIAwardBadge(TestBadgrLiteBase):
     """BadgrLite CLI award-badge subcommand tests"""
@@ -242,5 +360,284 @@ class TestBadgrLiteCLIAwardBadge(TestBadgrLiteBase):
         self.assertTrue(isinstance(badge_data['evidence'], list))
 
 
+class TestBadgrLiteCLIAwardBatch(TestBadgrLiteBase):
+    """BadgrLite CLI award-batch subcommand tests"""
+
+    SAMPLE_ASSERTION = {
+        'entityType': 'Assertion',
+        'entityId': 'I4eaA9LARAaODuDaxt9DGQ',
+        'openBadgeId': 'https://api.badgr.io/public/assertions/'
+                       'I4eaA9LARAaODuDaxt9DGQ',
+        'createdAt': '2019-09-17T23:54:18.277836Z',
+        'createdBy': 'LjhaHDrCT7K6EdwC_vVVIA',
+        'issuer': '5Dm1JnO_STiXQ26x5yD4Kg',
+        'issuerOpenBadgeId': 'https://api.badgr.io/public/issuers/'
+                             '5Dm1JnO_STiXQ26x5yD4Kg',
+        'image': 'https://media.badgr.io/uploads/badges/assertion.png',
+        'expires': None,
+        'extensions': {}}
+    RESULT_LINE_START = 'I4eaA9LARAaODuDaxt9DGQ\thttps://'
+
+    def setUp(self):
+        super().setUp()
+        self._tempdir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self._tempdir, 'checkpoint')
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self._tempdir)
+
+    def write_input(self, name: str, content: str) -> str:
+        """Write batch input file, returning its path"""
+
+        path = os.path.join(self._tempdir, name)
+        with open(path, 'w') as input_h:
+            input_h.write(content)
+        return path
+
+    def fake_award_badge(self, failing=()):
+        """Return stand-in for BadgrLite.award_badge
+
+        Recipients in `failing` raise AwardBadgeBadDataError.
+        """
+
+        def award_badge(_, badge_id, badge_data):
+            self.assertEqual(badge_id, '2TfNNqMLT8CoAhfGKqSv6Q')
+            if badge_data['recipient']['identity'] in failing:
+                raise exceptions.AwardBadgeBadDataError('bad data')
+            return models.Badge(self.SAMPLE_ASSERTION)
+        return award_badge
+
+    def invoke(self, input_file, *options):
+        """Invoke award-batch for input_file"""
+
+        return self.runner.invoke(
+            cli.main,
+            ['--token-file', self.token_file, 'award-batch', input_file,
+             '--checkpoint', self.checkpoint] + list(options))
+
+    def test_cli_subcommand_award_batch_help(self):
+        """CLI has subcommand award-batch"""
+
+        result = self.runner.invoke(cli.main, ['award-batch', '--help'])
+        self.assertEqual(0, result.exit_code)
+
+    def test_cli_subcommand_serve_help(self):
+        """CLI has subcommand serve"""
+
+        result = self.runner.invoke(cli.main, ['serve', '--help'])
+        self.assertEqual(0, result.exit_code)
+        self.assertIn('--socket', result.output)
+        self.assertIn('--secret-file', result.output)
+
+    def test_cli_serve_socket_or_port(self):
+        """CLI serve listens on a Unix socket or a port, not both"""
+
+        result = self.runner.invoke(
+            cli.main, ['serve', '--socket', 'badgr.sock', '--port', '8765'])
+        self.assertEqual(2, result.exit_code)
+        self.assertIn('--socket and --port are exclusive', result.output)
+
+    def test_cli_award_batch_csv(self):
+        """CLI award-batch awards one badge per CSV row"""
+
+        input_file = self.write_input(
+            'awards.csv',
+            'badge_id,recipient,notify\n'
+            '2TfNNqMLT8CoAhfGKqSv6Q,a@example.com,yes\n'
+            '2TfNNqMLT8CoAhfGKqSv6Q,b@example.com,no\n')
+
+        with unittest.mock.patch('badgr_lite.models.BadgrLite.award_badge',
+                                 self.fake_award_badge()):
+            result = self.invoke(input_file)
+        self.assertEqual(0, result.exit_code)
+        self.assertEqual(2, result.output.count(self.RESULT_LINE_START))
+
+    def test_cli_award_batch_jsonl_with_default_badge_id(self):
+        """CLI award-batch reads JSONL and falls back to --badge-id"""
+
+        input_file = self.write_input(
+            'awards.jsonl',
+            '{"recipient": "a@example.com"}\n'
+            '\n'
+            '{"badge_data": {"recipient": {"identity": "b@example.com"}}}\n')
+
+        with unittest.mock.patch('badgr_lite.models.BadgrLite.award_badge',
+                                 self.fake_award_badge()):
+            result = self.invoke(input_file,
+                                 '--badge-id', '2TfNNqMLT8CoAhfGKqSv6Q')
+        self.assertEqual(0, result.exit_code)
+        self.assertEqual(2, result.output.count(self.RESULT_LINE_START))
+
+    def test_cli_award_batch_resumes_from_checkpoint(self):
+        """CLI award-batch only retries rows missing from checkpoint"""
+
+        input_file = self.write_input(
+            'awards.csv',
+            'recipient\na@example.com\nb@example.com\nc@example.com\n')
+
+        with unittest.mock.patch(
+                'badgr_lite.models.BadgrLite.award_badge',
+                self.fake_award_badge(failing=('b@example.com',))):
+            result = self.invoke(input_file,
+                                 '--badge-id', '2TfNNqMLT8CoAhfGKqSv6Q')
+        self.assertNotEqual(0, result.exit_code)
+        self.assertIn('ERROR\trow 2\tAwardBadgeBadDataError', result.output)
+        self.assertEqual(cli.load_checkpoint(self.checkpoint), {1, 3})
+
+        with unittest.mock.patch('badgr_lite.models.BadgrLite.award_badge',
+                                 self.fake_award_badge()):
+            result = self.invoke(input_file,
+                                 '--badge-id', '2TfNNqMLT8CoAhfGKqSv6Q')
+        self.assertEqual(0, result.exit_code)
+        self.assertEqual(1, result.output.count(self.RESULT_LINE_START))
+        self.assertEqual(cli.load_checkpoint(self.checkpoint), {1, 2, 3})
+
+    def test_cli_queue_enqueue_worker_status(self):
+        """CLI queue enqueues rows, a draining worker awards them"""
+
+        input_file = self.write_input(
+            'awards.csv',
+            'recipient\na@example.com\nb@example.com\nc@example.com\n')
+        queue = ['--token-file', self.token_file, 'queue', '--queue-file',
+                 os.path.join(self._tempdir, 'queue.sqlite3')]
+
+        result = self.runner.invoke(cli.main, queue + [
+            'enqueue', input_file, '--badge-id', '2TfNNqMLT8CoAhfGKqSv6Q'])
+        self.assertEqual(0, result.exit_code)
+        self.assertIn('Queued 3 award(s)', result.output)
+
+        with unittest.mock.patch(
+                'badgr_lite.models.BadgrLite.award_badge',
+                self.fake_award_badge(failing=('b@example.com',))):
+            result = self.runner.invoke(cli.main, queue + ['worker',
+                                                           '--drain'])
+        self.assertEqual(0, result.exit_code)
+        self.assertEqual(2, result.output.count(self.RESULT_LINE_START))
+        self.assertIn('AwardBadgeBadDataError', result.output)
+
+        result = self.runner.invoke(cli.main, queue + ['status', '--failed'])
+        self.assertIn('pending\t0\n', result.output)
+        self.assertIn('done\t2\n', result.output)
+        self.assertIn('failed\t1\n', result.output)
+        self.assertIn('b@example.com', result.output)
+
+
+class TestBadgrLiteCLIRevokeBatch(TestBadgrLiteBase):
+    """BadgrLite CLI revoke-batch subcommand tests"""
+
+    def setUp(self):
+        super().setUp()
+        self._tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._tempdir)
+        self.checkpoint = os.path.join(self._tempdir, 'checkpoint')
+        self.input_file = os.path.join(self._tempdir, 'revoke.txt')
+        with open(self.input_file, 'w') as input_h:
+            input_h.write('# Bad run\nassertion1\n\n'
+                          'assertion2 Wrong recipient\nunknown\n')
+
+    def invoke(self):
+        """Invoke revoke-batch, recording revocations made"""
+
+        revoked = {}
+
+        def revoke_assertion(_, entity_id, reason):
+            if entity_id == 'unknown' or reason == 'Fails':
+                raise exceptions.BadAssertionIdError('not found')
+            revoked[entity_id] = reason
+
+        with unittest.mock.patch(
+                'badgr_lite.models.BadgrLite.revoke_assertion',
+                revoke_assertion):
+            result = self.runner.invoke(
+                cli.main,
+                ['--token-file', self.token_file, 'revoke-batch',
+                 self.input_file, '--reason', 'Bad run', '--checkpoint',
+                 self.checkpoint])
+        return result, revoked
+
+    def test_cli_subcommand_revoke_batch_help(self):
+        """CLI has subcommand revoke-batch"""
+
+        result = self.runner.invoke(cli.main, ['revoke-batch', '--help'])
+        self.assertEqual(0, result.exit_code)
+
+    def test_cli_revoke_batch(self):
+        """CLI revoke-batch revokes each listed assertion once"""
+
+        result, revoked = self.invoke()
+        self.assertNotEqual(0, result.exit_code)
+        self.assertEqual(revoked, {'assertion1': 'Bad run',
+                                   'assertion2': 'Wrong recipient'})
+        self.assertIn('assertion1\trevoked', result.output)
+        self.assertIn('ERROR\tline 5\tunknown\tBadAssertionIdError',
+                      result.output)
+        self.assertEqual(cli.load_checkpoint(self.checkpoint), {2, 4})
+
+        result, revoked = self.invoke()
+        self.assertEqual(list(revoked), [])
+
+    def test_cli_revoke_batch_repeated_assertion(self):
+        """CLI revoke-batch reports each line of a repeated assertion"""
+
+        with open(self.input_file, 'w') as input_h:
+            input_h.write('assertion1 Fails\nassertion1 Works\n')
+        result, revoked = self.invoke()
+        self.assertEqual(revoked, {'assertion1': 'Works'})
+        self.assertIn('ERROR\tline 1\tassertion1', result.output)
+        self.assertEqual(cli.load_checkpoint(self.checkpoint), {2})
+
+
+class TestBadgrLiteCLIStartup(unittest.TestCase):
+    """`badgr --help` must start quickly: heavy modules are lazy"""
+
+    HEAVY_MODULES = ('requests', 'pytz', 'sqlite3', 'concurrent.futures')
+    # Cumulative import time of badgr_lite.cli (including click), in ms
+    STARTUP_BUDGET_MS = 150
+    ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def run_python(self, *args) -> subprocess.CompletedProcess:
+        """Run a fresh interpreter on the source tree"""
+
+        environment = dict(os.environ, PYTHONPATH=self.ROOT)
+        return subprocess.run([sys.executable] + list(args), cwd=self.ROOT,
+                              env=environment, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE,
+                              universal_newlines=True, check=True)
+
+    def test_help_does_not_import_heavy_modules(self):
+        """CLI --help runs without importing requests, pytz, ..."""
+
+        script = '\n'.join([
+            'import sys',
+            'from badgr_lite import cli',
+            'sys.argv = ["badgr", "--help"]',
+            'try:',
+            '    cli.main()',
+            'except SystemExit:',
+            '    pass',
+            'print(" ".join(name for name in {!r}'.format(self.HEAVY_MODULES),
+            '               if name in sys.modules))'])
+        output = self.run_python('-c', script).stdout
+        self.assertIn('Usage:', output)
+        self.assertEqual(output.splitlines()[-1], '')
+
+    def test_startup_within_budget(self):
+        """CLI module imports within STARTUP_BUDGET_MS (-X importtime)"""
+
+        def import_time_ms():
+            stderr = self.run_python(
+                '-X', 'importtime', '-c', 'import badgr_lite.cli').stderr
+            for line in stderr.splitlines():
+                if line.endswith('| badgr_lite.cli'):
+                    return int(line.split('|')[1]) / 1000
+            self.fail('badgr_lite.cli not in -X importtime output')
+            return None
+
+        # Best of three, so a busy machine does not fail the test
+        best = min(import_time_ms() for _ in range(3))
+        self.assertLess(best, self.STARTUP_BUDGET_MS)
+
+
 if __name__ == '__main__':
     unittest.main()
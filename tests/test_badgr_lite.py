@@ -5,16 +5,45 @@
 """Tests for `badgr_lite` package."""
 
 
+import asyncio
 import datetime
+import errno
+import hashlib
+import http.client
+import itertools
 import json
+import multiprocessing
 import os
+import pickle
+import shutil
+import socket
+import sqlite3
 from tempfile import mkdtemp
+import threading
+import time
+import tracemalloc
 import unittest
+import unittest.mock
 
+import requests
 import vcr
-
+import yaml
+
+from badgr_lite.aio import AsyncBadgrLite
+from badgr_lite.awardqueue import AwardQueue, QueueWorker
+from badgr_lite.cache import CacheEntry, ResponseCache
+from badgr_lite.client import BadgrClient
+from badgr_lite.dedup import AwardIndex
+from badgr_lite.fakeserver import FakeBadgrServer, fake_image
+from badgr_lite.metrics import MetricsRegistry, endpoint_of
 from badgr_lite.models import BadgrLite, Badge
-from badgr_lite import exceptions
+from badgr_lite.pool import AccountPool
+from badgr_lite.ratelimit import RateLimiter, parse_retry_after
+from badgr_lite.retry import RetryPolicy
+from badgr_lite.server import (AwardBatcher, BadgrService, make_server,
+                               read_secret)
+from badgr_lite import exceptions, helpers
+from badgr_lite.helpers import imap_bounded, interleave_bounded
 
 
 class BadgrLiteTestBase(unittest.TestCase):
@@ -40,8 +69,7 @@ class BadgrLiteTestBase(unittest.TestCase):
     def tearDown(self):
         """Remove temporary files"""
 
-        os.remove(self.sample_token_file)
-        os.rmdir(self._tempdir)
+        shutil.rmtree(self._tempdir)
 
     def get_badgr_setup(self):
         """Return BadgrLite instance for testing"""
@@ -50,6 +78,62 @@ class BadgrLiteTestBase(unittest.TestCase):
         badgr.load_token()
         return badgr
 
+    @staticmethod
+    def make_response(status_code: int, body, headers=None):
+        """Return requests.Response with given status, body and headers
+
+        A body that is not a string is encoded as JSON.
+        """
+
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers.update(headers or {})
+        # Build the Response by hand; pylint: disable=W0212
+        response._content = body.encode('utf8')
+        response.raw = unittest.mock.Mock(spec=['close'])
+        return response
+
+    def get_refreshing_session(self, responses) -> unittest.mock.Mock:
+        """Return session answering requests with responses in turn
+
+        Token refreshes (POST to /o/token) are answered with a new token.
+        """
+
+        responses = iter(responses)
+
+        def request(method, url, **kwargs):
+            if url.endswith('/o/token'):
+                return self.make_response(200, {
+                    'access_token': 'new_token', 'refresh_token': 'new'})
+            return next(responses)
+
+        session = unittest.mock.Mock()
+        session.request.side_effect = request
+        return session
+
+    def get_fake_session(self, cassette: str) -> unittest.mock.Mock:
+        """Return session answering every request from a cassette
+
+        Recorded responses are replayed in order, then the last one is
+        repeated. Unlike a VCR cassette, this works from worker threads.
+        """
+
+        with open(cassette) as cassette_h:
+            interactions = yaml.safe_load(cassette_h)['interactions']
+
+        responses = [
+            self.make_response(interaction['response']['status']['code'],
+                               interaction['response']['body']['string'])
+            for interaction in interactions]
+
+        session = unittest.mock.Mock()
+        session.request.side_effect = \
+            lambda *args, **kwargs: responses.pop(0) if len(responses) > 1 \
+            else responses[0]
+        return session
+
     def get_sample_badge(self):
         """Fetch single badge for other tests"""
 
@@ -109,6 +193,79 @@ class TestBadgeInstantiation(BadgrLiteTestBase):
                 # We need more attrs than just created_at
                 Badge({'created_at': '2019-09-04T19:03:24Z'})
 
+    def test_to_dict_gives_api_mapping(self):
+        """Badge.to_dict() gives the mapping the badge was created from"""
+
+        attrs = self.get_sample_attrs()
+        badge = Badge(attrs)
+        self.assertIsInstance(badge.created_at, datetime.datetime)
+        self.assertIs(badge.to_dict(), attrs)
+        self.assertEqual(badge.to_dict()['created_at'],
+                         '2019-09-04T19:03:24Z')
+
+
+class TestBadgeCompactRepresentation(BadgrLiteTestBase):
+    """Badge() memory-compact, lazily decoded representation tests"""
+
+    def get_sample_json(self):
+        """Return API (camelCase) dictionary for creating Badge"""
+
+        with open('tests/vcr_cassettes/badge_retrieval.yaml') as cassette_h:
+            return json.loads(yaml.safe_load(cassette_h)['interactions'][0]
+                              ['response']['body']['string'])['result'][0]
+
+    def test_badge_has_no_instance_dict(self):
+        """Badge() is slotted and keeps no per-instance __dict__"""
+
+        self.assertFalse(hasattr(Badge(self.get_sample_json()), '__dict__'))
+
+    def test_badge_keeps_given_dictionary(self):
+        """Badge() stores the given dictionary without copying values"""
+
+        attrs = self.get_sample_json()
+        badge = Badge(attrs)
+        self.assertIs(badge.description, attrs['description'])
+        self.assertIs(badge.issuer_open_badge_id, attrs['issuerOpenBadgeId'])
+
+    def test_created_at_decoded_once_on_access(self):
+        """Badge().created_at is converted on first access only"""
+
+        converter = unittest.mock.Mock(return_value='decoded')
+        # Converters are not meant to be exposed; pylint: disable=W0212
+        with unittest.mock.patch.dict(Badge._CONVERTERS,
+                                      {'created_at': converter}):
+            badge = Badge(self.get_sample_json())
+            self.assertFalse(converter.called)
+            self.assertEqual(badge.created_at, 'decoded')
+            self.assertEqual(badge.created_at, 'decoded')
+            self.assertEqual(converter.call_count, 1)
+
+    def test_missing_attribute_raises_attribute_error(self):
+        """Badge() raises AttributeError for attributes not given"""
+
+        attrs = self.get_sample_json()
+        del attrs['name']
+        badge = Badge(attrs)
+        self.assertFalse(hasattr(badge, 'name'))
+        self.assertIn('<No name>', str(badge))
+
+    def test_attributes_can_be_assigned(self):
+        """Badge() attributes can still be assigned"""
+
+        badge = Badge(self.get_sample_json())
+        badge.name = 'Renamed'
+        badge.note = 'A note'
+        self.assertEqual(badge.name, 'Renamed')
+        self.assertEqual(badge.note, 'A note')
+
+    def test_badge_can_be_pickled(self):
+        """Badge() survives a pickle round trip"""
+
+        badge = Badge(self.get_sample_json())
+        copy = pickle.loads(pickle.dumps(badge))
+        self.assertEqual(copy.entity_id, badge.entity_id)
+        self.assertEqual(copy.created_at, badge.created_at)
+
 
 class TestBadgeBadgesMethod(BadgrLiteTestBase):
     """Badge.badges() related tests"""
@@ -254,6 +411,264 @@ class TestBadgeOptionalAttributes(BadgrLiteTestBase):
         self.assertIsInstance(badge.tags, list)
 
 
+class TestBadgrLiteIterBadges(BadgrLiteTestBase):
+    """BadgrLite.iter_badges() related tests"""
+
+    def get_paged_badgr(self, pages: int = 3) -> BadgrLite:
+        """Return BadgrLite whose session serves badge classes in pages"""
+
+        with open('tests/vcr_cassettes/badge_retrieval.yaml') as cassette_h:
+            body = json.loads(yaml.safe_load(cassette_h)['interactions'][0]
+                              ['response']['body']['string'])
+
+        def request(method, url, **kwargs):
+            page = int(url.split('cursor=')[1]) if 'cursor=' in url else 0
+            headers = {}
+            if page < pages - 1:
+                headers['Link'] = '<{}?cursor={}>; rel="next"'.format(
+                    self._sample_url, page + 1)
+            page_body = dict(body, result=[
+                dict(raw, entityId='page{}_{}'.format(page, number))
+                for number, raw in enumerate(body['result'])])
+            return self.make_response(200, page_body, headers)
+
+        session = unittest.mock.Mock()
+        session.request.side_effect = request
+        return BadgrLite(token_filename=self.sample_token_file,
+                         session=session)
+
+    def test_iter_badges_is_lazy(self):
+        """.iter_badges() fetches pages only as they are needed"""
+
+        badgr = self.get_paged_badgr()
+        badges = badgr.iter_badges()
+        self.assertIsInstance(next(badges), Badge)
+        self.assertEqual(badgr.session.request.call_count, 1)
+
+    def test_iter_badges_follows_pages(self):
+        """.iter_badges() yields badges from every page"""
+
+        badgr = self.get_paged_badgr()
+        entity_ids = [badge.entity_id for badge in badgr.iter_badges()]
+        self.assertEqual(badgr.session.request.call_count, 3)
+        self.assertTrue(entity_ids[0].startswith('page0_'))
+        self.assertTrue(entity_ids[-1].startswith('page2_'))
+
+    def test_iter_badges_prefetch_gives_same_badges(self):
+        """.iter_badges(prefetch=True) yields the same badges in order"""
+
+        expected = [badge.entity_id
+                    for badge in self.get_paged_badgr().iter_badges()]
+        prefetched = [badge.entity_id for badge in
+                      self.get_paged_badgr().iter_badges(prefetch=True)]
+        self.assertEqual(prefetched, expected)
+
+    def test_iter_badges_projects_fields(self):
+        """.iter_badges(fields=...) yields only the requested fields"""
+
+        badges = list(self.get_paged_badgr().iter_badges())
+        records = list(self.get_paged_badgr().iter_badges(
+            fields=['entity_id', 'createdAt', 'missing']))
+
+        self.assertEqual(len(records), len(badges))
+        self.assertEqual(records[0], {
+            'entity_id': badges[0].entity_id,
+            # pylint: disable=W0212
+            'createdAt': badges[0]._raw['createdAt'],
+            'missing': None})
+
+    def test_badges_collects_all_pages(self):
+        """.badges gives badges from every page"""
+
+        self.assertEqual(len(self.get_paged_badgr(pages=2).badges),
+                         len(list(self.get_paged_badgr(
+                             pages=1).iter_badges())) * 2)
+
+
+class TestBadgrLiteIterAssertions(BadgrLiteTestBase):
+    """BadgrLite.iter_assertions() related tests"""
+
+    def get_assertions_badgr(self, badge_count: int = 3) -> BadgrLite:
+        """Return BadgrLite whose session serves badges and assertions
+
+        Each badge class has two pages of two assertions.
+        """
+
+        with open('tests/vcr_cassettes/badge_retrieval.yaml') as cassette_h:
+            badge_body = json.loads(yaml.safe_load(cassette_h)[
+                'interactions'][0]['response']['body']['string'])
+        with open('tests/vcr_cassettes/award_badge.yaml') as cassette_h:
+            assertion = json.loads(yaml.safe_load(cassette_h)[
+                'interactions'][0]['response']['body']['string'])[
+                    'result'][0]
+
+        def request(method, url, **kwargs):
+            path = url.split('/v2/')[1]
+            if path == 'badgeclasses':
+                return self.make_response(200, dict(badge_body, result=[
+                    dict(badge_body['result'][0], entityId='b{}'.format(i))
+                    for i in range(badge_count)]))
+
+            owner = path.split('/')[1]
+            page = int(url.split('cursor=')[1]) if 'cursor=' in url else 0
+            headers = {}
+            if page == 0:
+                headers['Link'] = '<{}?cursor=1>; rel="next"'.format(url)
+            return self.make_response(200, dict(badge_body, result=[
+                dict(assertion, entityId='{}_{}_{}'.format(owner, page, i))
+                for i in range(2)]), headers)
+
+        session = unittest.mock.Mock()
+        session.request.side_effect = request
+        return BadgrLite(token_filename=self.sample_token_file,
+                         session=session)
+
+    def test_iter_assertions_of_badge_class(self):
+        """.iter_assertions(badge_id=...) pages through one badge class"""
+
+        assertions = list(
+            self.get_assertions_badgr().iter_assertions(badge_id='b1'))
+        self.assertEqual([assertion.entity_id for assertion in assertions],
+                         ['b1_0_0', 'b1_0_1', 'b1_1_0', 'b1_1_1'])
+        self.assertIsInstance(assertions[0], Badge)
+
+    def test_iter_assertions_of_issuer(self):
+        """.iter_assertions(issuer_id=...) lists an issuer's assertions"""
+
+        badgr = self.get_assertions_badgr()
+        assertions = list(badgr.iter_assertions(issuer_id='i1'))
+        self.assertEqual(len(assertions), 4)
+        self.assertIn('/v2/issuers/i1/assertions',
+                      badgr.session.request.call_args[0][1])
+
+    def test_iter_assertions_fans_out_over_all_badge_classes(self):
+        """.iter_assertions() fetches every badge class in parallel"""
+
+        assertions = self.get_assertions_badgr().iter_assertions(
+            max_workers=2)
+        self.assertEqual(
+            sorted(assertion.entity_id for assertion in assertions),
+            sorted('b{}_{}_{}'.format(badge, page, number)
+                   for badge in range(3) for page in range(2)
+                   for number in range(2)))
+
+    def test_iter_assertions_of_given_badge_classes(self):
+        """.iter_assertions(badge_ids=...) fetches only those classes"""
+
+        assertions = self.get_assertions_badgr().iter_assertions(
+            badge_ids=['b0', 'b2'])
+        self.assertEqual(
+            {assertion.entity_id.split('_')[0] for assertion in assertions},
+            {'b0', 'b2'})
+
+
+class TestBadgrLiteResponseCache(BadgrLiteTestBase):
+    """BadgrLite on-disk badge class cache tests"""
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = os.path.join(self._tempdir, 'cache')
+        with open('tests/vcr_cassettes/badge_retrieval.yaml') as cassette_h:
+            self.body = yaml.safe_load(cassette_h)['interactions'][0][
+                'response']['body']['string']
+
+    def get_cached_badgr(self, **cache_options) -> BadgrLite:
+        """Return BadgrLite with cache, answering 304 when ETag matches"""
+
+        def request(method, url, headers=None, **kwargs):
+            if headers.get('If-None-Match') == '"v1"':
+                return self.make_response(304, '')
+            return self.make_response(200, self.body, {'ETag': '"v1"'})
+
+        session = unittest.mock.Mock()
+        session.request.side_effect = request
+        return BadgrLite(token_filename=self.sample_token_file,
+                         session=session,
+                         cache=ResponseCache(self.cache_dir, **cache_options))
+
+    def sent_headers(self, badgr: BadgrLite) -> list:
+        """Return headers of every request sent by badgr"""
+
+        return [call[1]['headers']
+                for call in badgr.session.request.call_args_list]
+
+    def test_listing_is_revalidated(self):
+        """.badges revalidates a cached listing and serves it on 304"""
+
+        first = [badge.entity_id
+                 for badge in self.get_cached_badgr().badges]
+        badgr = self.get_cached_badgr()
+        second = [badge.entity_id for badge in badgr.badges]
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.sent_headers(badgr)[0]['If-None-Match'],
+                         '"v1"')
+
+    def test_fresh_listing_needs_no_request(self):
+        """.badges uses a listing within its TTL without any request"""
+
+        self.get_cached_badgr(ttl=60).badges  # pylint: disable=W0106
+        badgr = self.get_cached_badgr(ttl=60)
+        self.assertTrue(badgr.badges)
+        self.assertFalse(badgr.session.request.called)
+
+    def test_refresh_ignores_cached_listing(self):
+        """.badges with cache refresh downloads the listing again"""
+
+        self.get_cached_badgr().badges  # pylint: disable=W0106
+        badgr = self.get_cached_badgr(refresh=True)
+        self.assertTrue(badgr.badges)
+        self.assertNotIn('If-None-Match', self.sent_headers(badgr)[0])
+
+    def test_cache_is_bounded(self):
+        """ResponseCache() evicts entries beyond max_entries"""
+
+        cache = ResponseCache(self.cache_dir, max_entries=2)
+        for number in range(3):
+            cache.put(cache.key('url{}'.format(number), 'account'),
+                      CacheEntry(b'{}'))
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    def test_cache_size_is_tracked(self):
+        """ResponseCache() lists its directory only to count or evict"""
+
+        cache = ResponseCache(self.cache_dir, max_entries=3)
+        with unittest.mock.patch('os.listdir', wraps=os.listdir) as listdir:
+            for number in range(6):
+                cache.put(cache.key('url{}'.format(number % 3), 'account'),
+                          CacheEntry(b'{}'))
+        self.assertEqual(listdir.call_count, 1)
+        with unittest.mock.patch('os.listdir', wraps=os.listdir) as listdir:
+            cache.put(cache.key('url3', 'account'), CacheEntry(b'{}'))
+        self.assertEqual(listdir.call_count, 1)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 3)
+
+    def test_revalidation_only_touches_entry(self):
+        """ResponseCache.revalidated() updates the time, not the body"""
+
+        cache = ResponseCache(self.cache_dir, ttl=60)
+        key = cache.key(self._sample_url, 'account')
+        cache.put(key, CacheEntry(b'{}', '"v1"', validated_at=1000))
+        entry = cache.get(key)
+        self.assertFalse(cache.is_fresh(entry))
+        inode = os.stat(os.path.join(self.cache_dir, key + '.cache')).st_ino
+
+        cache.revalidated(key, entry)
+
+        self.assertEqual(
+            os.stat(os.path.join(self.cache_dir, key + '.cache')).st_ino,
+            inode)
+        entry = cache.get(key)
+        self.assertTrue(cache.is_fresh(entry))
+        self.assertEqual((entry.body, entry.etag), (b'{}', '"v1"'))
+
+    def test_cache_is_keyed_by_account(self):
+        """ResponseCache() keys differ per account"""
+
+        self.assertNotEqual(ResponseCache.key(self._sample_url, 'first'),
+                            ResponseCache.key(self._sample_url, 'second'))
+
+
 class TestBadgrLiteInstantiation(BadgrLiteTestBase):
     """Test BadgrLite Instantiation"""
 
@@ -330,6 +745,1124 @@ class TestBadgrLiteInstantiation(BadgrLiteTestBase):
                                 badgr._token_data['access_token'])
 
 
+class TestBadgrLiteTokenCache(BadgrLiteTestBase):
+    """Test BadgrLite in-memory token cache"""
+
+    def rewrite_token_file(self, access_token: str) -> None:
+        """Replace sample token file with one holding access_token"""
+
+        with open(self.sample_token_file, 'w') as stf_h:
+            stf_h.write(json.dumps({"access_token": access_token,
+                                    "token_type": "Bearer",
+                                    "refresh_token": "some_refresh_token"}))
+        # Make the change visible even on coarse mtime filesystems
+        stat = os.stat(self.sample_token_file)
+        os.utime(self.sample_token_file,
+                 ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def test_token_file_read_once(self):
+        """BadgrLite.load_token() does not re-read an unchanged file"""
+
+        badgr = self.get_badgr_setup()
+        with unittest.mock.patch('builtins.open') as mock_open:
+            badgr.load_token()
+            badgr.load_token()
+        self.assertFalse(mock_open.called)
+
+    def test_token_file_reread_when_changed(self):
+        """BadgrLite.load_token() reloads a changed token file"""
+
+        badgr = self.get_badgr_setup()
+        self.rewrite_token_file('a_new_token')
+        badgr.load_token()
+
+        # _token_data isn't meant to be exposed; pylint: disable=W0212
+        self.assertEqual(badgr._token_data['access_token'], 'a_new_token')
+
+    def test_token_cache_can_be_disabled(self):
+        """BadgrLite(token_cache=False) reads the file on every call"""
+
+        badgr = BadgrLite(token_filename=self.sample_token_file,
+                          token_cache=False)
+        badgr.load_token()
+        with unittest.mock.patch('builtins.open',
+                                 unittest.mock.mock_open(
+                                     read_data='{"access_token": "x"}')):
+            badgr.load_token()
+
+        # _token_data isn't meant to be exposed; pylint: disable=W0212
+        self.assertEqual(badgr._token_data['access_token'], 'x')
+
+    def test_refresh_does_not_force_reread(self):
+        """BadgrLite refreshed token is kept without re-reading the file"""
+
+        badgr = self.get_badgr_setup()
+        with vcr.use_cassette('tests/vcr_cassettes/expired_auth_token.yaml'):
+            badgr.get_from_server(self._sample_url)
+        with unittest.mock.patch('builtins.open') as mock_open:
+            badgr.load_token()
+        self.assertFalse(mock_open.called)
+
+
+def refresh_in_other_process(token_filename: str, stale_token: str,
+                             posts_filename: str) -> None:
+    """Refresh token in a child process, recording each token POST"""
+
+    def post(*args, **kwargs):
+        with open(posts_filename, 'a') as posts_h:
+            posts_h.write('POST\n')
+        response = requests.Response()
+        response.status_code = 200
+        # Build the Response by hand; pylint: disable=W0212
+        response._content = json.dumps(
+            {"access_token": "new_token_{}".format(os.getpid()),
+             "refresh_token": "new_refresh_token"}).encode('utf8')
+        time.sleep(0.05)
+        return response
+
+    session = unittest.mock.Mock()
+    session.request.side_effect = post
+    badgr = BadgrLite(token_filename=token_filename, session=session)
+    badgr.load_token()
+    badgr.refresh_token(stale_access_token=stale_token)
+
+
+class TestBadgrLiteTokenRefreshCoordination(BadgrLiteTestBase):
+    """Test single-flight token refresh across BadgrLite instances"""
+
+    def test_refresh_uses_token_refreshed_elsewhere(self):
+        """BadgrLite.refresh_token() adopts token refreshed by others"""
+
+        first = self.get_badgr_setup()
+        second = BadgrLite(token_filename=self.sample_token_file,
+                           session=unittest.mock.Mock())
+        second.load_token()
+
+        with vcr.use_cassette('tests/vcr_cassettes/expired_auth_token.yaml'):
+            first.refresh_token()
+        second.refresh_token(stale_access_token=self._sample_token)
+
+        self.assertFalse(second.session.request.called)
+        self.assertEqual(second.prepare_headers(), first.prepare_headers())
+
+    def test_refresh_replaces_token_file_atomically(self):
+        """BadgrLite.refresh_token() leaves no partial or temporary files"""
+
+        badgr = self.get_badgr_setup()
+        with vcr.use_cassette('tests/vcr_cassettes/expired_auth_token.yaml'):
+            badgr.refresh_token()
+
+        self.assertEqual(
+            sorted(os.listdir(self._tempdir)),
+            ['sample_token_file.json', 'sample_token_file.json.lock'])
+        with open(self.sample_token_file) as stf_h:
+            self.assertIn('access_token', json.load(stf_h))
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "requires fork")
+    def test_refresh_is_single_flight_across_processes(self):
+        """BadgrLite.refresh_token() POSTs once for many processes"""
+
+        posts_filename = os.path.join(self._tempdir, 'posts')
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(
+                target=refresh_in_other_process,
+                args=(self.sample_token_file, self._sample_token,
+                      posts_filename))
+            for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        with open(posts_filename) as posts_h:
+            self.assertEqual(posts_h.read(), 'POST\n')
+
+
+class TestBadgrLiteSession(BadgrLiteTestBase):
+    """Test BadgrLite pooled session handling"""
+
+    def test_has_pooled_session(self):
+        """BadgrLite() creates a connection-pooled session"""
+
+        badgr = BadgrLite(token_filename=self.sample_token_file,
+                          pool_maxsize=32)
+        self.assertIsInstance(badgr.session, requests.Session)
+        adapter = badgr.session.get_adapter('https://api.badgr.io')
+        # Pool size is not publicly exposed; pylint: disable=W0212
+        self.assertEqual(adapter._pool_maxsize, 32)
+
+    def test_session_is_reused(self):
+        """BadgrLite() sends every call over the same session"""
+
+        badgr = self.get_badgr_setup()
+        session = badgr.session
+        with vcr.use_cassette('tests/vcr_cassettes/badge_retrieval.yaml'):
+            badgr.get_from_server(self._sample_url)
+        self.assertIs(session, badgr.session)
+
+    def test_accepts_injected_session(self):
+        """BadgrLite() uses a caller-supplied session"""
+
+        session = requests.Session()
+        badgr = BadgrLite(token_filename=self.sample_token_file,
+                          session=session)
+        badgr.load_token()
+        with vcr.use_cassette('tests/vcr_cassettes/badge_retrieval.yaml'):
+            self.assertTrue(badgr.badges)
+        self.assertIs(session, badgr.session)
+
+    def test_close_leaves_injected_session_open(self):
+        """BadgrLite.close() does not close a caller-supplied session"""
+
+        session = unittest.mock.Mock()
+        with BadgrLite(token_filename=self.sample_token_file,
+                       session=session):
+            pass
+        self.assertFalse(session.close.called)
+
+    def test_keep_alive_can_be_disabled(self):
+        """BadgrLite() asks server to close connections if not keep-alive"""
+
+        badgr = BadgrLite(token_filename=self.sample_token_file,
+                          keep_alive=False)
+        self.assertEqual(badgr.session.headers['Connection'], 'close')
+
+    def test_refresh_skipped_when_already_refreshed(self):
+        """BadgrLite.refresh_token() is skipped if token already replaced"""
+
+        session = unittest.mock.Mock()
+        badgr = BadgrLite(token_filename=self.sample_token_file,
+                          session=session)
+        badgr.load_token()
+        badgr.refresh_token(stale_access_token='some_older_token')
+        self.assertFalse(session.request.called)
+
+
+class TestRateLimiter(BadgrLiteTestBase):
+    """Test RateLimiter pacing and BadgrLite handling of 429 answers"""
+
+    def get_limited_badgr(self, statuses, limiter=None):
+        """Return BadgrLite whose session answers the given statuses"""
+
+        responses = [self.make_response(
+            status, {'result': []}, {'Retry-After': '0'} if status == 429
+            else {}) for status in statuses]
+        session = unittest.mock.Mock()
+        session.request.side_effect = responses
+        badgr = BadgrLite(token_filename=self.sample_token_file,
+                          session=session, rate_limiter=limiter)
+        badgr.load_token()
+        return badgr
+
+    def test_parse_retry_after(self):
+        """parse_retry_after() understands seconds and HTTP dates"""
+
+        self.assertEqual(parse_retry_after('3'), 3.0)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('soon'))
+        self.assertEqual(
+            parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+
+    def test_acquire_paces_requests(self):
+        """RateLimiter.acquire() lets burst through, then paces at rate"""
+
+        limiter = RateLimiter(rate=50, burst=2)
+        started = time.monotonic()
+        for _ in range(6):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 4 / 50 - 0.01)
+
+    def test_limiters_share_state_file(self):
+        """RateLimiter() with the same shared_filename shares one bucket"""
+
+        shared_filename = os.path.join(self._tempdir, 'rate.json')
+        first = RateLimiter(rate=1, shared_filename=shared_filename)
+        second = RateLimiter(rate=1, shared_filename=shared_filename)
+        self.assertEqual(first.acquire(), 0)
+        self.assertGreater(second.acquire(), 0.5)
+
+    def test_throttle_halves_rate_and_success_restores_it(self):
+        """RateLimiter.throttle() lowers rate, succeeded() raises it again"""
+
+        limiter = RateLimiter(rate=100)
+        limiter.throttle(0)
+        self.assertEqual(limiter.rate, 50)
+        for _ in range(10):
+            limiter.succeeded()
+        self.assertEqual(limiter.rate, 100)
+
+    def test_throttle_pauses_for_retry_after(self):
+        """RateLimiter.throttle() delays the next acquire by Retry-After"""
+
+        limiter = RateLimiter(rate=1000, burst=10)
+        limiter.throttle(0.2)
+        self.assertGreater(limiter.acquire(), 0.15)
+
+    def test_429_is_retried(self):
+        """BadgrLite with a rate limiter retries after 429"""
+
+        limiter = RateLimiter(rate=1000)
+        badgr = self.get_limited_badgr([429, 429, 200], limiter)
+        self.assertEqual(badgr.get_from_server(self._sample_url),
+                         {'result': []})
+        self.assertEqual(badgr.session.request.call_count, 3)
+        self.assertLess(limiter.rate, 1000)
+
+    def test_429_retries_are_bounded(self):
+        """BadgrLite raises RateLimitedError after max_retries"""
+
+        limiter = RateLimiter(rate=1000, max_retries=1)
+        badgr = self.get_limited_badgr([429, 429, 200], limiter)
+        with self.assertRaises(exceptions.RateLimitedError):
+            badgr.get_from_server(self._sample_url)
+        self.assertEqual(badgr.session.request.call_count, 2)
+
+    def test_429_without_rate_limiter_raises(self):
+        """BadgrLite without a rate limiter raises RateLimitedError"""
+
+        badgr = self.get_limited_badgr([429])
+        with self.assertRaises(exceptions.RateLimitedError) as context:
+            badgr.get_from_server(self._sample_url)
+        self.assertEqual(context.exception.args, (0.0,))
+
+
+class TestRetryPolicy(BadgrLiteTestBase):
+    """Test retrying transient failures"""
+
+    AWARD_URL = 'https://api.badgr.io/v2/badgeclasses/x/assertions'
+
+    def get_retrying_badgr(self, outcomes, **policy_options):
+        """Return BadgrLite whose session gives outcomes in turn
+
+        Outcomes are status codes or exceptions to raise.
+        """
+
+        self.retries = []
+        policy_options.setdefault('backoff_base', 0)
+        policy = RetryPolicy(
+            on_retry=lambda *args: self.retries.append(args),
+            **policy_options)
+        session = unittest.mock.Mock()
+        session.request.side_effect = [
+            self.make_response(outcome, {'result': []})
+            if isinstance(outcome, int) else outcome
+            for outcome in outcomes]
+        badgr = BadgrLite(token_filename=self.sample_token_file,
+                          session=session, retry_policy=policy)
+        badgr.load_token()
+        return badgr
+
+    def test_backoff_is_jittered_and_capped(self):
+        """RetryPolicy.backoff() stays within the capped exponential"""
+
+        policy = RetryPolicy(backoff_base=1, backoff_cap=5)
+        for attempt in range(6):
+            delay = policy.backoff(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(5, 2 ** attempt))
+
+    def test_discarded_responses_are_closed(self):
+        """Answers to 401, 429 and 5xx are closed before sending again"""
+
+        responses = [self.make_response(status, {'result': []},
+                                        {'Retry-After': '0'})
+                     for status in (401, 429, 503, 200)]
+        session = self.get_refreshing_session(responses)
+        badgr = BadgrLite(token_filename=self.sample_token_file,
+                          session=session,
+                          rate_limiter=RateLimiter(rate=1000),
+                          retry_policy=RetryPolicy(backoff_base=0))
+        badgr.load_token()
+        self.assertEqual(badgr.get_from_server(self._sample_url),
+                         {'result': []})
+        self.assertEqual([response.raw.close.called for response in responses],
+                         [True, True, True, False])
+
+    def test_token_refresh_is_retried(self):
+        """A token refresh answered 503 is retried, other errors raise"""
+
+        session = self.get_refreshing_session([])
+        refreshed = session.request.side_effect
+        session.request.side_effect = [
+            self.make_response(503, {}), refreshed('POST', '/o/token'),
+            self.make_response(500, {})]
+        badgr = BadgrLite(token_filename=self.sample_token_file,
+                          session=session,
+                          retry_policy=RetryPolicy(backoff_base=0))
+        badgr.load_token()
+        badgr.refresh_token()
+        self.assertEqual(badgr.prepare_headers()['Authorization'],
+                         'Bearer new_token')
+        with self.assertRaises(exceptions.ServerError):
+            badgr.refresh_token()
+        self.assertNotIn('Authorization',
+                         session.request.call_args[1]['headers'])
+
+    def test_get_is_retried_on_5xx(self):
+        """BadgrLite retries a GET answered with 500 or 503"""
+
+        badgr = self.get_retrying_badgr([500, 503, 200])
+        self.assertEqual(badgr.get_from_server(self._sample_url),
+                         {'result': []})
+        self.assertEqual([retry[2:] for retry in self.retries],
+                         [(1, 0, 500), (2, 0, 503)])
+
+    def test_get_is_retried_on_connection_error(self):
+        """BadgrLite retries a GET failing with a connection reset"""
+
+        badgr = self.get_retrying_badgr(
+            [requests.ConnectionError('reset'), requests.ReadTimeout(), 200])
+        self.assertEqual(badgr.get_from_server(self._sample_url),
+                         {'result': []})
+        self.assertEqual(len(self.retries), 2)
+
+    def test_attempts_are_bounded(self):
+        """BadgrLite raises ServerError once max_attempts are used"""
+
+        badgr = self.get_retrying_badgr([502, 502, 200], max_attempts=2)
+        with self.assertRaises(exceptions.ServerError) as context:
+            badgr.get_from_server(self._sample_url)
+        self.assertEqual(context.exception.args[0], 502)
+
+    def test_post_is_not_retried_after_it_may_have_been_processed(self):
+        """BadgrLite does not retry a POST the server may have acted on"""
+
+        badgr = self.get_retrying_badgr([500, 201])
+        with self.assertRaises(exceptions.ServerError):
+            badgr.award_badge('x', {})
+        badgr = self.get_retrying_badgr([requests.ReadTimeout(), 201])
+        with self.assertRaises(requests.ReadTimeout):
+            badgr.award_badge('x', {})
+        self.assertEqual(self.retries, [])
+
+    def test_post_is_retried_when_not_processed(self):
+        """BadgrLite retries a POST answered 503 or never connected"""
+
+        badgr = self.get_retrying_badgr(
+            [503, requests.ConnectTimeout(), 500])
+        with self.assertRaises(exceptions.ServerError):
+            badgr.award_badge('x', {})
+        self.assertEqual([retry[:3] for retry in self.retries],
+                         [('POST', self.AWARD_URL, 1),
+                          ('POST', self.AWARD_URL, 2)])
+
+
+class TestMetricsRegistry(BadgrLiteTestBase):
+    """Test recording and exporting request metrics"""
+
+    def get_measured_badgr(self, statuses, **registry_options):
+        """Return BadgrLite with metrics whose session answers statuses"""
+
+        session = self.get_refreshing_session([
+            self.make_response(status, {'result': []})
+            for status in statuses])
+        badgr = BadgrLite(
+            token_filename=self.sample_token_file, session=session,
+            retry_policy=RetryPolicy(backoff_base=0),
+            metrics=MetricsRegistry(**registry_options))
+        badgr.load_token()
+        return badgr
+
+    def test_endpoint_of_hides_entity_ids(self):
+        """endpoint_of() gives one endpoint for all entities"""
+
+        self.assertEqual(
+            endpoint_of('https://api.badgr.io/v2/badgeclasses/2TfNNq'
+                        '/assertions?num=10'),
+            '/v2/badgeclasses/{id}/assertions')
+        self.assertEqual(endpoint_of(self._sample_url), '/v2/badgeclasses')
+        self.assertEqual(
+            endpoint_of('https://media.badgr.io/uploads/badges/a1b2.png'),
+            'other')
+
+    def test_requests_are_measured(self):
+        """BadgrLite records latency per endpoint and status class"""
+
+        badgr = self.get_measured_badgr([503, 200])
+        badgr.get_from_server(self._sample_url)
+        metrics = badgr.metrics
+        for status in ('5xx', '2xx'):
+            histogram = metrics.histogram(
+                'badgr_request_duration_seconds', method='GET',
+                endpoint='/v2/badgeclasses', status=status)
+            self.assertEqual(histogram.count, 1)
+        self.assertEqual(
+            metrics.counter('badgr_retries_total', reason='503'), 1)
+        self.assertEqual(
+            metrics.counter('badgr_request_bytes_total',
+                            direction='received'),
+            2 * len('{"result": []}'))
+
+    def test_refreshes_are_counted(self):
+        """BadgrLite counts 401 answers and token refreshes"""
+
+        badgr = self.get_measured_badgr([401, 200])
+        badgr.get_from_server(self._sample_url)
+        self.assertEqual(badgr.metrics.counter('badgr_unauthorized_total'), 1)
+        self.assertEqual(
+            badgr.metrics.counter('badgr_token_refreshes_total'), 1)
+
+    def test_render_prometheus_text(self):
+        """MetricsRegistry.render() gives Prometheus text format"""
+
+        metrics = MetricsRegistry(buckets=(0.1, 1))
+        metrics.observe('latency_seconds', 0.5, endpoint='/v2/x')
+        metrics.increment('calls_total', 2)
+        self.assertEqual(metrics.render(), '\n'.join([
+            '# TYPE calls_total counter',
+            'calls_total 2',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{endpoint="/v2/x",le="0.1"} 0',
+            'latency_seconds_bucket{endpoint="/v2/x",le="1"} 1',
+            'latency_seconds_bucket{endpoint="/v2/x",le="+Inf"} 1',
+            'latency_seconds_sum{endpoint="/v2/x"} 0.5',
+            'latency_seconds_count{endpoint="/v2/x"} 1',
+            '']))
+
+    def test_observations_are_pushed_to_callback(self):
+        """MetricsRegistry(callback=...) receives every observation"""
+
+        pushed = []
+        badgr = self.get_measured_badgr(
+            [200], callback=lambda *args: pushed.append(args))
+        badgr.get_from_server(self._sample_url)
+        self.assertIn('badgr_request_duration_seconds',
+                      [name for name, _, _ in pushed])
+
+
+class TestFakeBadgrServer(BadgrLiteTestBase):
+    """Test BadgrLite end to end against the local fake server"""
+
+    def get_served_badgr(self, **server_options) -> BadgrLite:
+        """Return BadgrLite talking to a started FakeBadgrServer"""
+
+        self.server = FakeBadgrServer(seed=1, **server_options).start()
+        self.addCleanup(self.server.stop)
+        self.server.write_token_file(self.sample_token_file)
+        badgr = BadgrLite(
+            token_filename=self.sample_token_file,
+            base_url=self.server.base_url,
+            retry_policy=RetryPolicy(max_attempts=10, backoff_base=0.001),
+            rate_limiter=RateLimiter(rate=1000, max_retries=10))
+        self.addCleanup(badgr.close)
+        return badgr
+
+    def test_lists_badges_over_pages(self):
+        """BadgrLite follows the fake server's pagination"""
+
+        badgr = self.get_served_badgr(badge_count=25, page_size=10)
+        self.assertEqual(len(badgr.badges), 25)
+        self.assertEqual(self.server.stats, {200: 3})
+
+    def test_awards_and_lists_assertions(self):
+        """BadgrLite awards on the fake server and lists the assertion"""
+
+        badgr = self.get_served_badgr(badge_count=1, assertion_count=0)
+        badge_id = badgr.badges[0].entity_id
+        awarded = badgr.award_badge(
+            badge_id, {'recipient': {'identity': 'a@example.com'}})
+        self.assertEqual(
+            [badge.entity_id for badge in badgr.iter_assertions(badge_id)],
+            [awarded.entity_id])
+
+    def test_bad_award_data(self):
+        """Fake server answers 400 and 404 like the Badgr server"""
+
+        badgr = self.get_served_badgr(badge_count=1)
+        with self.assertRaises(exceptions.BadBadgeIdError):
+            badgr.award_badge('unknown', {'recipient': {'identity': 'a@b'}})
+        with self.assertRaises(exceptions.AwardBadgeBadDataError):
+            badgr.award_badge(badgr.badges[0].entity_id, {})
+
+    def test_expired_token_is_refreshed(self):
+        """BadgrLite refreshes the token once the fake server expires it"""
+
+        badgr = self.get_served_badgr()
+        badgr.load_token()
+        old_token = badgr.prepare_headers()['Authorization']
+        self.server.expire_tokens()
+        self.assertTrue(badgr.badges)
+        self.assertNotEqual(badgr.prepare_headers()['Authorization'],
+                            old_token)
+        self.assertEqual(self.server.stats[401], 1)
+
+    def test_concurrent_awards_refresh_token_once(self):
+        """award_badges() threads hitting 401 together refresh only once"""
+
+        badgr = self.get_served_badgr(badge_count=1, latency=0.05)
+        badge_id = badgr.badges[0].entity_id
+        self.server.expire_tokens()
+        self.server.stats.clear()
+        awards = [(badge_id, {'recipient': {'identity': 'user{}@b.c'.format(
+            number)}}) for number in range(8)]
+
+        results = [result for _, _, result in badgr.award_badges(
+            awards, max_workers=8)]
+
+        self.assertTrue(all(isinstance(result, Badge) for result in results))
+        self.assertEqual(self.server.stats[401], 8)
+        # Token refreshes are the only 200 answers
+        self.assertEqual(self.server.stats[200], 1)
+
+    def test_injected_failures_are_retried(self):
+        """BadgrLite rides out injected 500 and 429 answers"""
+
+        badgr = self.get_served_badgr(error_rate=0.2, throttle_rate=0.2,
+                                      retry_after=0)
+        for _ in range(10):
+            self.assertTrue(badgr.badges)
+        self.assertGreater(self.server.stats.get(500, 0) +
+                           self.server.stats.get(429, 0), 0)
+
+
+class TestBadgrLiteFetchImages(BadgrLiteTestBase):
+    """BadgrLite.fetch_images() related tests"""
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeBadgrServer(badge_count=5,
+                                      assertion_count=0).start()
+        self.addCleanup(self.server.stop)
+        self.server.write_token_file(self.sample_token_file)
+        self.badgr = BadgrLite(token_filename=self.sample_token_file,
+                               base_url=self.server.base_url)
+        self.addCleanup(self.badgr.close)
+        self.badges = self.badgr.badges
+        self.dest = os.path.join(self._tempdir, 'images')
+
+    def fetch(self, badges=None) -> dict:
+        """Fetch images of badges (all by default), return path by ID"""
+
+        self.server.stats.clear()
+        return {badge.entity_id: outcome
+                for badge, outcome in self.badgr.fetch_images(
+                    self.badges if badges is None else badges, self.dest,
+                    max_workers=3)}
+
+    def test_stores_images_by_content(self):
+        """Images are streamed to files named by their SHA-256"""
+
+        paths = self.fetch()
+        self.assertEqual(self.server.stats, {200: 5})
+        for entity_id, path in paths.items():
+            with open(path, 'rb') as image_h:
+                content = image_h.read()
+            self.assertEqual(content, fake_image(entity_id))
+            self.assertEqual(os.path.basename(path), '{}.png'.format(
+                hashlib.sha256(content).hexdigest()))
+
+    def test_unchanged_images_are_revalidated(self):
+        """Images fetched before are revalidated, not downloaded again"""
+
+        first = self.fetch()
+        os.remove(first[self.badges[0].entity_id])
+
+        self.assertEqual(self.fetch(), first)
+        self.assertEqual(self.server.stats, {304: 4, 200: 1})
+
+    def test_images_are_fetched_without_token(self):
+        """The token is only sent to the API, not to the media host"""
+
+        self.badgr.session.request = unittest.mock.Mock(
+            wraps=self.badgr.session.request)
+        self.fetch()
+        for call in self.badgr.session.request.call_args_list:
+            self.assertNotIn('Authorization', call[1]['headers'])
+
+    def test_images_are_measured_as_one_endpoint(self):
+        """Image requests share one endpoint label, whatever their URL"""
+
+        self.badgr.metrics = MetricsRegistry()
+        self.fetch()
+        histogram = self.badgr.metrics.histogram(
+            'badgr_request_duration_seconds', method='GET',
+            endpoint='image', status='2xx')
+        self.assertEqual(histogram.count, 5)
+        self.assertNotIn('/media/', self.badgr.metrics.render())
+
+    def test_unconditional_not_modified_is_an_error(self):
+        """A 304 answer to an unconditional GET is retried once, then fails"""
+
+        response = unittest.mock.Mock(status_code=304)
+        self.badgr.session.request = unittest.mock.Mock(
+            return_value=response)
+        outcome = self.fetch(self.badges[:1])[self.badges[0].entity_id]
+        self.assertIsInstance(outcome, exceptions.ServerError)
+        self.assertEqual(self.badgr.session.request.call_count, 2)
+        self.assertEqual(response.close.call_count, 2)
+
+    def test_badges_without_image(self):
+        """Badges without image give None"""
+
+        raw = dict(self.badges[0]._raw, image=None)  # pylint: disable=W0212
+        self.assertEqual(self.fetch([Badge(raw)]),
+                         {raw['entityId']: None})
+
+
+class TestBadgrLiteRevokeAssertions(BadgrLiteTestBase):
+    """BadgrLite.revoke_assertion(s)() related tests"""
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeBadgrServer(badge_count=1,
+                                      assertion_count=5).start()
+        self.addCleanup(self.server.stop)
+        self.server.write_token_file(self.sample_token_file)
+        self.badgr = BadgrLite(token_filename=self.sample_token_file,
+                               base_url=self.server.base_url)
+        self.addCleanup(self.badgr.close)
+        self.badge_id = self.badgr.badges[0].entity_id
+
+    def revoked(self) -> dict:
+        """Return revocation reason by assertion ID (None: not revoked)"""
+
+        return {assertion.entity_id: assertion.revocation_reason
+                for assertion in self.badgr.iter_assertions(self.badge_id)}
+
+    def test_revoke_assertion(self):
+        """.revoke_assertion() revokes one assertion with its reason"""
+
+        entity_id = next(iter(self.revoked()))
+        self.badgr.revoke_assertion(entity_id, 'Awarded by mistake')
+        revoked = self.revoked()
+        self.assertEqual(revoked.pop(entity_id), 'Awarded by mistake')
+        self.assertEqual(set(revoked.values()), {None})
+
+    def test_revoke_errors(self):
+        """Unknown and already revoked assertions raise exceptions"""
+
+        entity_id = next(iter(self.revoked()))
+        self.badgr.revoke_assertion(entity_id, 'Mistake')
+        with self.assertRaises(exceptions.RevokeAssertionBadDataError):
+            self.badgr.revoke_assertion(entity_id, 'Mistake')
+        with self.assertRaises(exceptions.BadAssertionIdError):
+            self.badgr.revoke_assertion('unknown', 'Mistake')
+
+    def test_revoke_refreshes_expired_token(self):
+        """.revoke_assertion() refreshes an expired token, then revokes"""
+
+        entity_id = next(iter(self.revoked()))
+        self.server.expire_tokens()
+        self.badgr.revoke_assertion(entity_id, 'Mistake')
+        self.assertEqual(self.revoked()[entity_id], 'Mistake')
+
+    def test_revoke_assertions_yields_each_outcome(self):
+        """.revoke_assertions() revokes concurrently, per-item outcomes"""
+
+        entity_ids = list(self.revoked())
+        outcomes = {entity_id: outcome
+                    for entity_id, _, outcome in self.badgr.revoke_assertions(
+                        ((entity_id, 'Bad run')
+                         for entity_id in entity_ids + ['unknown']),
+                        max_workers=3)}
+
+        self.assertIsInstance(outcomes.pop('unknown'),
+                              exceptions.BadAssertionIdError)
+        self.assertEqual(outcomes, dict.fromkeys(entity_ids))
+        self.assertEqual(set(self.revoked().values()), {'Bad run'})
+
+    def test_revoked_award_is_forgotten_by_index(self):
+        """The award index forgets revoked awards"""
+
+        self.badgr.award_index = AwardIndex.beside(self.sample_token_file)
+        self.addCleanup(self.badgr.award_index.close)
+        badge_data = {'recipient': {'identity': 'new@example.com'}}
+        assertion = self.badgr.award_badge(self.badge_id, badge_data)
+
+        self.badgr.revoke_assertion(assertion.entity_id, 'Mistake')
+        self.assertIsNone(self.badgr.award_index.get(self.badge_id,
+                                                     'new@example.com'))
+        self.assertNotEqual(
+            self.badgr.award_badge(self.badge_id, badge_data).entity_id,
+            assertion.entity_id)
+
+
+class TestAccountPool(BadgrLiteTestBase):
+    """AccountPool routes calls to the account owning a badge"""
+
+    def setUp(self):
+        super().setUp()
+        self.servers = {}
+        token_files = {}
+        for name, latency in (('acme', 0.1), ('globex', 0.0)):
+            server = FakeBadgrServer(badge_count=2, assertion_count=0,
+                                     latency=latency,
+                                     issuer_id=name).start()
+            self.addCleanup(server.stop)
+            token_files[name] = os.path.join(self._tempdir, name + '.json')
+            server.write_token_file(token_files[name])
+            self.servers[name] = server
+        self.pool = AccountPool({
+            name: BadgrLite(token_filename=token_file,
+                            base_url=self.servers[name].base_url)
+            for name, token_file in token_files.items()})
+        self.addCleanup(self.pool.close)
+
+    def badge_ids_of(self, name: str) -> list:
+        """Return IDs of the badge classes of account name"""
+
+        return [badge.entity_id for badge in self.pool.badges(
+            issuer_id=name)]
+
+    def test_badges_of_all_accounts(self):
+        """.badges() lists every account, or the account of an issuer"""
+
+        self.assertEqual(len(self.pool.badges()), 4)
+        self.assertEqual(
+            {badge.issuer for badge in self.pool.badges('globex')},
+            {'globex'})
+
+    def test_failing_account_is_unavailable(self):
+        """An account failing to list badges does not stop the others"""
+
+        os.remove(self.pool.clients['acme'].token_filename)
+        self.assertEqual({badge.issuer for badge in self.pool.badges()},
+                         {'globex'})
+        self.assertIsInstance(self.pool.unavailable['acme'],
+                              exceptions.TokenFileNotFoundError)
+        badge_id = self.badge_ids_of('globex')[0]
+        result = self.pool.award_badge(
+            badge_id, {'recipient': {'identity': 'a@example.com'}})
+        self.assertEqual(result.badgeclass, badge_id)
+
+        self.servers['acme'].write_token_file(
+            self.pool.clients['acme'].token_filename)
+        self.assertEqual(len(self.pool.badges()), 4)
+        self.assertEqual(self.pool.unavailable, {})
+
+    def test_award_badges_of_failing_account_give_its_error(self):
+        """Awards of an account without token fail, the others go on"""
+
+        acme, globex = self.badge_ids_of('acme'), self.badge_ids_of('globex')
+        awards = [(badge_id, {'recipient': {'identity': 'a@b'}})
+                  for badge_id in acme + globex]
+        error = exceptions.TokenFileNotFoundError('gone')
+        with unittest.mock.patch.object(self.pool.clients['acme'],
+                                        'load_token', side_effect=error):
+            results = {badge_id: result for badge_id, _, result
+                       in self.pool.award_badges(awards)}
+
+        self.assertEqual([results[badge_id] for badge_id in acme],
+                         [error] * len(acme))
+        self.assertTrue(all(isinstance(results[badge_id], Badge)
+                            for badge_id in globex))
+        self.assertIs(self.pool.unavailable['acme'], error)
+
+    def test_award_badge_is_routed_to_owner(self):
+        """.award_badge() awards with the account owning the badge"""
+
+        badge_id = self.badge_ids_of('globex')[0]
+        self.servers['globex'].stats.clear()
+        result = self.pool.award_badge(
+            badge_id, {'recipient': {'identity': 'a@example.com'}})
+
+        self.assertEqual(result.badgeclass, badge_id)
+        self.assertEqual(self.servers['globex'].stats, {201: 1})
+        with self.assertRaises(exceptions.BadBadgeIdError):
+            self.pool.award_badge('unknown', {})
+
+    def test_award_badges_runs_accounts_in_parallel(self):
+        """A slow account does not hold back awards of the others"""
+
+        slow, fast = self.badge_ids_of('acme'), self.badge_ids_of('globex')
+        awards = [(badge_id, {'recipient': {'identity': '{}@b'.format(n)}})
+                  for n in range(4) for badge_id in slow + fast]
+        results = list(self.pool.award_badges(
+            awards + [('unknown', {})], max_workers=2))
+
+        self.assertEqual(len(results), len(awards) + 1)
+        order = [badge_id in fast for badge_id, _, _ in results
+                 if badge_id != 'unknown']
+        self.assertEqual(order, [True] * 8 + [False] * 8)
+        self.assertEqual(
+            sum(isinstance(result, Badge) for _, _, result in results),
+            len(awards))
+
+
+class TestBadgrLiteStreamListings(BadgrLiteTestBase):
+    """BadgrLite(stream_listings=True) decodes listings as they arrive"""
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeBadgrServer(badge_count=25, assertion_count=12,
+                                      page_size=10, compress=True).start()
+        self.addCleanup(self.server.stop)
+        self.server.write_token_file(self.sample_token_file)
+
+    def get_badgr(self, **options) -> BadgrLite:
+        """Return BadgrLite talking to the started, gzipping fake server"""
+
+        badgr = BadgrLite(token_filename=self.sample_token_file,
+                          base_url=self.server.base_url,
+                          metrics=MetricsRegistry(), **options)
+        self.addCleanup(badgr.close)
+        return badgr
+
+    def test_streams_badges_over_pages(self):
+        """Streamed badges are those listed, decoded as pages arrive"""
+
+        listed = self.get_badgr()
+        streamed = self.get_badgr(stream_listings=True)
+        responses = []
+        request = streamed.session.request
+
+        def keep_response(*args, **kwargs):
+            responses.append(request(*args, **kwargs))
+            return responses[-1]
+
+        streamed.session.request = keep_response
+        with unittest.mock.patch('badgr_lite.models.STREAM_CHUNK_SIZE', 64):
+            badges = streamed.iter_badges()
+            first = next(badges)
+            # Decoded from the start of the page, the rest is still unread
+            self.assertLess(responses[0].raw.tell(),
+                            int(responses[0].headers['Content-Length']))
+            badges = [first] + list(badges)
+
+        self.assertTrue(all(isinstance(badge, Badge) for badge in badges))
+        self.assertEqual([badge.entity_id for badge in badges],
+                         [badge.entity_id for badge in listed.badges])
+        self.assertEqual(self.server.stats, {200: 6})
+        # Both count the gzipped bytes read off the wire
+        self.assertEqual(
+            streamed.metrics.counter('badgr_request_bytes_total',
+                                     direction='received'),
+            listed.metrics.counter('badgr_request_bytes_total',
+                                   direction='received'))
+        self.assertEqual(
+            listed.metrics.counter('badgr_request_bytes_total',
+                                   direction='received'),
+            sum(int(response.headers['Content-Length'])
+                for response in responses))
+
+    def test_streams_assertions(self):
+        """Assertions of a badge class are streamed page by page"""
+
+        badge_id = self.get_badgr().badges[0].entity_id
+        streamed = self.get_badgr(stream_listings=True)
+        self.assertEqual(
+            len(list(streamed.iter_assertions(badge_id=badge_id))), 12)
+
+    def test_unread_records_are_dropped(self):
+        """Moving on to the next page drops the rest of the current one"""
+
+        badgr = self.get_badgr(stream_listings=True)
+        badgr.load_token()
+        firsts = [next(iter(page)) for page in badgr.iter_pages(
+            '{}/badgeclasses'.format(badgr.api_url))]
+        self.assertEqual([raw['name'] for raw in firsts],
+                         ['Fake badge 0', 'Fake badge 10', 'Fake badge 20'])
+
+    def test_cached_listings_are_not_streamed(self):
+        """Listings going through the response cache are read whole"""
+
+        badgr = self.get_badgr(stream_listings=True, cache=ResponseCache(
+            os.path.join(self._tempdir, 'cache')))
+        with unittest.mock.patch.object(badgr, '_stream_page') as stream:
+            self.assertEqual(len(badgr.badges), 25)
+        stream.assert_not_called()
+
+    def test_server_error(self):
+        """A streamed listing answered with an error raises ServerError"""
+
+        badgr = self.get_badgr(stream_listings=True)
+        badgr.load_token()
+        with self.assertRaises(exceptions.ServerError):
+            list(badgr.iter_pages('{}/unknown'.format(badgr.api_url)))
+
+
+class TestBadgrDaemon(BadgrLiteTestBase):
+    """Test the `badgr serve` daemon and its client"""
+
+    def get_client(self, socket_name='badgr.sock', **service_options):
+        """Return BadgrClient of a daemon backed by a FakeBadgrServer
+
+        Without socket_name, the daemon listens on a localhost port and
+        the client sends its secret.
+        """
+
+        self.fake = FakeBadgrServer(badge_count=3, assertion_count=0).start()
+        self.addCleanup(self.fake.stop)
+        self.fake.write_token_file(self.sample_token_file)
+        badgr = BadgrLite(token_filename=self.sample_token_file,
+                          base_url=self.fake.base_url)
+        self.service = BadgrService(badgr, **service_options)
+        if socket_name:
+            socket_path = os.path.join(self._tempdir, socket_name)
+            daemon = make_server(self.service, socket_path)
+            address = 'unix:{}'.format(socket_path)
+        else:
+            daemon = make_server(self.service, port=0, secret='s3cret')
+            address = 'http://127.0.0.1:{}'.format(daemon.server_address[1])
+        self.address = address
+        thread = threading.Thread(target=daemon.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.start()
+
+        def stop():
+            daemon.shutdown()
+            thread.join()
+            daemon.server_close()
+            self.service.close()
+        self.addCleanup(stop)
+
+        client = BadgrClient(address,
+                             secret=None if socket_name else 's3cret')
+        self.addCleanup(client.close)
+        return client
+
+    def post_raw(self, body, headers):
+        """POST body to the daemon's /awards over TCP, return response"""
+
+        port = int(self.address.rsplit(':', 1)[1])
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        self.addCleanup(connection.close)
+        connection.request('POST', '/awards', body=body, headers=headers)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def test_health_over_unix_socket_and_http(self):
+        """BadgrClient reaches the daemon on a Unix socket or localhost"""
+
+        self.assertTrue(self.get_client().health())
+        self.assertTrue(self.get_client(socket_name=None).health())
+
+    def test_unix_socket_is_private(self):
+        """Only the current user can connect to the Unix socket"""
+
+        self.get_client().health()
+        mode = os.stat(os.path.join(self._tempdir, 'badgr.sock')).st_mode
+        self.assertEqual(mode & 0o777, 0o600)
+
+    def test_socket_path_is_only_replaced_when_stale(self):
+        """Daemon replaces a dead socket, not a file or a live daemon"""
+
+        self.get_client().health()
+        socket_path = os.path.join(self._tempdir, 'badgr.sock')
+        with self.assertRaises(OSError) as context:
+            make_server(self.service, socket_path)
+        self.assertEqual(context.exception.errno, errno.EADDRINUSE)
+        with self.assertRaises(FileExistsError):
+            make_server(self.service, self.sample_token_file)
+        self.assertTrue(os.path.exists(self.sample_token_file))
+
+        stale_path = os.path.join(self._tempdir, 'stale.sock')
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+            stale.bind(stale_path)
+        make_server(self.service, stale_path).server_close()
+
+    def test_tcp_requires_secret(self):
+        """Daemon only listens on TCP with a secret, and checks it"""
+
+        self.get_client(socket_name=None)
+        with self.assertRaises(ValueError):
+            make_server(self.service, port=0)
+        client = BadgrClient(self.address, secret='wrong')
+        self.addCleanup(client.close)
+        with self.assertRaisesRegex(exceptions.ServerError, 'Forbidden'):
+            client.health()
+
+    def test_refuses_unexpected_host(self):
+        """Requests naming another Host (DNS rebinding) are refused"""
+
+        self.get_client(socket_name=None)
+        status, answer = self.post_raw('{}', {
+            'Host': 'attacker.example:8765', 'X-Badgr-Secret': 's3cret',
+            'Content-Type': 'application/json'})
+        self.assertEqual((status, answer['error']), (403, 'Forbidden'))
+
+    def test_refuses_other_content_types(self):
+        """Awards must be posted as application/json"""
+
+        self.get_client(socket_name=None)
+        status, answer = self.post_raw('badge_id=x', {
+            'X-Badgr-Secret': 's3cret',
+            'Content-Type': 'application/x-www-form-urlencoded'})
+        self.assertEqual((status, answer['error']),
+                         (415, 'UnsupportedMediaType'))
+        self.assertEqual(self.fake.stats, {})
+
+    def test_secret_file_is_created_once(self):
+        """read_secret creates a private secret file, then reuses it"""
+
+        filename = os.path.join(self._tempdir, 'badgr-serve.secret')
+        secret = read_secret(filename)
+        self.assertGreaterEqual(len(secret), 32)
+        self.assertEqual(os.stat(filename).st_mode & 0o777, 0o600)
+        self.assertEqual(read_secret(filename), secret)
+
+    def test_badge_catalog_is_kept_warm(self):
+        """Daemon serves badges from memory until refreshed"""
+
+        client = self.get_client()
+        self.assertEqual(len(client.badges()), 3)
+        self.assertEqual(len(client.badges()), 3)
+        self.assertEqual(self.fake.stats, {200: 1})
+        client.badges(refresh=True)
+        self.assertEqual(self.fake.stats, {200: 2})
+
+    def test_award_badge(self):
+        """BadgrClient awards through the daemon"""
+
+        client = self.get_client()
+        badge_id = client.badges()[0].entity_id
+        result = client.award_badge(
+            badge_id, {'recipient': {'identity': 'a@example.com'}})
+        self.assertEqual(result.badgeclass, badge_id)
+
+    def test_errors_are_reraised(self):
+        """BadgrClient raises the exception raised in the daemon"""
+
+        client = self.get_client()
+        with self.assertRaises(exceptions.BadBadgeIdError):
+            client.award_badge('unknown', {'recipient': {'identity': 'a@b'}})
+
+    def test_concurrent_awards_are_batched(self):
+        """Daemon awards concurrent requests in one batch"""
+
+        client = self.get_client(batch_window=0.2)
+        badge_id = client.badges()[0].entity_id
+        results = client.award_badges(
+            [(badge_id, {'recipient': {'identity': 'user{}@b'.format(n)}})
+             for n in range(10)] + [('unknown', {})])
+        self.assertEqual([type(result) for result in results],
+                         [Badge] * 10 + [exceptions.BadBadgeIdError])
+        self.assertEqual(self.service.batcher.batches, 1)
+
+    def test_awards_beyond_batch_size_are_awarded(self):
+        """Every award resolves, however many batches they fill"""
+
+        badgr = unittest.mock.Mock(award_badge=lambda badge_id, _: badge_id)
+        batcher = AwardBatcher(badgr, batch_size=4, batch_window=0.5)
+        self.addCleanup(batcher.close)
+        futures = [batcher.submit(str(n), {}) for n in range(10)]
+        self.assertEqual([future.result(timeout=2) for future in futures],
+                         [str(n) for n in range(10)])
+        self.assertEqual(batcher.batches, 3)
+
+    def test_slow_award_does_not_hold_next_batch(self):
+        """Awards of a later batch finish while an earlier one is slow"""
+
+        release = threading.Event()
+
+        def award_badge(badge_id, badge_data):
+            if badge_id == 'slow':
+                release.wait(5)
+            return badge_id
+
+        badgr = unittest.mock.Mock(award_badge=award_badge)
+        batcher = AwardBatcher(badgr, max_workers=2, batch_window=0)
+        self.addCleanup(batcher.close)
+        self.addCleanup(release.set)
+        slow = batcher.submit('slow', {})
+        time.sleep(0.05)
+        self.assertEqual(batcher.submit('fast', {}).result(timeout=2),
+                         'fast')
+        self.assertFalse(slow.done())
+        self.assertEqual(batcher.batches, 2)
+
+
 class TestBadgrLiteAwardMethod(BadgrLiteTestBase):
     """Test BadgrLite.award Method"""
 
@@ -388,6 +1921,611 @@ class TestBadgrLiteAwardMethod(BadgrLiteTestBase):
                     {'bad_badge_data': 1}
                 )
 
+    def test_award_badges_gives_result_per_item(self):
+        """.award_badges() yields a Badge for each awarded item"""
+
+        badgr = BadgrLite(
+            token_filename=self.sample_token_file,
+            session=self.get_fake_session(
+                'tests/vcr_cassettes/award_badge.yaml'))
+        awards = [(self.get_sample_award_badge_id(),
+                   self.get_sample_award_badge_data())] * 5
+
+        results = list(badgr.award_badges(awards, max_workers=3))
+        self.assertEqual(len(results), 5)
+        for badge_id, _, result in results:
+            self.assertEqual(badge_id, self.get_sample_award_badge_id())
+            self.assertIsInstance(result, Badge)
+
+    def test_award_badges_gives_exception_per_failed_item(self):
+        """.award_badges() yields the exception for a failed item"""
+
+        badgr = BadgrLite(
+            token_filename=self.sample_token_file,
+            session=self.get_fake_session(
+                'tests/vcr_cassettes/award_bad_badge_id.yaml'))
+        awards = [('bad_badge_id', self.get_sample_award_badge_data())]
+
+        (_, _, result), = badgr.award_badges(awards)
+        self.assertIsInstance(result, exceptions.BadBadgeIdError)
+
+
+class TestAwardIndex(BadgrLiteTestBase):
+    """BadgrLite award dedup index tests"""
+
+    def setUp(self):
+        super().setUp()
+        self.index = AwardIndex.beside(self.sample_token_file)
+        with open('tests/vcr_cassettes/award_badge.yaml') as cassette_h:
+            self.assertion = json.loads(yaml.safe_load(cassette_h)[
+                'interactions'][0]['response']['body']['string'])[
+                    'result'][0]
+
+    def tearDown(self):
+        self.index.close()
+        super().tearDown()
+
+    def get_indexed_badgr(self) -> BadgrLite:
+        """Return BadgrLite with award index and fake award session"""
+
+        return BadgrLite(
+            token_filename=self.sample_token_file,
+            session=self.get_fake_session(
+                'tests/vcr_cassettes/award_badge.yaml'),
+            award_index=self.index)
+
+    def test_index_lives_beside_token_file(self):
+        """AwardIndex.beside() keeps index in token file's directory"""
+
+        self.assertEqual(os.path.dirname(self.index.filename),
+                         self._tempdir)
+
+    def test_award_badge_skips_known_award(self):
+        """.award_badge() does not award a recorded award again"""
+
+        badgr = self.get_indexed_badgr()
+        first = badgr.award_badge(
+            '2TfNNqMLT8CoAhfGKqSv6Q',
+            {"recipient": {"identity": "joe@example.com"}})
+        second = badgr.award_badge(
+            '2TfNNqMLT8CoAhfGKqSv6Q',
+            {"recipient": {"identity": " Joe@Example.com "}})
+
+        self.assertEqual(badgr.session.request.call_count, 1)
+        self.assertEqual(first.entity_id, second.entity_id)
+        self.assertIsInstance(second, Badge)
+
+    def test_award_badge_awards_other_recipients(self):
+        """.award_badge() awards recipients missing from the index"""
+
+        badgr = self.get_indexed_badgr()
+        for recipient in ['a@example.com', 'b@example.com']:
+            badgr.award_badge('2TfNNqMLT8CoAhfGKqSv6Q',
+                              {"recipient": {"identity": recipient}})
+        self.assertEqual(badgr.session.request.call_count, 2)
+        self.assertEqual(len(self.index), 2)
+
+    def test_rebuild_from_server(self):
+        """AwardIndex.rebuild() indexes current assertions from server"""
+
+        revoked = dict(self.assertion, revoked=True, badgeclass='other')
+        badgr = unittest.mock.Mock()
+        badgr.iter_assertions.return_value = [Badge(self.assertion),
+                                              Badge(revoked)]
+        self.index.record('stale', 'someone@example.com', {})
+
+        self.assertEqual(self.index.rebuild(badgr), 1)
+        self.assertIsNone(self.index.get('stale', 'someone@example.com'))
+        self.assertEqual(
+            self.index.get('2TfNNqMLT8CoAhfGKqSv6Q',
+                           'joe@example.com')['entityId'],
+            self.assertion['entityId'])
+
+    def test_rebuild_counts_duplicate_awards_once(self):
+        """AwardIndex.rebuild() returns the number of distinct awards"""
+
+        again = dict(self.assertion, entityId='again')
+        badgr = unittest.mock.Mock()
+        badgr.iter_assertions.return_value = [Badge(self.assertion),
+                                              Badge(again)]
+
+        self.assertEqual(self.index.rebuild(badgr), 1)
+        self.assertEqual(len(self.index), 1)
+        self.assertEqual(
+            self.index.get('2TfNNqMLT8CoAhfGKqSv6Q',
+                           'joe@example.com')['entityId'], 'again')
+
+    def test_forget_looks_up_assertion_id(self):
+        """AwardIndex.forget() deletes by the indexed assertion ID"""
+
+        self.index.record('2TfNNqMLT8CoAhfGKqSv6Q', 'joe@example.com',
+                          self.assertion)
+        self.index.forget(self.assertion['entityId'])
+        self.assertEqual(len(self.index), 0)
+        # Test the query plan; pylint: disable=W0212
+        plan = self.index._connection.execute(
+            'EXPLAIN QUERY PLAN DELETE FROM awards WHERE entity_id = ?',
+            ('id',)).fetchall()
+        self.assertIn('awards_entity_id', str(plan))
+
+    def test_index_without_assertion_ids_is_upgraded(self):
+        """AwardIndex() adds assertion IDs to an index written before"""
+
+        filename = os.path.join(self._tempdir, 'old.sqlite3')
+        with sqlite3.connect(filename) as connection:
+            connection.execute(
+                'CREATE TABLE awards (badge_id TEXT NOT NULL,'
+                ' recipient TEXT NOT NULL, assertion TEXT NOT NULL,'
+                ' PRIMARY KEY (badge_id, recipient)) WITHOUT ROWID')
+            connection.execute('INSERT INTO awards VALUES (?, ?, ?)', (
+                'badge', 'joe@example.com', json.dumps(self.assertion)))
+        connection.close()
+
+        index = AwardIndex(filename)
+        self.addCleanup(index.close)
+        index.forget(self.assertion['entityId'])
+        self.assertEqual(len(index), 0)
+
+    def test_failed_rebuild_keeps_index(self):
+        """AwardIndex.rebuild() leaves the index as it was on failure"""
+
+        def assertions():
+            yield Badge(self.assertion)
+            raise exceptions.ServerError(500, 'url')
+
+        badgr = unittest.mock.Mock()
+        badgr.iter_assertions.return_value = assertions()
+        self.index.record('kept', 'someone@example.com', {})
+
+        with self.assertRaises(exceptions.ServerError):
+            self.index.rebuild(badgr)
+        self.assertEqual(len(self.index), 1)
+        self.assertEqual(self.index.get('kept', 'someone@example.com'), {})
+
+
+class TestAwardQueue(BadgrLiteTestBase):
+    """Durable award queue and its workers"""
+
+    def setUp(self):
+        super().setUp()
+        self.queue = AwardQueue.beside(self.sample_token_file)
+        with open('tests/vcr_cassettes/award_badge.yaml') as cassette_h:
+            self.assertion = json.loads(yaml.safe_load(cassette_h)[
+                'interactions'][0]['response']['body']['string'])[
+                    'result'][0]
+
+    def tearDown(self):
+        self.queue.close()
+        super().tearDown()
+
+    def enqueue_recipients(self, *recipients):
+        """Queue awards of one badge to recipients, return job ids"""
+
+        return self.queue.enqueue_many(
+            ('2TfNNqMLT8CoAhfGKqSv6Q', {'recipient': {'identity': recipient}})
+            for recipient in recipients)
+
+    def test_commit_error_is_raised_to_later_callers(self):
+        """After a failed commit, enqueue and close raise its error"""
+
+        connection = self.queue._connection  # pylint: disable=W0212
+        self.queue._connection = unittest.mock.Mock(  # pylint: disable=W0212
+            wraps=connection)
+        self.queue._connection.executemany.side_effect = \
+            sqlite3.OperationalError('disk I/O error')
+        self.queue.enqueue('2TfNNqMLT8CoAhfGKqSv6Q', {}, wait=False)
+        with self.assertRaises(sqlite3.OperationalError):
+            self.queue.flush()
+        with self.assertRaises(sqlite3.OperationalError):
+            self.queue.enqueue('2TfNNqMLT8CoAhfGKqSv6Q', {}, wait=False)
+        with self.assertRaises(sqlite3.OperationalError):
+            self.queue.close()
+        self.queue = AwardQueue.beside(self.sample_token_file)
+
+    def test_enqueue_is_durable(self):
+        """Enqueued jobs are committed to the database"""
+
+        self.enqueue_recipients('a@example.com')
+        self.queue.enqueue('2TfNNqMLT8CoAhfGKqSv6Q', {}, wait=False)
+        self.queue.close()
+
+        self.queue = AwardQueue.beside(self.sample_token_file)
+        self.assertEqual(self.queue.status()['pending'], 2)
+
+    def test_concurrent_enqueues_are_group_committed(self):
+        """Enqueues from many threads all end up in the queue"""
+
+        threads = [threading.Thread(target=self.enqueue_recipients,
+                                    args=['user{}@example.com'.format(n)
+                                          for n in range(50)])
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.queue.status()['pending'], 400)
+
+    def test_lease_hides_jobs_until_it_expires(self):
+        """Leased jobs are leased again only once their lease expired"""
+
+        job_ids = self.enqueue_recipients('a@b', 'c@d')
+        self.assertEqual([job.job_id for job in self.queue.lease(1)],
+                         job_ids[:1])
+        expired = self.queue.lease(5, visibility_timeout=0)
+        self.assertEqual([job.job_id for job in expired], job_ids[1:])
+        time.sleep(0.01)
+
+        taken_over = self.queue.lease(5)
+        self.assertEqual([job.job_id for job in taken_over], job_ids[1:])
+        self.assertEqual(taken_over[0].attempts, 2)
+
+        # The first lessee may no longer give the job back
+        self.queue.retry(expired[0], 0, ValueError())
+        self.assertEqual(self.queue.status()['leased'], 2)
+
+    def get_worker(self, side_effect) -> QueueWorker:
+        """Return worker awarding with a fake BadgrLite"""
+
+        badgr = unittest.mock.Mock()
+        badgr.award_badge.side_effect = side_effect
+        return QueueWorker(self.queue, badgr, concurrency=4,
+                           retry_policy=RetryPolicy(max_attempts=2,
+                                                    backoff_base=0),
+                           poll_interval=0.01)
+
+    def test_worker_drains_queue(self):
+        """QueueWorker awards every job and records the assertions"""
+
+        self.enqueue_recipients(*('user{}@example.com'.format(n)
+                                  for n in range(20)))
+        worker = self.get_worker(lambda *_: Badge(self.assertion))
+
+        self.assertEqual(worker.run(drain=True),
+                         {'done': 20, 'retried': 0, 'failed': 0})
+        self.assertEqual(self.queue.status()['done'], 20)
+        self.assertEqual(self.queue.jobs('done', limit=1)[0]['result'],
+                         self.assertion)
+
+    def test_worker_retries_transient_failures(self):
+        """Transient failures are retried, permanent ones are not"""
+
+        self.enqueue_recipients('flaky@example.com', 'bad@example.com',
+                                'down@example.com')
+        unavailable = exceptions.ServerError(503, 'x')
+        failures = {'flaky@example.com': [exceptions.ServerError(500, 'x')],
+                    'bad@example.com': [exceptions.BadBadgeIdError()] * 2,
+                    'down@example.com': [unavailable, unavailable]}
+
+        def award_badge(_, badge_data):
+            pending = failures[badge_data['recipient']['identity']]
+            if pending:
+                raise pending.pop()
+            return Badge(self.assertion)
+
+        worker = self.get_worker(award_badge)
+        self.assertEqual(worker.run(drain=True),
+                         {'done': 1, 'retried': 2, 'failed': 2})
+        failed = {job['badge_data']['recipient']['identity']: job
+                  for job in self.queue.jobs('failed')}
+        self.assertEqual(failed['bad@example.com']['attempts'], 1)
+        self.assertEqual(failed['down@example.com']['attempts'], 2)
+        self.assertEqual(failed['down@example.com']['result']['error'],
+                         'ServerError')
+
+
+class TestAsyncBadgrLite(BadgrLiteTestBase):
+    """Test AsyncBadgrLite"""
+
+    def run_async(self, coroutine_function, *args):
+        """Run coroutine_function(badgr, *args) with a fresh client"""
+
+        async def runner():
+            async with AsyncBadgrLite(
+                    token_filename=self.sample_token_file) as badgr:
+                return await coroutine_function(badgr, *args)
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(runner())
+        finally:
+            loop.close()
+
+    def test_badges_gives_list_of_badges(self):
+        """AsyncBadgrLite.badges() gives a list of Badge"""
+
+        with vcr.use_cassette('tests/vcr_cassettes/badge_retrieval.yaml'):
+            badges = self.run_async(lambda badgr: badgr.badges())
+        self.assertIsInstance(badges, list)
+        self.assertIsInstance(badges[0], Badge)
+
+    def test_badges_follows_pagination(self):
+        """AsyncBadgrLite.badges() lists badges over pages like BadgrLite"""
+
+        server = FakeBadgrServer(seed=1, badge_count=25, page_size=10).start()
+        self.addCleanup(server.stop)
+        server.write_token_file(self.sample_token_file)
+
+        async def badges():
+            async with AsyncBadgrLite(token_filename=self.sample_token_file,
+                                      base_url=server.base_url) as badgr:
+                return await badgr.badges()
+
+        loop = asyncio.new_event_loop()
+        try:
+            listed = loop.run_until_complete(badges())
+        finally:
+            loop.close()
+        self.assertEqual(len(listed), 25)
+        self.assertEqual(len({badge.entity_id for badge in listed}), 25)
+        self.assertEqual(server.stats, {200: 3})
+
+    def test_award_badge_gives_badge(self):
+        """AsyncBadgrLite.award_badge() returns a badge when successful"""
+
+        with vcr.use_cassette('tests/vcr_cassettes/award_badge.yaml'):
+            result = self.run_async(
+                lambda badgr: badgr.award_badge(
+                    '2TfNNqMLT8CoAhfGKqSv6Q',
+                    {"recipient": {"identity": "joe@example.com"}}))
+        self.assertIsInstance(result, Badge)
+
+    def test_award_badge_bad_badge_id(self):
+        """AsyncBadgrLite.award_badge() raises BadBadgeIdError"""
+
+        with vcr.use_cassette('tests/vcr_cassettes/award_bad_badge_id.yaml'):
+            with self.assertRaises(exceptions.BadBadgeIdError):
+                self.run_async(
+                    lambda badgr: badgr.award_badge('bad_badge_id', {}))
+
+    def test_refreshes_token_when_expired(self):
+        """AsyncBadgrLite refreshes the token when it is expired"""
+
+        async def fetch(badgr):
+            badgr.load_token()
+            original_token = badgr.prepare_headers()['Authorization']
+            await badgr.get_from_server(self._sample_url)
+            return original_token, badgr.prepare_headers()['Authorization']
+
+        with vcr.use_cassette('tests/vcr_cassettes/expired_auth_token.yaml'):
+            original_token, new_token = self.run_async(fetch)
+        self.assertNotEqual(original_token, new_token)
+
+    def test_raises_token_expired_when_applicable(self):
+        """AsyncBadgrLite raises TokenExpired when applicable"""
+
+        async def fetch(badgr):
+            badgr.load_token()
+            await badgr.get_from_server(self._sample_url)
+
+        with vcr.use_cassette('tests/vcr_cassettes/no_valid_auth_token.yaml'):
+            with self.assertRaises(exceptions.TokenAndRefreshExpiredError):
+                self.run_async(fetch)
+
+    def test_failed_refresh_raises_server_error(self):
+        """AsyncBadgrLite raises ServerError if the refresh fails"""
+
+        async def refresh(badgr):
+            badgr.load_token()
+            badgr.session.post = unittest.mock.MagicMock()
+            badgr.session.post.return_value.__aenter__.return_value.status = \
+                503
+            await badgr.refresh_token()
+
+        with self.assertRaises(exceptions.ServerError):
+            self.run_async(refresh)
+
+    def test_token_file_io_is_off_the_event_loop(self):
+        """AsyncBadgrLite reads and writes the token file in a thread"""
+
+        threads = []
+        load_token, store_token = AsyncBadgrLite.load_token, \
+            AsyncBadgrLite._store_token  # pylint: disable=W0212
+
+        def record(method):
+            def recorded(*args):
+                threads.append(threading.current_thread())
+                return method(*args)
+            return recorded
+
+        with unittest.mock.patch.object(
+                AsyncBadgrLite, 'load_token', record(load_token)), \
+                unittest.mock.patch.object(
+                    AsyncBadgrLite, '_store_token', record(store_token)), \
+                vcr.use_cassette(
+                    'tests/vcr_cassettes/expired_auth_token.yaml'):
+            self.run_async(lambda badgr: badgr.badges())
+        self.assertGreaterEqual(len(threads), 3)
+        self.assertNotIn(threading.main_thread(), threads)
+
+
+class TestInterleaveBounded(unittest.TestCase):
+    """Test helpers.interleave_bounded"""
+
+    def test_yields_every_element(self):
+        """interleave_bounded() yields elements of every iterator"""
+
+        elements = interleave_bounded(
+            lambda item: iter(range(item * 10, item * 10 + 3)),
+            range(5), max_workers=3)
+        self.assertEqual(sorted(elements),
+                         [item * 10 + n for item in range(5)
+                          for n in range(3)])
+
+    def test_reraises_errors(self):
+        """interleave_bounded() re-raises errors from the iterators"""
+
+        def failing(item):
+            yield item
+            raise ValueError(item)
+
+        with self.assertRaises(ValueError):
+            list(interleave_bounded(failing, range(3), max_workers=2))
+
+    def test_buffer_is_bounded(self):
+        """interleave_bounded() keeps at most buffer_size elements waiting"""
+
+        produced = []
+
+        def endless(item):
+            for element in itertools.count():
+                produced.append(element)
+                yield element
+
+        elements = interleave_bounded(endless, range(2), max_workers=2,
+                                      buffer_size=5)
+        next(elements)
+        time.sleep(0.05)
+        # buffer plus one element held by each blocked worker
+        self.assertLessEqual(len(produced), 5 + 1 + 2)
+        elements.close()
+
+
+class TestFieldCodec(unittest.TestCase):
+    """Test helpers used for decoding API fields"""
+
+    def test_pythonic_translates_camel_case(self):
+        """pythonic() converts camelCase keys"""
+
+        self.assertEqual(helpers.pythonic('issuerOpenBadgeId'),
+                         'issuer_open_badge_id')
+        self.assertEqual(helpers.pythonic('entity_id'), 'entity_id')
+
+    def test_pythonic_is_memoized(self):
+        """pythonic() translates each key only once"""
+
+        helpers.pythonic('someCamelKey')
+        with unittest.mock.patch.object(helpers, '_CAMEL_WORD') as mock:
+            self.assertEqual(helpers.pythonic('someCamelKey'),
+                             'some_camel_key')
+        self.assertFalse(mock.sub.called)
+
+    def test_to_datetime_matches_strptime(self):
+        """to_datetime() parses both API timestamp shapes like strptime"""
+
+        for timestamp, datetime_format in [
+                ('2019-09-04T19:03:24Z', helpers.DATETIME_FORMAT),
+                ('2019-09-17T23:54:18.277836Z',
+                 helpers.DATETIME_MILLISECOND_FORMAT),
+                ('2019-09-17T23:54:18.2Z',
+                 helpers.DATETIME_MILLISECOND_FORMAT)]:
+            expected = datetime.datetime.strptime(
+                timestamp, datetime_format).replace(tzinfo=helpers.UTC)
+            self.assertEqual(helpers.to_datetime(timestamp), expected)
+            self.assertEqual(helpers.to_datetime(timestamp).tzinfo,
+                             helpers.UTC)
+
+    def test_to_datetime_rejects_other_shapes(self):
+        """to_datetime() raises ValueError for unknown timestamp shapes"""
+
+        for timestamp in ['2019-09-04 19:03:24', '2019-13-04T19:03:24Z',
+                          '2019-09-04T19:03:24.1234567Z']:
+            with self.assertRaises(ValueError):
+                helpers.to_datetime(timestamp)
+
+    def test_to_datetime_passes_through_non_strings(self):
+        """to_datetime() returns non-string values unchanged"""
+
+        self.assertIsNone(helpers.to_datetime(None))
+
+    def test_json_loads_decodes_bytes_and_str(self):
+        """json_loads() decodes both bytes and str"""
+
+        self.assertEqual(helpers.json_loads(b'{"a": [1]}'), {'a': [1]})
+        self.assertEqual(helpers.json_loads('{"a": [1]}'), {'a': [1]})
+
+
+class TestIterJsonItems(unittest.TestCase):
+    """Test helpers.iter_json_items"""
+
+    document = {
+        'status': {'success': True, 'description': 'no "result": [] here'},
+        'count': 12345,
+        'result': [{'n': number, 'name': 'Badge é€😀 ]},'}
+                   for number in range(20)] + [1.5e3, None, True, 'x', -7],
+        'next': None}
+
+    def test_decodes_items_split_anywhere(self):
+        """iter_json_items() yields the same items whatever the chunking"""
+
+        data = json.dumps(self.document, ensure_ascii=False).encode('utf8')
+        for size in (1, 2, 3, 7, 64, len(data)):
+            chunks = [data[start:start + size]
+                      for start in range(0, len(data), size)]
+            self.assertEqual(list(helpers.iter_json_items(chunks)),
+                             self.document['result'])
+
+    def test_missing_or_empty_array(self):
+        """iter_json_items() yields nothing without items"""
+
+        for data in (b'{}', b'{"status": 1}', b' { "result" : [ ] } '):
+            self.assertEqual(list(helpers.iter_json_items([data])), [])
+
+    def test_malformed_json(self):
+        """iter_json_items() raises ValueError on bad or truncated JSON"""
+
+        for data in (b'', b'[1]', b'{"result": [1 2]}',
+                     b'{"result": [{"a": 1}, {"b"'):
+            with self.assertRaises(ValueError):
+                list(helpers.iter_json_items([data]))
+
+    def test_memory_is_bounded_by_an_item(self):
+        """iter_json_items() holds about one item, not the document"""
+
+        record = json.dumps({'description': 'x' * 1000}).encode('utf8')
+        count = 5000
+
+        def chunks():
+            yield b'{"result": ['
+            for number in range(count):
+                yield record + (b',' if number < count - 1 else b']}')
+
+        tracemalloc.start()
+        try:
+            for _ in helpers.iter_json_items(chunks()):
+                pass
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, len(record) * count / 50)
+
+
+class TestImapBounded(unittest.TestCase):
+    """Test helpers.imap_bounded"""
+
+    def test_caps_items_in_flight(self):
+        """imap_bounded() never runs more than max_workers at once"""
+
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def work(item):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.01)
+            with lock:
+                state['running'] -= 1
+            return item * 2
+
+        results = dict(imap_bounded(work, range(20), max_workers=4))
+        self.assertEqual(results, {i: i * 2 for i in range(20)})
+        self.assertLessEqual(state['peak'], 4)
+
+    def test_consumes_items_lazily(self):
+        """imap_bounded() pulls items only as workers free up"""
+
+        pulled = []
+
+        def items():
+            for i in itertools.count():
+                pulled.append(i)
+                yield i
+
+        results = imap_bounded(lambda item: item, items(), max_workers=2)
+        next(results)
+        results.close()
+        self.assertLessEqual(len(pulled), 3)
+
 
 if __name__ == '__main__':
     unittest.main()